@@ -0,0 +1,59 @@
+"""Benchmarks the offline transaction analytics over a synthetic JSONL dump.
+
+    $ python benchmarks/bench_analytics.py [numRecords] [processes]
+"""
+
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from orders.analytics import analyse
+
+
+PAYMENT_METHODS = ['amazonpay', 'icicidebit', 'paytm', 'hdfccredit', 'upi']
+
+
+def writeDump(path, numRecords):
+    rand = random.Random(42)
+    startTime = 1530000000000
+    with open(path, 'w') as f:
+        for i in range(numRecords):
+            start = startTime + i * 10
+            fraud = rand.random() < 0.02
+            fraudCheck = rand.lognormvariate(3, 0.5)
+            if fraud:
+                timeline = [[11, 0.0], [12, fraudCheck], [13, fraudCheck], [15, fraudCheck + 2]]
+                status = 15
+            else:
+                pay = rand.lognormvariate(5, 0.7)
+                timeline = [[11, 0.0], [16, fraudCheck + 5], [18, fraudCheck + 5 + pay]]
+                status = 18
+            f.write(json.dumps({'Transaction': {
+                'transactionID': start, 'userID': start, 'order': {'cost': 12.5},
+                'paymentMethod': rand.choice(PAYMENT_METHODS), 'payment': {'amount': 12.5},
+                'status': status, 'fraudStatus': fraud, 'transactionStartTime': start,
+                'transactionEndTime': start + int(timeline[-1][1]) + 1, 'timeline': timeline
+            }}) + '\n')
+
+
+def main():
+    numRecords = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'transactions.jsonl')
+        writeDump(path, numRecords)
+        for groupBy in (('status', 'paymentMethod'), ('paymentMethod', 'bucket')):
+            start = time.perf_counter()
+            with open(path) as f:
+                report = analyse(f, groupBy, processes=processes)
+            seconds = time.perf_counter() - start
+            print('{:<28} {:>8.2f} s  {:>10.0f} records/s  groups: {}'.format(
+                ','.join(groupBy), seconds, numRecords / seconds, len(report)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Benchmarks the cpu cost against the bytes saved of compressing the transaction
+messages published to the message broker, for orders of a few to a few hundred
+items, with every algorithm at its fastest, default and smallest levels.
+
+    $ python benchmarks/bench_compression.py
+"""
+
+
+import json
+import random
+import timeit
+
+from orders.compression import CODECS, PayloadCodec
+
+
+PRODUCTS = ['pen', 'notebook', 'coffee beans', 'usb-c cable', 'desk lamp', 'headphones',
+    'water bottle', 'backpack', 'monitor stand', 'mechanical keyboard']
+
+
+def transactionMessage(numItems, rand):
+    items = [{
+        'name': '{} {}'.format(rand.choice(PRODUCTS), rand.randint(1, 500)),
+        'cost': round(rand.uniform(1, 200), 2),
+        'quantity': rand.randint(1, 5),
+        'discount': rand.choice([0.0, 0.05, 0.1])
+    } for _ in range(numItems)]
+    cost = round(sum(item['cost'] * item['quantity'] for item in items), 2)
+    return json.dumps({'message': {
+        'transactionID': rand.getrandbits(60),
+        'userID': rand.getrandbits(40),
+        'order': {'cost': cost, 'items': items},
+        'paymentMethod': rand.choice(['card', 'paytm', 'netbanking']),
+        'payment': {'card': str(rand.randint(10 ** 15, 10 ** 16 - 1)), 'amount': cost},
+        'status': 11,
+        'fraudStatus': False
+    }}).encode()
+
+
+def bench(algorithm, level, bodies, number=200):
+    codec = PayloadCodec(algorithm, level, threshold=0)
+    encoded = [codec.encode(body) for body in bodies]
+
+    def encode():
+        for body in bodies:
+            codec.encode(body)
+
+    def decode():
+        for body, encoding in encoded:
+            codec.decode(body, encoding)
+
+    encodeSeconds = min(timeit.repeat(encode, number=number, repeat=3)) / number / len(bodies)
+    decodeSeconds = min(timeit.repeat(decode, number=number, repeat=3)) / number / len(bodies)
+    ratio = sum(len(body) for body, _ in encoded) / sum(len(body) for body in bodies)
+    print('  {:<12} {:>6.3f} {:>12.1f} {:>12.1f}'.format(
+        '{}-{}'.format(algorithm, level), ratio, encodeSeconds * 1e6, decodeSeconds * 1e6))
+
+
+def main():
+    rand = random.Random(42)
+    for numItems in (1, 5, 20, 100, 500):
+        bodies = [transactionMessage(numItems, rand) for _ in range(20)]
+        meanSize = sum(len(body) for body in bodies) / len(bodies)
+        print('{} items, {:.0f} bytes'.format(numItems, meanSize))
+        print('  {:<12} {:>6} {:>12} {:>12}'.format('codec', 'ratio', 'encode us', 'decode us'))
+        number = max(1, int(20000 / meanSize))
+        for algorithm in CODECS:
+            levels = (0, 6, 9) if algorithm == 'xz' else (1, CODECS[algorithm][2], 9)
+            for level in sorted(set(levels)):
+                bench(algorithm, level, bodies, number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Benchmarks the store and findByID latency of the journal Repository.
+
+    $ python benchmarks/bench_journal.py [numTransactions]
+"""
+
+
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+
+from orders.domain.transaction import Transaction
+from orders.journal import JournalRepository
+
+
+async def bench(numTransactions, fsync):
+    with tempfile.TemporaryDirectory() as directory:
+        journal = JournalRepository(directory, segmentSize=16 * 1024 * 1024, fsync=fsync)
+        await journal.setup()
+        transactions = []
+        for i in range(numTransactions):
+            transaction = Transaction(
+                {'id': i, 'name': 'avengers 4 spoilers book', 'cost': 123.00, 'currency': 'INR'},
+                'amazonpay',
+                {'card': 1234567887654321, 'type': 'wallet', 'amount': 123.00, 'currency': 'INR'}
+            )
+            transaction.transactionID = i + 1
+            transactions.append(transaction)
+
+        start = time.perf_counter()
+        for transaction in transactions:
+            await journal.store(transaction)
+            # every transaction is stored twice, as pending and with its outcome
+            transaction.updateStatus(18)
+            await journal.store(transaction)
+        storeSeconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for transaction in transactions:
+            await journal.findByID(transaction.transactionID)
+        findSeconds = time.perf_counter() - start
+        await journal.close()
+
+        start = time.perf_counter()
+        journal = JournalRepository(directory, segmentSize=16 * 1024 * 1024)
+        await journal.setup()
+        recoverySeconds = time.perf_counter() - start
+        await journal.close()
+
+    print('fsync: {:<5} store {:>8.2f} us  findByID {:>8.2f} us  recovery {:>6.3f} s  ({} stores)'.format(
+        str(fsync), storeSeconds / numTransactions / 2 * 1e6, findSeconds / numTransactions * 1e6,
+        recoverySeconds, numTransactions * 2))
+
+
+def main():
+    numTransactions = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    logging.disable(logging.INFO)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(bench(numTransactions, fsync=False))
+    loop.run_until_complete(bench(numTransactions // 100, fsync=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""Benchmarks the cost of a rate limit check of the local and the shared memory
+token bucket limiters.
+
+    $ python benchmarks/bench_ratelimit.py
+"""
+
+
+import timeit
+
+from orders.ratelimit import SharedTokenBucketLimiter, TokenBucketLimiter
+
+
+def bench(name, limiter, numKeys, number=200000):
+    keys = ['api-key-{}'.format(i) for i in range(numKeys)]
+    counter = iter(range(10 ** 12))
+
+    def check():
+        limiter.allow(keys[next(counter) % numKeys])
+
+    seconds = min(timeit.repeat(check, number=number, repeat=5))
+    print('{:<36} {:>8.2f} us/check'.format(
+        '{} ({} keys)'.format(name, numKeys), seconds / number * 1e6))
+
+
+def main():
+    for numKeys in (1, 1000, 100000):
+        bench('local', TokenBucketLimiter(rate=1000, burst=1000, maxKeys=100000), numKeys)
+        bench('shared', SharedTokenBucketLimiter(rate=1000, burst=1000, slots=262144), numKeys)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Benchmarks the shared memory cache against a dict per worker: the cost of a get
+and a set, and the hit rate of a skewed (zipf like) key stream spread round robin
+over the workers, which a dict per worker only hits once every worker has seen the
+key. Then forks the workers for real to measure the throughput of the shared cache
+under concurrent readers and writers.
+
+    $ python benchmarks/bench_sharedcache.py
+"""
+
+
+import multiprocessing
+import random
+import time
+import timeit
+
+from orders.sharedcache import SharedMemoryCache
+
+
+VALUE = b'x' * 200
+
+
+def zipfKeys(numKeys, count, rand, skew=1.1):
+    weights = [1.0 / (rank ** skew) for rank in range(1, numKeys + 1)]
+    return rand.choices(range(numKeys), weights=weights, k=count)
+
+
+def benchOps(number=200000):
+    cache = SharedMemoryCache(slots=262144, maxValueSize=256)
+    local = {}
+    keys = list(range(100000))
+    for key in keys:
+        cache.set(key, VALUE, 3600)
+        local[key] = VALUE
+    counter = iter(range(10 ** 12))
+
+    def localGet():
+        local.get(keys[next(counter) % 100000])
+
+    def sharedGet():
+        cache.get(keys[next(counter) % 100000])
+
+    def sharedSet():
+        cache.set(keys[next(counter) % 100000], VALUE, 3600)
+
+    for name, func in (('dict get', localGet), ('shared get', sharedGet), ('shared set', sharedSet)):
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print('{:<28} {:>8.2f} us/op'.format(name, seconds / number * 1e6))
+
+
+def benchHitRate(workers, numKeys=200000, requests=400000, capacity=50000):
+    """Every worker caches up to ``capacity`` keys in its dict, the shared cache
+    holds ``capacity`` keys in total for all of them, i.e. the same memory as one
+    worker's dict.
+    """
+
+    rand = random.Random(7)
+    stream = zipfKeys(numKeys, requests, rand)
+    dicts = [dict() for _ in range(workers)]
+    cache = SharedMemoryCache(slots=capacity, maxValueSize=256)
+    dictHits = sharedHits = 0
+    for i, key in enumerate(stream):
+        local = dicts[i % workers]
+        if key in local:
+            dictHits += 1
+        else:
+            if len(local) >= capacity:
+                # evict the oldest insert, roughly what a bounded cache would do
+                del local[next(iter(local))]
+            local[key] = VALUE
+        if cache.get(key) is not None:
+            sharedHits += 1
+        else:
+            cache.set(key, VALUE, 3600)
+    print('{} workers: dict per worker hit rate {:.3f} ({} entries), shared hit rate {:.3f} ({} slots)'.format(
+        workers, dictHits / requests, sum(len(local) for local in dicts), sharedHits / requests, capacity))
+
+
+def _worker(cache, seconds, writeRatio, results):
+    rand = random.Random()
+    keys = zipfKeys(100000, 50000, rand)
+    ops = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for key in keys[:1000]:
+            if rand.random() < writeRatio:
+                cache.set(key, VALUE, 3600)
+            elif cache.get(key) is None:
+                cache.set(key, VALUE, 3600)
+        ops += 1000
+        keys = keys[1000:] + keys[:1000]
+    results.put((ops, cache.stats()['contendedReads']))
+
+
+def benchConcurrent(workers, writeRatio, seconds=2):
+    cache = SharedMemoryCache(slots=131072, maxValueSize=256)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_worker, args=(cache, seconds, writeRatio, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    print('{} workers, {:.0%} writes: {:>9.0f} ops/s, {} contended reads'.format(
+        workers, writeRatio, sum(ops for ops, _ in outcomes) / seconds,
+        sum(contended for _, contended in outcomes)))
+
+
+def main():
+    benchOps()
+    for workers in (1, 2, 4, 8):
+        benchHitRate(workers)
+    for workers in (1, 4):
+        for writeRatio in (0.01, 0.2):
+            benchConcurrent(workers, writeRatio)
+
+
+if __name__ == '__main__':
+    multiprocessing.set_start_method('fork')
+    main()
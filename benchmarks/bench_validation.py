@@ -0,0 +1,47 @@
+"""Benchmarks the cost of validating a transaction request body against the
+precompiled TRANSACTION_REQUEST_SCHEMA.
+
+    $ python benchmarks/bench_validation.py
+"""
+
+
+import timeit
+
+from orders.usecases.transact import validateTransactionRequest
+
+
+VALID_REQUEST = {
+    'order': {'id': 1234, 'name': 'avengers 4 spoilers book', 'cost': 123.00, 'currency': 'INR'},
+    'paymentMethod': 'amazonpay',
+    'payment': {'card': 1234567887654321, 'type': 'wallet', 'amount': 123.00, 'currency': 'INR'}
+}
+
+VALID_REQUEST_WITH_ITEMS = {
+    'order': {
+        'id': 5678, 'name': 'bahubali vs avengers saga', 'cost': 13.00, 'currency': 'USD',
+        'items': [{'name': 'item-{}'.format(i), 'cost': 1.3, 'quantity': 1} for i in range(10)]
+    },
+    'paymentMethod': 'icicidebit',
+    'payment': {'card': 8765432112345678, 'type': 'debit', 'amount': 13.00, 'currency': 'USD'}
+}
+
+INVALID_REQUEST = {
+    'order': {'id': 1234, 'cost': -1, 'currency': 'rupees'},
+    'paymentMethod': '',
+    'payment': {'card': True, 'currency': 'INR'}
+}
+
+NOT_AN_OBJECT = ['order', 'paymentMethod', 'payment']
+
+
+def bench(name, body, number=100000):
+    seconds = min(timeit.repeat(lambda: validateTransactionRequest(body), number=number, repeat=5))
+    print('{:<28} {:>8.2f} us/request  errors: {}'.format(
+        name, seconds / number * 1e6, len(validateTransactionRequest(body))))
+
+
+if __name__ == '__main__':
+    bench('valid', VALID_REQUEST)
+    bench('valid with 10 items', VALID_REQUEST_WITH_ITEMS)
+    bench('invalid', INVALID_REQUEST)
+    bench('not an object', NOT_AN_OBJECT)
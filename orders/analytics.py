@@ -0,0 +1,297 @@
+"""The analytics module aggregates large JSONL dumps of ``Transaction.toDict()`` records
+(repository exports, logs, etc) offline, without grepping logs.
+
+The records are read in chunks of ``chunkSize`` lines, every chunk is parsed into
+columnar NumPy arrays (start time, status, fraud status, payment method, latencies)
+and reduced right away to per group partial aggregates, hence the memory used is
+bounded by the chunk size and the number of groups, not by the size of the dump.
+Chunks can be parsed and reduced in parallel processes, since parsing the json is
+the bulk of the work.
+
+The groups are any combination of the status, the payment method and a time bucket
+of the transaction start time. For every group the counts, fraud and success rates
+and the percentiles of the transaction and payment latencies are reported, the
+latencies are kept as log spaced histograms, so the percentiles are exact to within
+``LATENCY_BIN_ERROR`` (about 2.3%).
+
+    $ python -m orders.analytics transactions.jsonl --group-by paymentMethod,bucket \\
+        --bucket-seconds 3600 --processes 4
+
+NumPy is an optional dependency, ``pip install orders[analytics]``.
+"""
+
+
+import argparse
+import itertools
+import json
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from ujson import loads as jsonLoads
+except ImportError:
+    jsonLoads = json.loads
+
+from orders.domain.transaction import (
+    TransactionStatus, TRANSACTION_PAYMENT_INITIATED, TRANSACTION_PAYMENT_ERROR,
+    TRANSACTION_PAYMENT_COMPLETE
+)
+
+
+GROUP_BY_FIELDS = ('status', 'paymentMethod', 'bucket')
+
+# log spaced latency histogram bins from 10us to ~3h, each bin is 2.3% wider than the previous
+LATENCY_BIN_ERROR = 10 ** (9 / 900) - 1
+_LATENCY_EDGES_MS = None
+
+# counters kept per group
+_COUNT, _FRAUDULENT, _COMPLETED = range(3)
+
+
+def _requireNumpy():
+    global _LATENCY_EDGES_MS
+    if np is None:
+        raise RuntimeError("orders.analytics requires numpy, install it with `pip install numpy`")
+    if _LATENCY_EDGES_MS is None:
+        _LATENCY_EDGES_MS = np.geomspace(0.01, 1e7, 901)
+
+
+class GroupAggregate(object):
+    """The counters and latency histograms of one group, partial aggregates of
+    the same group (of different chunks) are merged by adding them up.
+    """
+
+    __slots__ = ('counts', 'latency', 'paymentLatency')
+
+    def __init__(self, counts, latency, paymentLatency):
+        self.counts = counts
+        self.latency = latency
+        self.paymentLatency = paymentLatency
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.latency += other.latency
+        self.paymentLatency += other.paymentLatency
+
+    def toDict(self, percentiles):
+        count = int(self.counts[_COUNT])
+        return OrderedDict([
+            ('count', count),
+            ('fraudRate', round(float(self.counts[_FRAUDULENT]) / count, 6)),
+            ('successRate', round(float(self.counts[_COMPLETED]) / count, 6)),
+            ('latencyMs', _histogramPercentiles(self.latency, percentiles)),
+            ('paymentLatencyMs', _histogramPercentiles(self.paymentLatency, percentiles))
+        ])
+
+
+def _histogramPercentiles(histogram, percentiles):
+    """Returns the upper edge of the bin each percentile falls in, None when the
+    histogram is empty.
+    """
+
+    total = histogram.sum()
+    result = OrderedDict()
+    if total == 0:
+        return None
+    cumulative = np.cumsum(histogram)
+    for p in percentiles:
+        index = int(np.searchsorted(cumulative, total * p / 100.0))
+        result['p{:g}'.format(p)] = round(float(_LATENCY_EDGES_MS[min(index, len(_LATENCY_EDGES_MS) - 1)]), 3)
+    return result
+
+
+def parseChunk(lines):
+    """Parses the json lines of one chunk into a dict of columns, the lines which
+    are not json transactions (blank ones included) are skipped.
+    """
+
+    _requireNumpy()
+    rows = []
+    append = rows.append
+    nan = np.nan
+    for line in lines:
+        try:
+            record = jsonLoads(line)
+        except ValueError:
+            continue
+        transaction = record.get('Transaction', record) if isinstance(record, dict) else None
+        if not isinstance(transaction, dict) or 'transactionStartTime' not in transaction:
+            continue
+        endTime = transaction.get('transactionEndTime')
+        append((
+            transaction['transactionStartTime'],
+            nan if endTime is None else endTime,
+            transaction.get('status', 0),
+            bool(transaction.get('fraudStatus')),
+            str(transaction.get('paymentMethod')),
+            _paymentLatency(transaction.get('timeline'))
+        ))
+
+    startTimes, endTimes, statuses, fraudStatuses, paymentMethods, paymentLatencies = (
+        zip(*rows) if rows else ((),) * 6)
+    startTimes = np.array(startTimes, dtype=np.int64)
+    return {
+        'startTime': startTimes,
+        'latency': np.array(endTimes, dtype=np.float64) - startTimes,
+        'status': np.array(statuses, dtype=np.int64),
+        'fraudStatus': np.array(fraudStatuses, dtype=bool),
+        'paymentMethod': np.array(paymentMethods, dtype=str),
+        'paymentLatency': np.array(paymentLatencies, dtype=np.float64)
+    }
+
+
+def _paymentLatency(timeline):
+    """Returns the ms between the payment being initiated and it completing or
+    failing, NaN if the timeline does not have both of them.
+    """
+
+    initiatedAt = np.nan
+    for status, ms in timeline or ():
+        if status == TRANSACTION_PAYMENT_INITIATED:
+            initiatedAt = ms
+        elif status in (TRANSACTION_PAYMENT_COMPLETE, TRANSACTION_PAYMENT_ERROR):
+            return ms - initiatedAt
+    return np.nan
+
+
+def aggregateColumns(columns, groupBy=GROUP_BY_FIELDS, bucketSeconds=3600):
+    """Reduces the columns of one chunk to a dict of group key -> GroupAggregate,
+    the group key is a tuple with a value for every field in groupBy.
+    """
+
+    _requireNumpy()
+    numRecords = len(columns['startTime'])
+    if numRecords == 0:
+        return {}
+
+    # encode every group by field as integer codes, to find the groups with a single np.unique
+    keyColumns, decoders = [], []
+    for field in groupBy:
+        if field == 'status':
+            keyColumns.append(columns['status'])
+            decoders.append(lambda code: TransactionStatus.get(int(code), int(code)))
+        elif field == 'paymentMethod':
+            names, codes = np.unique(columns['paymentMethod'], return_inverse=True)
+            keyColumns.append(codes.reshape(-1))
+            decoders.append(lambda code, names=names: str(names[code]))
+        elif field == 'bucket':
+            bucketMs = int(bucketSeconds * 1000)
+            keyColumns.append(columns['startTime'] // bucketMs * int(bucketSeconds))
+            decoders.append(int)
+        else:
+            raise ValueError("Unknown group by field: {}".format(field))
+
+    if keyColumns:
+        uniqueKeys, groupIDs = np.unique(np.stack(keyColumns, axis=1), axis=0, return_inverse=True)
+        groupIDs = groupIDs.reshape(-1)
+    else:
+        uniqueKeys, groupIDs = np.zeros((1, 0), dtype=np.int64), np.zeros(numRecords, dtype=np.int64)
+    numGroups = len(uniqueKeys)
+
+    counts = np.stack([
+        np.bincount(groupIDs, minlength=numGroups),
+        np.bincount(groupIDs, weights=columns['fraudStatus'], minlength=numGroups),
+        np.bincount(groupIDs, weights=columns['status'] == TRANSACTION_PAYMENT_COMPLETE, minlength=numGroups)
+    ], axis=1).astype(np.int64)
+    latency = _groupHistograms(groupIDs, columns['latency'], numGroups)
+    paymentLatency = _groupHistograms(groupIDs, columns['paymentLatency'], numGroups)
+
+    return {
+        tuple(decode(code) for decode, code in zip(decoders, key)):
+            GroupAggregate(counts[i], latency[i], paymentLatency[i])
+        for i, key in enumerate(uniqueKeys)
+    }
+
+
+def _groupHistograms(groupIDs, values, numGroups):
+    numBins = len(_LATENCY_EDGES_MS) + 1
+    known = ~np.isnan(values)
+    bins = np.searchsorted(_LATENCY_EDGES_MS, values[known])
+    return np.bincount(
+        groupIDs[known] * numBins + bins, minlength=numGroups * numBins
+    ).reshape(numGroups, numBins)
+
+
+def _aggregateLines(args):
+    lines, groupBy, bucketSeconds = args
+    return aggregateColumns(parseChunk(lines), groupBy, bucketSeconds)
+
+
+def _chunks(lines, chunkSize):
+    while True:
+        chunk = list(itertools.islice(lines, chunkSize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def analyse(lines, groupBy=GROUP_BY_FIELDS, bucketSeconds=3600, chunkSize=100000,
+        processes=1, percentiles=(50, 90, 99)):
+    """Aggregates the transaction json lines and returns the report, a list of
+    one dict per group sorted by the group key.
+    """
+
+    _requireNumpy()
+    groupBy = tuple(groupBy)
+    jobs = ((chunk, groupBy, bucketSeconds) for chunk in _chunks(iter(lines), chunkSize))
+    groups = {}
+
+    def merge(partials):
+        for key, aggregate in partials.items():
+            if key in groups:
+                groups[key].merge(aggregate)
+            else:
+                groups[key] = aggregate
+
+    if processes > 1:
+        from multiprocessing import Pool
+        with Pool(processes) as pool:
+            for partials in pool.imap_unordered(_aggregateLines, jobs):
+                merge(partials)
+    else:
+        for job in jobs:
+            merge(_aggregateLines(job))
+
+    report = []
+    for key in sorted(groups, key=lambda key: tuple(str(value) for value in key)):
+        row = OrderedDict(zip(groupBy, key))
+        row.update(groups[key].toDict(percentiles))
+        report.append(row)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregates JSONL dumps of transactions')
+    parser.add_argument('path', help="jsonl file of Transaction.toDict() records, '-' for stdin")
+    parser.add_argument('--group-by', default='status,paymentMethod',
+        help='comma separated fields out of {}'.format(', '.join(GROUP_BY_FIELDS)))
+    parser.add_argument('--bucket-seconds', type=int, default=3600)
+    parser.add_argument('--chunk-size', type=int, default=100000, help='lines parsed per chunk')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--percentiles', default='50,90,99')
+    args = parser.parse_args()
+
+    groupBy = [field for field in args.group_by.split(',') if field]
+    percentiles = [float(p) for p in args.percentiles.split(',')]
+    start = time.perf_counter()
+    if args.path == '-':
+        report = analyse(sys.stdin, groupBy, args.bucket_seconds, args.chunk_size,
+            args.processes, percentiles)
+    else:
+        with open(args.path) as f:
+            report = analyse(f, groupBy, args.bucket_seconds, args.chunk_size,
+                args.processes, percentiles)
+    print(json.dumps({
+        'groups': report,
+        'wallSeconds': round(time.perf_counter() - start, 3)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
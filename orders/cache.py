@@ -0,0 +1,130 @@
+"""The cache module consists of a CachingRepository, a read through cache which can
+decorate any Repository, so that status checks and the reconciliation of recent
+transactions do not hammer the database.
+
+Found objects are kept for ``ttl`` seconds and misses (None) for ``negativeTtl``
+seconds, the least recently used entries are evicted beyond ``maxSize``. Stores are
+written through, hence the cache is never stale for the writes of this worker
+(writes by other workers become visible when the entry expires). Concurrent misses
+for the same ID are coalesced into a single read of the backing repository, and a
+read which a store (or an invalidation) of the same ID overtook is returned but not
+cached.
+"""
+
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+from orders.domain.order import Repository
+
+
+log = getCustomLogger(__name__)
+
+
+class CachingRepository(Repository):
+    """A Repository which caches the ``findByID`` results of the wrapped one.
+
+    NOTE: the cached objects are shared by all the callers, they must not be
+    mutated.
+    """
+
+    def __init__(self, repository, maxSize=10000, ttl=60, negativeTtl=5):
+        self._repository = repository
+        self._maxSize = maxSize
+        self._ttl = ttl
+        self._negativeTtl = negativeTtl
+        # uID -> (expiresAt, object), ordered from the least to the most recently used
+        self._entries = OrderedDict()
+        self._inFlight = {}
+        # the IDs stored or invalidated while being read
+        self._superseded = set()
+        self._hits = 0
+        self._negativeHits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    async def setup(self):
+        await self._repository.setup()
+
+    async def close(self):
+        await self._repository.close()
+
+    async def findByID(self, uID):
+        entry = self._entries.get(uID)
+        if entry is not None:
+            expiresAt, obj = entry
+            if expiresAt > time.monotonic():
+                self._entries.move_to_end(uID)
+                if obj is None:
+                    self._negativeHits += 1
+                else:
+                    self._hits += 1
+                return obj
+            del self._entries[uID]
+
+        task = self._inFlight.get(uID)
+        if task is not None:
+            self._coalesced += 1
+            return await asyncio.shield(task)
+
+        self._misses += 1
+        task = asyncio.ensure_future(self._read(uID))
+        self._inFlight[uID] = task
+        return await asyncio.shield(task)
+
+    async def store(self, domainObject):
+        storedObject = await self._repository.store(domainObject)
+        self._supersede(storedObject.transactionID)
+        # cache what a findByID would return, the stored form of the object
+        record = storedObject.toDict()
+        self._set(storedObject.transactionID, record.get('Transaction', record), self._ttl)
+        return storedObject
+
+    def invalidate(self, uID):
+        self._supersede(uID)
+        self._entries.pop(uID, None)
+
+    def stats(self):
+        lookups = self._hits + self._negativeHits + self._misses + self._coalesced
+        return OrderedDict([
+            ('size', len(self._entries)),
+            ('hits', self._hits),
+            ('negativeHits', self._negativeHits),
+            ('misses', self._misses),
+            ('coalesced', self._coalesced),
+            ('evictions', self._evictions),
+            ('hitRate', round((self._hits + self._negativeHits) / lookups, 4) if lookups else None)
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _read(self, uID):
+        try:
+            obj = await self._repository.findByID(uID)
+            # a store done while reading is fresher than what was read, even once
+            # it has been evicted again
+            if uID not in self._superseded:
+                self._set(uID, obj, self._ttl if obj is not None else self._negativeTtl)
+            return obj
+        finally:
+            self._inFlight.pop(uID, None)
+            self._superseded.discard(uID)
+
+    def _supersede(self, uID):
+        if uID in self._inFlight:
+            self._superseded.add(uID)
+
+    def _set(self, uID, obj, ttl):
+        if ttl <= 0:
+            self._entries.pop(uID, None)
+            return
+        self._entries[uID] = (time.monotonic() + ttl, obj)
+        self._entries.move_to_end(uID)
+        while len(self._entries) > self._maxSize:
+            self._entries.popitem(last=False)
+            self._evictions += 1
@@ -0,0 +1,135 @@
+"""The compression module compresses the message bodies published to the message
+broker, which otherwise carry the full order and payment payloads as plain json
+and cost broker memory, disk (the messages are persistent) and network.
+
+A PayloadCodec compresses the bodies of at least ``threshold`` bytes with one of the
+stdlib algorithms below, named by the content encoding the message is published
+with, and decompresses the consumed bodies by their content encoding. Bodies which
+do not shrink are sent as they are, without a content encoding, so the consumers
+of small or incompressible messages pay nothing. A consumed body is decompressed up
+to ``maxSize`` bytes, one decompressing to more (a decompression bomb) is refused
+with PayloadTooLarge without being decompressed any further.
+
+    =========== ============ =================
+    encoding    module       levels
+    =========== ============ =================
+    gzip        zlib (gzip)  1 (fast) - 9
+    deflate     zlib         1 (fast) - 9
+    bzip2       bz2          1 (fast) - 9
+    xz          lzma         0 (fast) - 9
+    =========== ============ =================
+"""
+
+
+import bz2
+import lzma
+import zlib
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+
+
+log = getCustomLogger(__name__)
+
+
+class UnsupportedEncoding(Exception):
+    pass
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+def _gzipCompress(body, level):
+    # wbits of 16 + 15 writes the gzip header and trailer, and is way faster for
+    # small bodies than gzip.compress
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+# encoding -> (compress(body, level), decompressor(), default level), the decompressors
+# all take the max length of their output
+CODECS = {
+    'gzip': (_gzipCompress, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), 6),
+    'deflate': (zlib.compress, zlib.decompressobj, 6),
+    'bzip2': (lambda body, level: bz2.compress(body, level), bz2.BZ2Decompressor, 9),
+    'xz': (lambda body, level: lzma.compress(body, preset=level), lzma.LZMADecompressor, 6)
+}
+
+
+class PayloadCodec(object):
+    """Compresses the bodies of at least ``threshold`` bytes with ``algorithm``
+    (one of the CODECS, None to never compress) at ``level`` (the default level
+    of the algorithm if None), and decompresses the bodies of any of the CODECS up
+    to ``maxSize`` bytes.
+    """
+
+    def __init__(self, algorithm=None, level=None, threshold=1024, maxSize=1024 * 1024):
+        if algorithm and algorithm not in CODECS:
+            raise UnsupportedEncoding("Unsupported compression algorithm: {}".format(algorithm))
+        self._algorithm = algorithm or None
+        self._level = CODECS[algorithm][2] if algorithm and level is None else level
+        self._threshold = threshold
+        self._maxSize = maxSize
+        self._compressed = 0
+        self._uncompressed = 0
+        self._bytesIn = 0
+        self._bytesOut = 0
+        self._decompressed = 0
+        self._tooLarge = 0
+
+    @property
+    def algorithm(self):
+        return self._algorithm
+
+    def encode(self, body):
+        """Returns the (body, content encoding) to publish, the encoding is None
+        if the body is not compressed.
+        """
+
+        if self._algorithm is None or len(body) < self._threshold:
+            self._uncompressed += 1
+            return body, None
+        compressed = CODECS[self._algorithm][0](body, self._level)
+        if len(compressed) >= len(body):
+            self._uncompressed += 1
+            return body, None
+        self._compressed += 1
+        self._bytesIn += len(body)
+        self._bytesOut += len(compressed)
+        return compressed, self._algorithm
+
+    def decode(self, body, encoding):
+        """Returns the body of a message consumed with the content encoding, a
+        body without an encoding (or the ``identity`` one) is returned as is.
+        Raises PayloadTooLarge if it decompresses to more than ``maxSize`` bytes.
+        """
+
+        if not encoding or encoding == 'identity':
+            return body
+        codec = CODECS.get(encoding.lower())
+        if codec is None:
+            raise UnsupportedEncoding("Unsupported content encoding: {}".format(encoding))
+        decompressor = codec[1]()
+        # one byte over the max is enough to tell, the rest is never decompressed
+        decompressed = decompressor.decompress(body, self._maxSize + 1)
+        if len(decompressed) > self._maxSize:
+            self._tooLarge += 1
+            raise PayloadTooLarge("Body decompresses to more than {} bytes".format(self._maxSize))
+        if not decompressor.eof:
+            raise ValueError("Truncated {} body".format(encoding))
+        self._decompressed += 1
+        return decompressed
+
+    def stats(self):
+        return OrderedDict([
+            ('algorithm', self._algorithm),
+            ('level', self._level),
+            ('threshold', self._threshold),
+            ('compressed', self._compressed),
+            ('uncompressed', self._uncompressed),
+            ('ratio', round(self._bytesOut / self._bytesIn, 3) if self._bytesIn else None),
+            ('bytesSaved', self._bytesIn - self._bytesOut),
+            ('decompressed', self._decompressed),
+            ('tooLarge', self._tooLarge)
+        ])
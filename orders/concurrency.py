@@ -0,0 +1,241 @@
+"""The concurrency module puts an adaptive limit on the calls in flight to each of
+the dependencies (the fraud checker, the alert gateway, the repository and every
+payment provider), so that the service neither wastes the capacity of a healthy
+dependency nor piles onto a slow one.
+
+An AdaptiveConcurrencyLimiter measures the latency of every call and adjusts the
+limit once per window of samples, a window being the larger of ``minWindow`` and
+the limit, i.e. roughly one round trip of the whole limit. The latency of a window
+is its ``percentile`` latency, which a single slow call does not move, and it is
+compared with the baseline, the latency of the dependency without queueing,
+estimated as the moving average of the window latencies smoothed by
+``baselineSmoothing`` so that it follows the dependency when it moves to slower
+hardware, a farther region, etc. A window latency well above the baseline means
+requests are queueing up at the dependency, and the limit is adjusted by one of
+two algorithms:
+
+- ``aimd`` adds one to the limit for every window the limit was in use and cuts it
+  by ``backoffRatio`` for a window slower than ``tolerance`` times the baseline.
+- ``gradient`` moves the limit towards ``limit * gradient + sqrt(limit)``, where the
+  gradient is ``tolerance * baseline / latency`` capped to [0.5, 1], hence it
+  shrinks in proportion to the queueing and grows by a queue allowance of
+  ``sqrt(limit)`` otherwise, smoothed by ``smoothing``.
+
+Calls failing with a timeout or a connection error cut the limit in both, but the
+limit is cut at most once per window, whatever the reason. Calls beyond the limit
+wait in a FIFO queue of at most ``maxQueue`` calls, beyond which they are rejected
+with LimitExceeded right away.
+"""
+
+
+import asyncio
+import math
+import time
+from collections import deque, OrderedDict
+
+from orders.log import getCustomLogger
+from orders.gateway import TransportGateway
+from orders.domain.order import Repository
+from orders.domain.payment import PaymentProcessor
+
+
+log = getCustomLogger(__name__)
+
+
+class LimitExceeded(Exception):
+    pass
+
+
+class AdaptiveConcurrencyLimiter(object):
+
+    def __init__(self, name, algorithm='gradient', initialLimit=20, minLimit=1,
+            maxLimit=200, maxQueue=50, tolerance=2.0, backoffRatio=0.9, smoothing=0.2,
+            minWindow=20, percentile=0.9, baselineSmoothing=0.1,
+            dropErrors=(asyncio.TimeoutError, ConnectionError)):
+        if algorithm not in ('aimd', 'gradient'):
+            raise ValueError("Unknown concurrency limit algorithm: {}".format(algorithm))
+        self._name = name
+        self._algorithm = algorithm
+        self._limit = float(initialLimit)
+        self._minLimit = minLimit
+        self._maxLimit = maxLimit
+        self._maxQueue = maxQueue
+        self._tolerance = tolerance
+        self._backoffRatio = backoffRatio
+        self._smoothing = smoothing
+        self._minWindow = minWindow
+        self._percentile = percentile
+        self._baselineSmoothing = baselineSmoothing
+        self._dropErrors = tuple(dropErrors)
+        self._inFlight = 0
+        self._waiters = deque()
+        # the latencies of the current window, the highest in flight count seen
+        # in it and whether the limit was cut in it already
+        self._window = []
+        self._windowInFlight = 0
+        self._windowCut = False
+        self._baseline = None
+        self._latency = None
+        self._windows = 0
+        self._calls = 0
+        self._queued = 0
+        self._rejected = 0
+        self._drops = 0
+
+    @property
+    def limit(self):
+        return max(1, int(self._limit))
+
+    async def call(self, func, *args, **kwargs):
+        await self._acquire()
+        inFlight = self._inFlight
+        startTime = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except self._dropErrors:
+            self._onDrop()
+            raise
+        else:
+            self._onSample(time.monotonic() - startTime, inFlight)
+            return result
+        finally:
+            self._release()
+
+    def stats(self):
+        return OrderedDict([
+            ('algorithm', self._algorithm),
+            ('limit', self.limit),
+            ('inFlight', self._inFlight),
+            ('waiting', len(self._waiters)),
+            ('baselineLatencyMs', round(self._baseline * 1000, 3) if self._baseline else None),
+            ('latencyMs', round(self._latency * 1000, 3) if self._latency else None),
+            ('calls', self._calls),
+            ('queued', self._queued),
+            ('rejected', self._rejected),
+            ('drops', self._drops),
+            ('windows', self._windows)
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _acquire(self):
+        self._calls += 1
+        if self._inFlight < self.limit and not self._waiters:
+            self._inFlight += 1
+            return
+        if len(self._waiters) >= self._maxQueue:
+            self._rejected += 1
+            raise LimitExceeded("Concurrency limit exceeded: {{ dependency: {}, limit: {}, waiting: {} }}".format(
+                self._name, self.limit, len(self._waiters)))
+
+        self._queued += 1
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # the slot is handed over by _release, already counted in flight
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def _release(self):
+        self._inFlight -= 1
+        self._wakeWaiters()
+
+    def _wakeWaiters(self):
+        while self._waiters and self._inFlight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._inFlight += 1
+                waiter.set_result(None)
+
+    def _onSample(self, latency, inFlight):
+        self._window.append(latency)
+        self._windowInFlight = max(self._windowInFlight, inFlight)
+        if len(self._window) < max(self._minWindow, self.limit):
+            return
+
+        window = sorted(self._window)
+        latency = window[min(len(window) - 1, int(len(window) * self._percentile))]
+        # the limit only grows when it is what holds the calls back
+        limitInUse = self._windowInFlight * 2 >= self._limit
+        cut = self._windowCut
+        self._window = []
+        self._windowInFlight = 0
+        self._windowCut = False
+        self._windows += 1
+        self._latency = latency
+        if self._baseline is None:
+            self._baseline = latency
+        baseline = self._baseline
+
+        if self._algorithm == 'aimd':
+            if latency > self._tolerance * baseline:
+                if not cut:
+                    self._limit *= self._backoffRatio
+            elif limitInUse:
+                self._limit += 1
+        else:
+            gradient = max(0.5, min(1.0, self._tolerance * baseline / max(latency, 1e-9)))
+            newLimit = self._limit * gradient + math.sqrt(self._limit)
+            if (newLimit < self._limit and not cut) or (newLimit >= self._limit and limitInUse):
+                self._limit = (1 - self._smoothing) * self._limit + self._smoothing * newLimit
+        self._limit = max(self._minLimit, min(self._maxLimit, self._limit))
+        self._baseline = (1 - self._baselineSmoothing) * baseline + self._baselineSmoothing * latency
+        self._wakeWaiters()
+
+    def _onDrop(self):
+        self._drops += 1
+        if self._windowCut:
+            return
+        self._windowCut = True
+        self._limit = max(self._minLimit, self._limit * self._backoffRatio)
+        log.debug("Concurrency limit cut on a failed call: {{ dependency: {}, limit: {} }}".format(
+            self._name, self.limit))
+
+
+class LimitedTransportGateway(TransportGateway):
+    """A TransportGateway which sends via the wrapped gateway under a concurrency limiter."""
+
+    def __init__(self, gateway, limiter):
+        self._gateway = gateway
+        self._limiter = limiter
+
+    async def send(self, msgToSend):
+        return await self._limiter.call(self._gateway.send, msgToSend)
+
+
+class LimitedRepository(Repository):
+    """A Repository which stores via the wrapped one under a concurrency limiter."""
+
+    def __init__(self, repository, limiter):
+        self._repository = repository
+        self._limiter = limiter
+
+    async def setup(self):
+        await self._repository.setup()
+
+    async def close(self):
+        await self._repository.close()
+
+    async def findByID(self, uID):
+        return await self._repository.findByID(uID)
+
+    async def store(self, domainObject):
+        return await self._limiter.call(self._repository.store, domainObject)
+
+
+class LimitedPaymentProcessor(PaymentProcessor):
+    """A PaymentProcessor which pays via the wrapped processor under a concurrency limiter."""
+
+    def __init__(self, paymentProcessor, limiter):
+        self._paymentProcessor = paymentProcessor
+        self._limiter = limiter
+
+    async def pay(self, payment):
+        return await self._limiter.call(self._paymentProcessor.pay, payment)
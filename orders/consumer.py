@@ -0,0 +1,166 @@
+"""The consumer module lets the service take transaction requests from a RabbitMQ
+queue instead of (or along with) the ``/transact`` api.
+
+Transaction requests queued on the broker are consumed with a bounded concurrency
+(tied to the channel's prefetch count), processed by the same TransactionProcessor
+usecase interactor the http api uses, and the result is published to a reply
+exchange. This lets the broker absorb traffic bursts and the processing consumers
+be scaled independently of the http tier.
+"""
+
+
+import asyncio
+import json
+
+from orders.log import getCustomLogger
+from orders.usecases.transact import TransactionRequest, validateTransactionRequest
+from orders.usecases.deadline import Deadline, DeadlineExceeded
+from orders.domain.transaction import TransactionStatus
+
+
+log = getCustomLogger(__name__)
+
+
+class InvalidTransactionMessage(Exception):
+    pass
+
+
+class TransactionConsumer(object):
+    """Consumes transaction request messages from a queue and processes them via
+    the transaction interactor.
+
+    A message is acked once its transaction has been processed (whatever the
+    outcome of the transaction itself, which is published as the reply), rejected
+    without requeue when it can never be processed (malformed message) and nacked
+    with requeue when processing blew up unexpectedly, unless it has already been
+    redelivered once, so that a poison message does not loop forever.
+    """
+
+    def __init__(self, rabbitMqClient, transInteractor, replyGateway, queue,
+            exchange, options=None, concurrency=None, timeout=None):
+        self._rabbitMqClient = rabbitMqClient
+        self._transInteractor = transInteractor
+        self._replyGateway = replyGateway
+        self._queue = queue
+        self._exchange = exchange
+        self._options = dict(options or {})
+        # never have more messages in flight than the broker is allowed to deliver
+        # unacked, so that set_qos is what bounds the work this consumer takes on
+        prefetch = int(self._options.setdefault('set_qos', concurrency or 10))
+        self._concurrency = min(concurrency or prefetch, prefetch)
+        self._semaphore = None
+        self._inFlight = set()
+        # the deadline of each transaction, counted from when it starts processing
+        self._timeout = timeout
+
+    async def start(self):
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        await self._rabbitMqClient.consume(
+            self._queue, self._exchange, self._onMessage, self._options
+        )
+        log.info("Consuming transactions: {{ queue: {}, exchange: {}, concurrency: {} }}".format(
+            self._queue, self._exchange, self._concurrency))
+
+    async def stop(self):
+        """Waits for the transactions being processed to finish."""
+
+        if self._inFlight:
+            log.info("Waiting for {} in flight transactions...".format(len(self._inFlight)))
+            await asyncio.wait(list(self._inFlight))
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _onMessage(self, message, body):
+        # plain callback so that it works with both the sync and async consume
+        # callbacks of the different aio-pika versions, body is the decoded one
+        task = asyncio.ensure_future(self._handleMessage(message, body))
+        self._inFlight.add(task)
+        task.add_done_callback(self._inFlight.discard)
+
+    async def _handleMessage(self, message, body):
+        async with self._semaphore:
+            if body is None:
+                # refused by the client, it decompresses beyond the max body size
+                await self._reply(message, {'message': 'Payload Too Large'})
+                await _settle(message.reject(requeue=False))
+                return
+            try:
+                transReq = self._parseTransactionRequest(body)
+            except InvalidTransactionMessage as exc:
+                log.info("Invalid Transaction Message Received: {{ body: {}, exc: {} }}".format(
+                    body, exc))
+                await self._reply(message, {'message': 'Bad Request'})
+                await _settle(message.reject(requeue=False))
+                return
+
+            try:
+                transaction = await self._transInteractor.process(transReq)
+            except DeadlineExceeded as exc:
+                log.info("Transaction Message abandoned: {{ correlationID: {}, exc: {} }}".format(
+                    message.correlation_id, exc))
+                await self._reply(message, {'message': 'Deadline Exceeded'})
+                await _settle(message.reject(requeue=False))
+                return
+            except Exception as exc:
+                requeue = not message.redelivered
+                log.error("TransactionProcessor.process raised exception for: {{ \
+                    correlationID: {}, requeue: {}, exc: {} }}".format(
+                        message.correlation_id, requeue, exc))
+                if requeue:
+                    await _settle(message.nack(requeue=True))
+                else:
+                    await self._reply(message, {'message': 'Something Bad Happened'})
+                    await _settle(message.reject(requeue=False))
+                return
+
+            await self._reply(message, self._createReplyMessage(transaction))
+            await _settle(message.ack())
+
+    async def _reply(self, message, replyMsg):
+        replyMsg['correlationID'] = message.correlation_id
+        try:
+            await self._replyGateway.send(replyMsg)
+        except Exception as exc:
+            # the transaction has been processed already, reprocessing it just to
+            # publish the reply again may charge the payment twice, so only log
+            log.error("Could not publish transaction reply: {{ reply: {}, exc: {} }}".format(
+                replyMsg, exc))
+
+    def _parseTransactionRequest(self, body):
+        try:
+            data = json.loads(body.decode() if isinstance(body, bytes) else body)
+        except ValueError as exc:
+            raise InvalidTransactionMessage("body is not valid json: {}".format(exc))
+        # messages published by AioPikaClient are wrapped in a message envelope
+        if isinstance(data, dict) and isinstance(data.get('message'), dict):
+            data = data['message']
+        errors = validateTransactionRequest(data)
+        if errors:
+            raise InvalidTransactionMessage(', '.join(errors))
+
+        return TransactionRequest(
+            order=data['order'],
+            paymentMethod=data['paymentMethod'],
+            payment=data['payment'],
+            deadline=Deadline(self._timeout) if self._timeout else None,
+            validated=True
+        )
+
+    def _createReplyMessage(self, transaction):
+        return {
+            'transactionID': transaction.transactionID,
+            'transactionStatus': {
+                'code': transaction.status,
+                'status': TransactionStatus[transaction.status],
+                'fraudStatus': transaction.fraudStatus
+            }
+        }
+
+
+async def _settle(result):
+    # ack/nack/reject are plain methods in older aio-pika versions and coroutines
+    # in the newer ones
+    if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+        await result
@@ -1,86 +1,274 @@
+import hashlib
+import hmac
+
 from sanic import response
 from sanic.exceptions import abort, ServerError, NotFound
 #from sanic.log import logger as log
 
+from orders import metrics, responses
 from orders.log import getCustomLogger
-from orders.usecases.transact import TransactionRequest
-from orders.domain.transaction import TRANSACTION_PAYMENT_COMPLETE, TransactionStatus
+from orders.usecases.transact import TransactionRequest, validateTransactionRequest
+from orders.usecases.deadline import Deadline, DeadlineExceeded
+from orders.partition import PartitionQueueFull
+from orders.idempotency import IdempotencyKeyReused
+from orders.domain.transaction import TRANSACTION_PAYMENT_COMPLETE
 
 
 log = getCustomLogger(__name__)
 
 
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# the client may ask for a shorter (never longer) deadline than the configured one
+REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+
+
 async def transactionHandler(req):
     # access the Sanic app isntance
     app = req.app
-    # parse request object to receive order, paymentMethod, and payment details
-    body = req.json
-    if not _isValidTransactionRequest(body):
-        log.info("Invalid Transaction Request Body Received: {{ body: {} }}".format(body))
-        # raise ServerError("Bad Request", status_code=400)
+    # the dependencies are set up in the background after the server starts
+    if not getattr(app, 'Ready', False):
+        return responses.serviceUnavailable()
+    # reject the clients and users over their rate limits before doing any work for them
+    rateLimiter = getattr(app, 'RateLimiter', None)
+    if rateLimiter is not None and not rateLimiter.allow(req):
+        return responses.tooManyRequests()
+    # requests carrying an idempotency key are processed only once per key, retries
+    # get the stored response back without going through the transaction again
+    idempotencyKey = req.headers.get(IDEMPOTENCY_KEY_HEADER)
+    guard = getattr(app, 'IdempotencyGuard', None)
+    if idempotencyKey and guard is not None:
+        if len(idempotencyKey) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return responses.badRequest()
+        return await _idempotentTransaction(guard, idempotencyKey, req)
+
+    resp, _ = await _handleTransaction(req)
+    return resp
+
+
+async def readinessHandler(req):
+    """Responds with 200 only once the worker has warmed up, i.e all of its
+    dependencies have been set up, along with the startup time breakdown.
+    """
+
+    app = req.app
+    report = getattr(app, 'StartupReport', None)
+    startup = report.toDict() if report else None
+    if not getattr(app, 'Ready', False):
         return response.json(
-            {'message': 'Bad Request'},
-            status=400
+            {'ready': False, 'startup': startup},
+            status=503
         )
+    return response.json({'ready': True, 'startup': startup})
 
-    resp, hasException = await _processTransaction(app, body)
-    if hasException:
-        return resp
-    return _getTransactionResponse(resp)
+
+async def metricsHandler(req):
+    """Responds with the runtime metrics registered by the components of
+    this worker.
+    """
+
+    return response.json(metrics.collect())
+
+
+async def velocityHandler(req, user):
+    """Responds with the number and the value of the transactions of the user
+    (the value at ``FRAUD_USER_KEY`` in the transactions, e.g. the card) within
+    the velocity window, to the admins only since the user is a card number.
+    """
+
+    _checkAdminToken(req)
+    store = getattr(req.app, 'VelocityStore', None)
+    if store is None:
+        raise NotFound("Velocity tracking is off")
+    # card numbers and the like are integers in the transaction requests
+    key = int(user) if user.isdigit() else user
+    count, amount = store.get(key)
+    return response.json({
+        'user': user,
+        'windowSeconds': store.windowSeconds,
+        'transactions': count,
+        'amount': amount
+    })
+
+
+async def faultsHandler(req):
+    """Responds with the fault profiles active in this worker and the faults
+    injected so far, ``DELETE`` clears all the profiles and stops the scenario.
+    """
+
+    faults = _getFaults(req)
+    if req.method == 'DELETE':
+        await faults.runScenario(None)
+        faults.clear()
+    return response.json(faults.toDict())
+
+
+async def faultHandler(req, dependency):
+    """``PUT`` activates the fault profile in the body for the dependency,
+    ``DELETE`` clears it. Only the dependencies wrapped at start up are known.
+    """
+
+    faults = _getFaults(req)
+    if dependency not in faults:
+        raise NotFound("Unknown dependency: {}".format(dependency))
+    try:
+        faults.activate(dependency, req.json if req.method == 'PUT' else None)
+    except (ValueError, KeyError, TypeError, AttributeError) as exc:
+        return responses.badRequest(['invalid fault profile: {}'.format(exc)])
+    return response.json(faults.toDict())
+
+
+async def faultScenarioHandler(req):
+    """``PUT`` runs the fault scenario in the body, replacing the running one,
+    ``DELETE`` stops it (the profiles it activated stay active).
+    """
+
+    faults = _getFaults(req)
+    try:
+        await faults.runScenario(req.json if req.method == 'PUT' else None)
+    except (ValueError, KeyError, TypeError, AttributeError) as exc:
+        return responses.badRequest(['invalid fault scenario: {}'.format(exc)])
+    return response.json(faults.toDict())
 
 
 #---------------------------------------#
 #           Private Methods             #
 #---------------------------------------#
 
-def _isValidTransactionRequest(body):
-    if 'order' not in body or 'paymentMethod' not in body or (
-            'payment' not in body):
-        return False
-    # for now just chekc for these keyword, for real app, further validator for
-    # values inside each of order, pyamentmethod, payment needs to be checked
-    # and santized.
-    return True
+def _checkAdminToken(req):
+    """Lets the request through only if it carries the ``ADMIN_TOKEN`` in the
+    ``X-Admin-Token`` header, the admin endpoints are not served without a token set.
+    """
+
+    token = req.app.config.get('ADMIN_TOKEN')
+    if not token:
+        raise NotFound("Admin endpoints are off")
+    if not hmac.compare_digest(req.headers.get('X-Admin-Token', '').encode(), token.encode()):
+        abort(403, "Invalid admin token")
+
+
+def _getFaults(req):
+    _checkAdminToken(req)
+    faults = getattr(req.app, 'Faults', None)
+    if faults is None:
+        raise NotFound("Fault injection is off")
+    return faults
 
 
-async def _processTransaction(app, body):
+async def _handleTransaction(req):
+    # parse request object to receive order, paymentMethod, and payment details
+    body = req.json
+    # validate the body against the precompiled request schema before building
+    # anything out of it
+    errors = validateTransactionRequest(body)
+    if errors:
+        log.info("Invalid Transaction Request Body Received: {{ body: {}, errors: {} }}".format(
+            body, errors))
+        # raise ServerError("Bad Request", status_code=400)
+        return responses.badRequest(errors), False
+
+    deadline = _getDeadline(req)
+    if deadline is None:
+        return responses.badRequest(
+            ['{} must be a positive number of milliseconds'.format(REQUEST_TIMEOUT_HEADER)]), False
+
+    resp, hasException = await _processTransaction(req.app, body, deadline)
+    if hasException:
+        return resp, False
+    # only responses of a fully processed transaction are safe to be replayed
+    return _getTransactionResponse(resp), True
+
+
+async def _idempotentTransaction(guard, idempotencyKey, req):
+    async def process():
+        resp, cacheable = await _handleTransaction(req)
+        storedResp = {
+            'status': resp.status,
+            'body': resp.body,
+            'contentType': resp.content_type
+        }
+        return storedResp, cacheable
+
+    # the keys of every client are their own, and a key only replays the request it was used for
+    scopedKey = (_getClientIdentity(req), idempotencyKey)
+    fingerprint = hashlib.sha256(req.body or b'').hexdigest()
+    try:
+        storedResp, replayed = await guard.execute(scopedKey, process, fingerprint)
+    except IdempotencyKeyReused:
+        log.info("Idempotency-Key reused for a different request: {{ idempotencyKey: {} }}".format(
+            idempotencyKey))
+        return responses.idempotencyKeyReused()
+    headers = None
+    if replayed:
+        log.debug("Replaying stored response for: {{ idempotencyKey: {} }}".format(idempotencyKey))
+        headers = {'Idempotent-Replayed': 'true'}
+    return response.raw(
+        storedResp['body'],
+        status=storedResp['status'],
+        headers=headers,
+        content_type=storedResp['contentType']
+    )
+
+
+def _getClientIdentity(req):
+    # the same header the rate limiter identifies the clients by, the ip of the peer without it
+    clientHeader = req.app.config.get('RATE_LIMIT_CLIENT_HEADER', 'X-API-Key')
+    return req.headers.get(clientHeader) or req.ip
+
+
+def _getDeadline(req):
+    """Returns the Deadline of the request, None if the client asked for an
+    invalid one.
+    """
+
+    timeout = float(req.app.config.get('TRANSACTION_TIMEOUT', 30))
+    requestedTimeout = req.headers.get(REQUEST_TIMEOUT_HEADER)
+    if requestedTimeout:
+        try:
+            requestedTimeout = float(requestedTimeout) / 1000
+        except ValueError:
+            requestedTimeout = None
+        # not requestedTimeout > 0 also rejects nan
+        if requestedTimeout is None or not requestedTimeout > 0:
+            log.info("Invalid {} header: {}".format(
+                REQUEST_TIMEOUT_HEADER, req.headers.get(REQUEST_TIMEOUT_HEADER)))
+            return None
+        timeout = min(timeout, requestedTimeout)
+    return Deadline(timeout)
+
+
+async def _processTransaction(app, body, deadline=None):
     # create TransactionRequest object to be used in the transaction processing usecase
     transReq = TransactionRequest(
         order=body['order'],
 	    paymentMethod=body['paymentMethod'],
-	    payment=body['payment']
+	    payment=body['payment'],
+	    deadline=deadline,
+	    validated=True
     )
     # use the tranaaction processing interactor to perform the trnasaction usecase
     resp = None
     hasException = False
     try:
         resp = await app.TransInteractor.process(transReq)
+    except DeadlineExceeded:
+        resp = responses.deadlineExceeded()
+        hasException = True
+    except PartitionQueueFull:
+        # too many transactions of the same user/card are already waiting
+        resp = responses.serviceUnavailable()
+        hasException = True
     except Exception:
         # raise ServerError('Something Bad Happened')
-        resp = response.json(
-            {'message': 'Something Bad Happened'},
-            status=500
-        )
+        resp = responses.somethingBadHappened()
         hasException = True
         
     return resp, hasException
     
     
 def _getTransactionResponse(resp):
+    # the response bodies are pre encoded, see the responses module
     if resp.status != TRANSACTION_PAYMENT_COMPLETE:
-        return response.json(
-            {
-                'message': 'Something Bad Happened',
-                'transactionStatus': {
-                    'code': resp.status,
-                    'status': TransactionStatus[resp.status],
-                    'fraudStatus': resp.fraudStatus
-                }
-            },
-            status=500
-        )
+        return responses.transactionFailed(resp.status, resp.fraudStatus)
     # return success response
-    return response.json({
-        'message': 'Transaction Successfull',
-        'transactionID': resp.transactionID
-    })
+    return responses.transactionSuccessfull(resp.transactionID)
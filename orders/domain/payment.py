@@ -80,11 +80,14 @@ class AcceptAllPaymentProcessor(PaymentProcessor):
         return True
 
 
+# paymentMethod -> processor class, any other method is paid by the default one
+PAYMENT_PROCESSORS = {
+    'paytm': PaytmPaymentProcessor,
+    'icici-debit': ICICIDebitPaymentProcessor
+}
+DEFAULT_PAYMENT_PROCESSOR = AcceptAllPaymentProcessor
+
+
 # Facotry method
 def getPaymentProcessor(paymentMethod):
-    if paymentMethod == 'paytm':
-        return PaytmPaymentProcessor()
-    elif paymentMethod == 'icici-debit':
-        return ICICIDebitPaymentProcessor()
-    else:
-        return AcceptAllPaymentProcessor()
\ No newline at end of file
+    return PAYMENT_PROCESSORS.get(paymentMethod, DEFAULT_PAYMENT_PROCESSOR)()
\ No newline at end of file
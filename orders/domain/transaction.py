@@ -35,6 +35,7 @@
 
 import abc
 import time
+from array import array
 
 
 from orders.log import getCustomLogger
@@ -82,6 +83,10 @@ class Transaction(object):
         self._fraudStatus = False
         self._transactionStartTime = int(time.time()*1000)
         self._transactionEndTime = None
+        # the timeline of the status transitions, kept in two parallel arrays of
+        # the statuses and the monotonic times they were entered at
+        self._timelineStatuses = array('B', (TRANSACTION_PENDING,))
+        self._timelineTimes = array('d', (time.monotonic(),))
     
     def __repr__(self):
         return '{{ Transaction: {{ transactionID: {0}, order: {1}, paymentMethod: {2}, \
@@ -95,6 +100,8 @@ class Transaction(object):
     
     def updateStatus(self, status):
         self._status = status
+        self._timelineStatuses.append(status)
+        self._timelineTimes.append(time.monotonic())
         
     def updateTransactionEndTime(self):
         self._transactionEndTime = int(time.time()*1000)
@@ -107,6 +114,10 @@ class Transaction(object):
     def transactionID(self, uID):
         self._transactionID = uID
     
+    @property
+    def order(self):
+        return self._order
+
     @property
     def paymentMethod(self):
         return self._paymentMethod
@@ -122,7 +133,27 @@ class Transaction(object):
     @property
     def status(self):
         return self._status
+
+    @property
+    def timeline(self):
+        """The status transitions as a list of ``[status, msSinceStart]`` pairs, the
+        first one is always the pending status at 0 ms.
+        """
+
+        startTime = self._timelineTimes[0]
+        return [
+            [status, round((t - startTime) * 1000, 3)]
+            for status, t in zip(self._timelineStatuses, self._timelineTimes)
+        ]
     
+    @property
+    def paymentStarted(self):
+        """True if the payment was handed to the PaymentProcessor since the
+        transaction was created (or rebuilt by fromDict), whatever came of it.
+        """
+
+        return TRANSACTION_PAYMENT_INITIATED in self._timelineStatuses
+
     def toDict(self):
         return {
             'Transaction': {
@@ -134,11 +165,26 @@ class Transaction(object):
                 'status': self._status,
                 'fraudStatus': self._fraudStatus,
                 'transactionStartTime': self._transactionStartTime,
-                'transactionEndTime': self._transactionEndTime
+                'transactionEndTime': self._transactionEndTime,
+                'timeline': self.timeline
             }
         }
     
     
 
-
-
+    @classmethod
+    def fromDict(cls, transactionDict):
+        """Rebuilds a transaction from its ``toDict()['Transaction']`` dict, the
+        timeline starts over from the status it was in.
+        """
+
+        transaction = cls(
+            transactionDict['order'], transactionDict['paymentMethod'], transactionDict['payment'])
+        transaction._transactionID = transactionDict['transactionID']
+        transaction._userID = transactionDict['userID']
+        transaction._status = transactionDict['status']
+        transaction._fraudStatus = transactionDict['fraudStatus']
+        transaction._transactionStartTime = transactionDict['transactionStartTime']
+        transaction._transactionEndTime = transactionDict['transactionEndTime']
+        transaction._timelineStatuses[0] = transaction._status
+        return transaction
@@ -0,0 +1,363 @@
+"""The faults module makes the dependencies misbehave on demand, so that the
+timeouts, retries, rate and concurrency limits and the reconciliation can be
+exercised under load locally, against the same degradation patterns seen in
+production.
+
+Every dependency (a TransportGateway, Repository, FraudChecker, AlertSender or
+PaymentProcessor) can be wrapped in the Faulty* wrapper of its interface, see
+wrapDependency, which asks its FaultInjector before every call. An injector
+applies the FaultProfile currently active for the dependency, if any, which is
+configured as::
+
+    {
+        "latency": {"type": "lognormal", "p50": 0.05, "p99": 0.8},
+        "errorRate": 0.1,
+        "error": "timeout",
+        "blackout": false,
+        "slowStart": {"seconds": 30, "factor": 10}
+    }
+
+``latency`` is any of the latency distributions of the simulation module and is
+added before the call, ``errorRate`` is the share of the calls failing with
+``error`` (``connection``, ``refused``, ``timeout`` or ``error``) instead of being
+made, ``blackout`` fails all of them, and ``slowStart`` multiplies the latency by
+``factor`` when the profile is activated, easing off linearly to 1 over
+``seconds``, like a cold dependency warming up after a restart. All the keys are
+optional.
+
+A FaultScenario activates and clears profiles on a schedule, in seconds from its
+start, optionally repeating::
+
+    {
+        "repeat": true,
+        "steps": [
+            {"at": 0, "target": "paymentProcessor.PaytmPaymentProcessor", "profile": {"errorRate": 0.5}},
+            {"at": 60, "target": "paymentProcessor.PaytmPaymentProcessor", "profile": null},
+            {"at": 90}
+        ]
+    }
+
+The FaultRegistry keeps the injectors by dependency name and is what the admin
+endpoints toggle at runtime. Only the dependencies registered when they are
+wrapped, at start up, have an injector, any other name is refused. The registry
+lives in the worker, hence the endpoints change the faults of the worker serving
+the request (run a single worker to control them all).
+"""
+
+
+import asyncio
+import random
+import time
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+from orders.gateway import TransportGateway
+from orders.domain.order import Repository
+from orders.domain.payment import PaymentProcessor
+from orders.usecases.alert import AlertSender
+from orders.usecases.fraudcheck import FraudChecker
+from orders.simulation import latencyFromConfig
+
+
+log = getCustomLogger(__name__)
+
+
+_ERRORS = {
+    'connection': ConnectionError,
+    'refused': ConnectionRefusedError,
+    'timeout': asyncio.TimeoutError,
+    'error': Exception
+}
+
+
+class FaultProfile(object):
+    """The faults injected into the calls to a dependency, see the module docs
+    for the config.
+    """
+
+    _KEYS = ('latency', 'errorRate', 'error', 'blackout', 'slowStart')
+
+    def __init__(self, config):
+        unknownKeys = set(config) - set(self._KEYS)
+        if unknownKeys:
+            raise ValueError("Unknown fault profile keys: {}".format(', '.join(sorted(unknownKeys))))
+        self.config = config
+        self._latency = latencyFromConfig(config['latency']) if config.get('latency') else None
+        self._errorRate = float(config.get('errorRate', 0))
+        if not 0 <= self._errorRate <= 1:
+            raise ValueError("errorRate must be within [0, 1]")
+        errorName = config.get('error', 'connection')
+        if errorName not in _ERRORS:
+            raise ValueError("Unknown fault error: {}".format(errorName))
+        self._error = _ERRORS[errorName]
+        self._blackout = bool(config.get('blackout', False))
+        slowStart = config.get('slowStart') or {}
+        self._slowStartSeconds = float(slowStart.get('seconds', 0))
+        self._slowStartFactor = float(slowStart.get('factor', 1))
+        self._activatedAt = time.monotonic()
+
+    def latency(self, rng):
+        if self._latency is None:
+            return 0.0
+        latency = self._latency.sample(rng)
+        elapsed = time.monotonic() - self._activatedAt
+        if elapsed < self._slowStartSeconds:
+            latency *= 1 + (self._slowStartFactor - 1) * (1 - elapsed / self._slowStartSeconds)
+        return latency
+
+    def error(self, rng, name):
+        """Returns the error to fail the call with, None to let it through."""
+
+        if self._blackout:
+            return self._error("Injected blackout of {}".format(name))
+        if self._errorRate and rng.random() < self._errorRate:
+            return self._error("Injected error of {}".format(name))
+        return None
+
+
+class FaultInjector(object):
+    """Injects the faults of the active profile of one dependency."""
+
+    def __init__(self, name, rng=None):
+        self._name = name
+        self._rng = rng or random.Random()
+        self._profile = None
+        self._calls = 0
+        self._delayed = 0
+        self._delaySeconds = 0.0
+        self._errors = 0
+
+    def activate(self, profile):
+        """Activates the FaultProfile, or clears the faults if it is None."""
+
+        self._profile = profile
+        log.info("Fault profile {}: {{ dependency: {}, profile: {} }}".format(
+            'activated' if profile else 'cleared', self._name, profile.config if profile else None))
+
+    async def inject(self):
+        profile = self._profile
+        if profile is None:
+            return
+        self._calls += 1
+        latency = profile.latency(self._rng)
+        if latency > 0:
+            self._delayed += 1
+            self._delaySeconds += latency
+            await asyncio.sleep(latency)
+        error = profile.error(self._rng, self._name)
+        if error is not None:
+            self._errors += 1
+            raise error
+
+    def toDict(self):
+        return OrderedDict([
+            ('profile', self._profile.config if self._profile else None),
+            ('calls', self._calls),
+            ('delayed', self._delayed),
+            ('delaySeconds', round(self._delaySeconds, 3)),
+            ('errors', self._errors)
+        ])
+
+
+class FaultScenario(object):
+    """Activates and clears the fault profiles of a registry on a schedule."""
+
+    def __init__(self, registry, config):
+        self._registry = registry
+        self.config = config
+        self._repeat = bool(config.get('repeat', False))
+        self._steps = []
+        for step in sorted(config.get('steps', ()), key=lambda step: step.get('at', 0)):
+            profile = step.get('profile')
+            if step.get('target') and step['target'] not in registry:
+                raise ValueError("Unknown fault target: {}".format(step['target']))
+            self._steps.append((
+                float(step.get('at', 0)),
+                step.get('target'),
+                FaultProfile(profile) if profile else None
+            ))
+        if not self._steps:
+            raise ValueError("A fault scenario needs at least one step")
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        log.info("Fault scenario started: {{ steps: {}, repeat: {} }}".format(
+            len(self._steps), self._repeat))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        log.info("Fault scenario stopped")
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _run(self):
+        while True:
+            startTime = time.monotonic()
+            for at, target, profile in self._steps:
+                await asyncio.sleep(max(0, startTime + at - time.monotonic()))
+                if target:
+                    # a profile object is activated afresh every round, for the slow start
+                    self._registry.get(target).activate(FaultProfile(profile.config) if profile else None)
+            if not self._repeat:
+                return
+
+
+class FaultRegistry(object):
+
+    def __init__(self, seed=None):
+        self._rng = random.Random(seed)
+        self._injectors = OrderedDict()
+        self._scenario = None
+
+    def __contains__(self, name):
+        return name in self._injectors
+
+    def register(self, name):
+        """Returns the injector of the dependency, created on first use, to be
+        called when the dependency is wrapped.
+        """
+
+        injector = self._injectors.get(name)
+        if injector is None:
+            injector = self._injectors[name] = FaultInjector(name, self._rng)
+        return injector
+
+    def get(self, name):
+        """Returns the injector of the registered dependency, raises KeyError
+        for any other name.
+        """
+
+        injector = self._injectors.get(name)
+        if injector is None:
+            raise KeyError("Unknown fault target: {}".format(name))
+        return injector
+
+    def activate(self, name, config):
+        """Activates the profile config for the registered dependency, None
+        clears it.
+        """
+
+        profile = FaultProfile(config) if config else None
+        self.get(name).activate(profile)
+
+    def clear(self):
+        for injector in self._injectors.values():
+            injector.activate(None)
+
+    async def runScenario(self, config):
+        """Replaces the running scenario, if any, with the one of the config,
+        None just stops it.
+        """
+
+        scenario = FaultScenario(self, config) if config else None
+        if self._scenario is not None:
+            await self._scenario.stop()
+        self._scenario = scenario
+        if scenario is not None:
+            scenario.start()
+
+    async def close(self):
+        await self.runScenario(None)
+
+    def toDict(self):
+        return OrderedDict([
+            ('dependencies', OrderedDict(
+                (name, injector.toDict()) for name, injector in self._injectors.items())),
+            ('scenario', self._scenario.config if self._scenario and self._scenario.running else None)
+        ])
+
+
+def wrapDependency(dependency, injector):
+    """Wraps the dependency in the Faulty* wrapper of its interface, anything
+    which is none of the others is taken for an AlertSender.
+    """
+
+    if isinstance(dependency, TransportGateway):
+        return FaultyTransportGateway(dependency, injector)
+    if isinstance(dependency, Repository):
+        return FaultyRepository(dependency, injector)
+    if isinstance(dependency, FraudChecker):
+        return FaultyFraudChecker(dependency, injector)
+    if isinstance(dependency, PaymentProcessor):
+        return FaultyPaymentProcessor(dependency, injector)
+    return FaultyAlertSender(dependency, injector)
+
+
+class FaultyTransportGateway(TransportGateway):
+
+    def __init__(self, gateway, injector):
+        self._gateway = gateway
+        self._injector = injector
+
+    async def send(self, msgToSend):
+        await self._injector.inject()
+        return await self._gateway.send(msgToSend)
+
+
+class FaultyRepository(Repository):
+
+    def __init__(self, repository, injector):
+        self._repository = repository
+        self._injector = injector
+
+    async def setup(self):
+        await self._repository.setup()
+
+    async def close(self):
+        await self._repository.close()
+
+    async def findByID(self, uID):
+        await self._injector.inject()
+        return await self._repository.findByID(uID)
+
+    async def store(self, domainObject):
+        await self._injector.inject()
+        return await self._repository.store(domainObject)
+
+
+class FaultyFraudChecker(FraudChecker):
+
+    def __init__(self, fraudChecker, injector):
+        self._fraudChecker = fraudChecker
+        self._injector = injector
+
+    async def isFraud(self, transactionObj):
+        await self._injector.inject()
+        return await self._fraudChecker.isFraud(transactionObj)
+
+
+class FaultyAlertSender(AlertSender):
+
+    def __init__(self, alertSender, injector):
+        self._alertSender = alertSender
+        self._injector = injector
+
+    async def send(self, alertObject):
+        await self._injector.inject()
+        return await self._alertSender.send(alertObject)
+
+
+class FaultyPaymentProcessor(PaymentProcessor):
+
+    def __init__(self, paymentProcessor, injector):
+        self._paymentProcessor = paymentProcessor
+        self._injector = injector
+
+    async def pay(self, payment):
+        await self._injector.inject()
+        return await self._paymentProcessor.pay(payment)
@@ -5,8 +5,6 @@ those interfaces which help in communicated to external services.
 
 import abc
 
-import aiohttp
-
 from orders.log import getCustomLogger
 
 
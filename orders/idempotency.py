@@ -0,0 +1,271 @@
+"""The idempotency module makes the ``/transact`` api safe to retry using a client
+supplied ``Idempotency-Key`` header.
+
+It consists of an IdempotencyStore interface which concrete stores implement, an
+InMemoryIdempotencyStore which is a bounded, ttl evicted store local to the worker
+process (optionally backed by a shared store), a SharedMemoryIdempotencyStore which
+keeps them in the SharedMemoryCache of the node, and an IdempotencyGuard which makes
+sure a key is processed only once and concurrent requests with the same key wait
+for the original one.
+
+With a shared store the key is also reserved in the store while it is being
+processed, so that a retry reaching another worker waits for the original request
+and replays its result instead of processing it again. A reservation lasts at most
+``inFlightTtl`` seconds, which has to be well above the transaction timeout.
+
+The keys are scoped by the caller (the controllers prefix them with the client
+identity), and every result is stored along with the fingerprint of the request
+it answers, so that a key reused for a different request is rejected with
+IdempotencyKeyReused instead of replaying the response of the first one.
+"""
+
+
+import abc
+import asyncio
+import pickle
+import time
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+
+
+log = getCustomLogger(__name__)
+
+
+class IdempotencyKeyReused(Exception):
+    pass
+
+
+# Interface
+class IdempotencyStore(metaclass=abc.ABCMeta):
+    """Interface for the store which keeps the result of an already processed
+    request against its idempotency key.
+
+    The results are plain dicts so that any shared backend (redis, memcached,
+    some database, etc) can implement this interface and be plugged in.
+    """
+
+    @abc.abstractmethod
+    async def get(self, key):
+        """Returns the result stored for the key or None if there is nothing
+        stored or it has expired.
+        """
+
+        pass
+
+    @abc.abstractmethod
+    async def set(self, key, result, ttl):
+        """Stores the result for the key for ttl seconds."""
+
+        pass
+
+    async def reserve(self, key, fingerprint, ttl):
+        """Reserves the key for the request of the fingerprint for ttl seconds,
+        unless another request holds it. Returns a tuple of (reserved, fingerprint
+        of the request holding the key).
+
+        A store local to the worker has nothing to reserve, the IdempotencyGuard
+        keeps track of the keys in flight in its worker.
+        """
+
+        return True, fingerprint
+
+    async def release(self, key):
+        """Releases the reservation of the key."""
+
+        pass
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """A bounded, ttl evicted IdempotencyStore which keeps the results in the
+    memory of the worker process.
+
+    When a shared backend (any IdempotencyStore) is given, this store acts as a
+    local cache in front of it, so that replays hitting this worker are answered
+    from memory while replays hitting other workers are answered from the backend.
+    """
+
+    def __init__(self, maxSize=100000, ttl=86400, backend=None):
+        self._maxSize = maxSize
+        self._ttl = ttl
+        self._backend = backend
+        # key -> (expiresAt, result), ordered by insertion to evict the oldest first
+        self._results = OrderedDict()
+
+    async def get(self, key):
+        result = self._getLocal(key)
+        if result is not None or self._backend is None:
+            return result
+
+        result = await self._backend.get(key)
+        if result is not None:
+            self._setLocal(key, result, self._ttl)
+        return result
+
+    async def set(self, key, result, ttl):
+        self._setLocal(key, result, ttl)
+        if self._backend is not None:
+            await self._backend.set(key, result, ttl)
+
+    async def reserve(self, key, fingerprint, ttl):
+        if self._backend is None:
+            return True, fingerprint
+        return await self._backend.reserve(key, fingerprint, ttl)
+
+    async def release(self, key):
+        if self._backend is not None:
+            await self._backend.release(key)
+
+    def __len__(self):
+        return len(self._results)
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _getLocal(self, key):
+        item = self._results.get(key)
+        if item is None:
+            return None
+        expiresAt, result = item
+        if expiresAt <= time.monotonic():
+            del self._results[key]
+            return None
+        return result
+
+    def _setLocal(self, key, result, ttl):
+        now = time.monotonic()
+        self._results.pop(key, None)
+        self._results[key] = (now + min(ttl, self._ttl), result)
+        # drop the expired entries from the oldest end, then enforce the size bound
+        while self._results:
+            oldestKey, (expiresAt, _) = next(iter(self._results.items()))
+            if expiresAt > now and len(self._results) <= self._maxSize:
+                break
+            del self._results[oldestKey]
+
+
+class SharedMemoryIdempotencyStore(IdempotencyStore):
+    """An IdempotencyStore in a SharedMemoryCache, shared by all the workers of
+    the node. Results larger than the values of the cache are not stored.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    async def get(self, key):
+        value = self._cache.get(('idempotency', key))
+        return pickle.loads(value) if value is not None else None
+
+    async def set(self, key, result, ttl):
+        value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        if not self._cache.set(('idempotency', key), value, ttl):
+            log.info("Idempotency result too large for the shared cache: {{ idempotencyKey: {}, \
+                size: {} }}".format(key, len(value)))
+
+    async def reserve(self, key, fingerprint, ttl):
+        value = pickle.dumps(fingerprint, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._cache.add(('idempotencyInFlight', key), value, ttl):
+            return True, fingerprint
+        holder = self._cache.get(('idempotencyInFlight', key))
+        # released in between, the guard looks for the result and tries again
+        return False, pickle.loads(holder) if holder is not None else fingerprint
+
+    async def release(self, key):
+        self._cache.delete(('idempotencyInFlight', key))
+
+
+class IdempotencyGuard(object):
+    """Runs a request handling coroutine at most once per idempotency key.
+
+    A request whose key already has a stored result gets the stored result back
+    without running anything. A request whose key is currently being processed
+    waits for the original one to finish and gets its result, by awaiting it in
+    this worker or by polling the store every ``pollInterval`` seconds while the
+    key is reserved by another worker.
+
+    The original processing runs in its own task, so that a client disconnecting
+    (and most likely retrying) does not abort a half done transaction.
+    """
+
+    def __init__(self, store, ttl=86400, inFlightTtl=120, pollInterval=0.05):
+        self._store = store
+        self._ttl = ttl
+        self._inFlightTtl = inFlightTtl
+        self._pollInterval = pollInterval
+        self._inFlight = {}
+
+    async def execute(self, key, func, fingerprint=None):
+        """Returns a tuple of (result, replayed) for the key.
+
+        ``func`` is a coroutine function returning a tuple of (result, cacheable),
+        only cacheable results are stored against the key. ``fingerprint`` (a hash
+        of the request) is stored along with the result, IdempotencyKeyReused is
+        raised if the key was used for a request with another fingerprint.
+        """
+
+        while True:
+            inFlight = self._inFlight.get(key)
+            if inFlight is None:
+                stored = await self._store.get(key)
+                if stored is not None:
+                    _checkFingerprint(key, stored['fingerprint'], fingerprint)
+                    return stored['result'], True
+                # the store lookup may have yielded to the loop, check again
+                inFlight = self._inFlight.get(key)
+
+            if inFlight is not None:
+                task, inFlightFingerprint = inFlight
+                _checkFingerprint(key, inFlightFingerprint, fingerprint)
+                log.debug("Waiting for in flight request: {{ idempotencyKey: {} }}".format(key))
+                result = await asyncio.shield(task)
+                return result, True
+
+            reserved, holderFingerprint = await self._store.reserve(key, fingerprint, self._inFlightTtl)
+            if reserved:
+                break
+            # another worker is processing the key, wait for its result
+            _checkFingerprint(key, holderFingerprint, fingerprint)
+            await asyncio.sleep(self._pollInterval)
+
+        # the original request may have stored its result and released the key
+        # right before it was reserved
+        stored = await self._store.get(key)
+        if stored is not None:
+            await self._store.release(key)
+            _checkFingerprint(key, stored['fingerprint'], fingerprint)
+            return stored['result'], True
+
+        task = asyncio.ensure_future(self._run(key, func, fingerprint))
+        self._inFlight[key] = (task, fingerprint)
+        result = await asyncio.shield(task)
+        return result, False
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _run(self, key, func, fingerprint):
+        try:
+            result, cacheable = await func()
+            if cacheable:
+                try:
+                    await self._store.set(
+                        key, {'fingerprint': fingerprint, 'result': result}, self._ttl)
+                except Exception as exc:
+                    log.error("IdempotencyStore.set raised exception for: {{ idempotencyKey: {}, \
+                        exc: {} }}".format(key, exc))
+            return result
+        finally:
+            self._inFlight.pop(key, None)
+            try:
+                await self._store.release(key)
+            except Exception as exc:
+                log.error("IdempotencyStore.release raised exception for: {{ idempotencyKey: {}, \
+                    exc: {} }}".format(key, exc))
+
+
+def _checkFingerprint(key, storedFingerprint, fingerprint):
+    if storedFingerprint != fingerprint:
+        raise IdempotencyKeyReused("Idempotency-Key reused for a different request: {{ \
+            idempotencyKey: {} }}".format(key))
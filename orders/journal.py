@@ -0,0 +1,322 @@
+"""The journal module is a local, durable Repository which needs no database process,
+for single node deployments and the benchmarks.
+
+Transactions are appended to fixed size segment files, which are memory mapped, as
+length prefixed records::
+
+    | payload length (4) | crc32 of payload (4) | transactionID (8) | json payload |
+
+An in memory index maps every transactionID to the segment and offset of its latest
+record, so a ``store`` is a memcpy into the page cache and a ``findByID`` a single
+read. When the active segment is full a new one is started, and the sealed segments
+where most of the records have been superseded by later states of the same
+transactions are compacted in the background, i.e. their live records are appended
+again a batch at a time, yielding to the event loop in between, and the segment is
+deleted.
+
+The transaction ids are millisecond timestamps, hence two transactions may get the
+same one. A store of a transaction whose id is already taken by another transaction
+(the fields preceding the status, which never change over the life of a
+transaction, differ) moves it to the next free id instead of replacing the other
+one.
+
+On start up the index is rebuilt by scanning the segments in order, the scan of a
+segment stops at the first empty or corrupt (torn write) record, and the tail of the
+last segment is wiped so that new records are appended right after the last good one.
+
+NOTE: the records reach the page cache on ``store``, so they survive a crash of the
+process but not of the machine, unless ``fsync`` is enabled. A journal directory can
+only be opened by a single process (worker) at a time.
+"""
+
+
+import asyncio
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from orders.log import getCustomLogger
+from orders.domain.order import Repository
+
+
+log = getCustomLogger(__name__)
+
+
+_HEADER = struct.Struct('<IIq')
+_SEGMENT_NAME = 'segment-{:08d}.log'
+
+
+class JournalError(Exception):
+    pass
+
+
+class _Segment(object):
+
+    def __init__(self, path, seq, size):
+        self.path = path
+        self.seq = seq
+        self.records = 0
+        self.live = 0
+        self.position = 0
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.size = os.fstat(fd).st_size
+            self.mmap = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+    def scan(self):
+        """Yields the (transactionID, offset) of every good record, and leaves the
+        position right after the last good one.
+        """
+
+        offset, end = 0, self.size - _HEADER.size
+        while offset <= end:
+            length, crc, transactionID = _HEADER.unpack_from(self.mmap, offset)
+            start = offset + _HEADER.size
+            if length == 0:
+                break
+            if start + length > self.size or zlib.crc32(self.mmap[start:start + length]) != crc:
+                log.error("Corrupt record in journal segment, ignoring the rest of it: {{ segment: {}, \
+                    offset: {} }}".format(self.path, offset))
+                break
+            yield transactionID, offset
+            offset = start + length
+        self.position = offset
+
+    def fits(self, length):
+        return self.position + _HEADER.size + length <= self.size
+
+    def append(self, transactionID, payload):
+        offset = self.position
+        _HEADER.pack_into(self.mmap, offset, len(payload), zlib.crc32(payload), transactionID)
+        start = offset + _HEADER.size
+        self.mmap[start:start + len(payload)] = payload
+        self.position = start + len(payload)
+        self.records += 1
+        return offset
+
+    def read(self, offset):
+        length, _, _ = _HEADER.unpack_from(self.mmap, offset)
+        start = offset + _HEADER.size
+        return self.mmap[start:start + length]
+
+    def flush(self, offset):
+        """msyncs the pages from offset up to the current position."""
+
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        self.mmap.flush(start, self.position - start)
+
+    def wipeTail(self):
+        if self.position < self.size:
+            self.mmap[self.position:] = bytes(self.size - self.position)
+
+    def close(self):
+        self.mmap.flush()
+        self.mmap.close()
+
+
+class JournalRepository(Repository):
+    """A Repository of transactions on an append only journal of memory mapped
+    segment files in ``path``.
+
+    ``segmentSize`` is the size of every segment file, ``fsync`` msyncs every
+    record to disk before ``store`` returns, and a sealed segment is compacted
+    once less than ``compactRatio`` of its records are live.
+    """
+
+    # records moved by the compaction between two yields to the event loop
+    _COMPACT_BATCH = 256
+
+    def __init__(self, path, segmentSize=64 * 1024 * 1024, fsync=False, compactRatio=0.5):
+        self._path = path
+        self._segmentSize = segmentSize
+        self._fsync = fsync
+        self._compactRatio = compactRatio
+        self._segments = {}
+        self._active = None
+        # transactionID -> (segment seq, offset)
+        self._index = {}
+        self._compaction = None
+        self._idCollisions = 0
+        self._lockFile = None
+
+    async def setup(self):
+        os.makedirs(self._path, exist_ok=True)
+        self._lockFile = open(os.path.join(self._path, 'LOCK'), 'w')
+        try:
+            fcntl.flock(self._lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lockFile.close()
+            raise JournalError("Journal is in use by another process: {}".format(self._path))
+
+        start = time.monotonic()
+        seqs = sorted(
+            int(name[len('segment-'):-len('.log')]) for name in os.listdir(self._path)
+            if name.startswith('segment-') and name.endswith('.log')
+        )
+        for seq in seqs:
+            segment = self._openSegment(seq)
+            for transactionID, offset in segment.scan():
+                segment.records += 1
+                self._indexRecord(transactionID, segment, offset)
+        if seqs:
+            self._active = self._segments[seqs[-1]]
+            self._active.wipeTail()
+        else:
+            self._active = self._openSegment(1)
+        log.info("Journal recovered: {{ path: {}, segments: {}, transactions: {}, seconds: {:.3f} }}".format(
+            self._path, len(self._segments), len(self._index), time.monotonic() - start))
+
+    async def close(self):
+        if self._compaction is not None:
+            self._compaction.cancel()
+            try:
+                await self._compaction
+            except asyncio.CancelledError:
+                pass
+            self._compaction = None
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
+        self._index = {}
+        if self._lockFile:
+            self._lockFile.close()
+            self._lockFile = None
+        log.info('Journal closed')
+
+    async def findByID(self, uID):
+        location = self._index.get(uID)
+        if location is None:
+            return None
+        seq, offset = location
+        return json.loads(self._segments[seq].read(offset).decode())
+
+    async def store(self, objToStore):
+        if not objToStore.transactionID:
+            objToStore.transactionID = int(time.time()*1000)
+        transactionID = objToStore.transactionID
+        payload = _encode(objToStore)
+        if not self._isSameTransaction(transactionID, payload):
+            while transactionID in self._index:
+                transactionID += 1
+            self._idCollisions += 1
+            log.info("Transaction id taken by another transaction: {{ transactionID: {}, \
+                movedTo: {} }}".format(objToStore.transactionID, transactionID))
+            objToStore.transactionID = transactionID
+            payload = _encode(objToStore)
+        self._append(transactionID, payload)
+        return objToStore
+
+    async def compact(self):
+        """Compacts the sealed segments with less than ``compactRatio`` live records,
+        until there are none left, yielding to the event loop every ``_COMPACT_BATCH``
+        records so that the stores go on meanwhile.
+        """
+
+        while True:
+            segments = [
+                segment for segment in self._segments.values()
+                if segment is not self._active and segment.live < segment.records * self._compactRatio
+            ]
+            if not segments:
+                return
+            for segment in segments:
+                await self._compactSegment(segment)
+
+    def stats(self):
+        return {
+            'segments': len(self._segments),
+            'transactions': len(self._index),
+            'records': sum(segment.records for segment in self._segments.values()),
+            'compacting': self._compaction is not None and not self._compaction.done(),
+            'idCollisions': self._idCollisions
+        }
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _openSegment(self, seq):
+        segment = _Segment(os.path.join(self._path, _SEGMENT_NAME.format(seq)), seq, self._segmentSize)
+        self._segments[seq] = segment
+        return segment
+
+    def _indexRecord(self, transactionID, segment, offset):
+        previous = self._index.get(transactionID)
+        if previous is not None:
+            self._segments[previous[0]].live -= 1
+        self._index[transactionID] = (segment.seq, offset)
+        segment.live += 1
+
+    def _append(self, transactionID, payload):
+        if not self._active.fits(len(payload)):
+            if _HEADER.size + len(payload) > self._segmentSize:
+                raise JournalError("Record of {} bytes does not fit in a journal segment".format(
+                    len(payload)))
+            self._rotate()
+        offset = self._active.append(transactionID, payload)
+        if self._fsync:
+            self._active.flush(offset)
+        self._indexRecord(transactionID, self._active, offset)
+
+    def _rotate(self):
+        self._active = self._openSegment(self._active.seq + 1)
+        # compaction appends to the journal too, it may rotate but the running
+        # compaction picks up the newly sealed segment
+        if self._compaction is None or self._compaction.done():
+            self._compaction = asyncio.ensure_future(self._compactInBackground())
+
+    async def _compactInBackground(self):
+        try:
+            await self.compact()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            log.error("Journal compaction raised exception: {}".format(exc))
+
+    async def _compactSegment(self, segment):
+        moved = 0
+        for i, (transactionID, offset) in enumerate(segment.scan()):
+            # only the latest record of a transaction is live, which a store may
+            # have superseded while the compaction yielded
+            if self._index.get(transactionID) == (segment.seq, offset):
+                self._append(transactionID, segment.read(offset))
+                moved += 1
+            if i % self._COMPACT_BATCH == self._COMPACT_BATCH - 1:
+                await asyncio.sleep(0)
+        # the live records are in the journal again, the segment can go
+        del self._segments[segment.seq]
+        segment.close()
+        os.remove(segment.path)
+        log.info("Compacted journal segment: {{ segment: {}, records: {}, live: {} }}".format(
+            segment.path, segment.records, moved))
+
+    def _isSameTransaction(self, transactionID, payload):
+        """Returns False if the transactionID is taken by another transaction than
+        the one of the payload.
+        """
+
+        location = self._index.get(transactionID)
+        if location is None:
+            return True
+        seq, offset = location
+        identity = _identity(payload)
+        return identity is None or identity == _identity(self._segments[seq].read(offset))
+
+
+def _encode(objToStore):
+    record = objToStore.toDict()
+    return json.dumps(record.get('Transaction', record), separators=(',', ':')).encode()
+
+
+def _identity(payload):
+    # the fields preceding the status never change over the life of a transaction
+    end = payload.find(b',"status":')
+    return payload[:end] if end >= 0 else None
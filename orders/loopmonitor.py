@@ -0,0 +1,138 @@
+"""The loopmonitor module helps find the event loop stalls which inflate the latency
+of every request being served by a worker.
+
+It consists of setEventLoopPolicy which picks uvloop when configured and available,
+and a LoopMonitor which samples the event loop lag (how late a timer fires) and runs
+a watchdog thread which, when the loop has not come back for longer than a threshold,
+records the stack of whatever is blocking it (a large json.dumps, synchronous
+logging, some cpu heavy code, etc).
+"""
+
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque, OrderedDict
+
+from orders.log import getCustomLogger
+
+
+log = getCustomLogger(__name__)
+
+
+def setEventLoopPolicy(loopType='auto'):
+    """Sets the event loop policy for the loops created from now on and returns
+    the name of the loop used. ``loopType`` is one of ``auto`` (uvloop when it
+    is installed), ``uvloop`` or ``asyncio``.
+
+    NOTE: sanic creates its server loops with uvloop on its own whenever uvloop
+    is installed, this policy decides the loops created by the service itself
+    (the consumer run mode).
+    """
+
+    if loopType in ('auto', 'uvloop'):
+        try:
+            import uvloop
+        except ImportError:
+            if loopType == 'uvloop':
+                log.error("uvloop is not installed, falling back to the asyncio event loop")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return 'uvloop'
+
+    asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    return 'asyncio'
+
+
+class LoopMonitor(object):
+    """Samples the lag of the event loop it is started on and detects stalls.
+
+    Every ``interval`` seconds a timer is scheduled and the lag is how late it
+    fires, the last ``windowSize`` lags are kept to compute the percentiles.
+    A watchdog thread records the stack of the event loop thread whenever the
+    loop has not run the timer for ``stallThreshold`` seconds past its due time.
+    """
+
+    def __init__(self, interval=0.05, stallThreshold=0.1, windowSize=1200, maxStalls=20):
+        self._interval = interval
+        self._stallThreshold = stallThreshold
+        self._lags = deque(maxlen=windowSize)
+        self._stalls = deque(maxlen=maxStalls)
+        self._numStalls = 0
+        self._task = None
+        self._watchdog = None
+        self._running = False
+        self._loopThreadID = None
+        # monotonic time by which the loop is due to run the sampler again
+        self._dueBy = None
+
+    def start(self):
+        self._loopThreadID = threading.get_ident()
+        self._dueBy = time.monotonic() + self._interval
+        self._running = True
+        self._task = asyncio.ensure_future(self._sample())
+        self._watchdog = threading.Thread(
+            target=self._watch, name='loop-monitor-watchdog', daemon=True
+        )
+        self._watchdog.start()
+        log.info("Event loop monitor started: {{ interval: {}, stallThreshold: {} }}".format(
+            self._interval, self._stallThreshold))
+
+    async def stop(self):
+        self._running = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        lags = sorted(self._lags)
+        stats = OrderedDict([
+            ('samples', len(lags)),
+            ('stalls', self._numStalls),
+            ('recentStalls', list(self._stalls))
+        ])
+        if lags:
+            last = len(lags) - 1
+            for p in (50, 90, 99):
+                stats['lagP{}Ms'.format(p)] = round(lags[min(last, len(lags) * p // 100)] * 1000, 3)
+            stats['lagMaxMs'] = round(lags[-1] * 1000, 3)
+        return stats
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self._interval
+            self._dueBy = expected
+            await asyncio.sleep(self._interval)
+            self._lags.append(max(0.0, time.monotonic() - expected))
+
+    def _watch(self):
+        stalledSince = None
+        while self._running:
+            time.sleep(self._stallThreshold / 2)
+            overdue = time.monotonic() - self._dueBy
+            if overdue < self._stallThreshold:
+                stalledSince = None
+                continue
+            if stalledSince == self._dueBy:
+                # still the same stall, its stack has been recorded already
+                continue
+            stalledSince = self._dueBy
+            frame = sys._current_frames().get(self._loopThreadID)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else None
+            self._numStalls += 1
+            self._stalls.append(OrderedDict([
+                ('detectedAt', time.time()),
+                ('detectedAfterMs', round(overdue * 1000, 3)),
+                ('stack', stack)
+            ]))
+            log.error("Event loop blocked for more than {:.3f}s, stack: \n{}".format(overdue, stack))
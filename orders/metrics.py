@@ -0,0 +1,28 @@
+"""The metrics module is a tiny registry of the runtime metrics of a worker.
+
+Components which keep their own counters (retry policies, limiters, etc) register
+a function returning a dict of their current values under some name, and the
+``/metrics`` api returns all of them.
+"""
+
+
+from collections import OrderedDict
+
+
+_providers = OrderedDict()
+
+
+def register(name, provider):
+    """Registers provider, a function returning a json serializable dict, under
+    name. Registering the same name again replaces the previous provider.
+    """
+
+    _providers[name] = provider
+
+
+def unregister(name):
+    _providers.pop(name, None)
+
+
+def collect():
+    return OrderedDict((name, provider()) for name, provider in _providers.items())
@@ -0,0 +1,238 @@
+"""The outbox module implements a transactional outbox for the messages that this
+service sends to the message broker.
+
+Messages are appended to a durable local log (a SQLite database in WAL mode) which
+takes microseconds and does not depend on the broker being available. The database
+is only ever touched by a single writer thread of the worker, so that waiting on the
+lock of the file (held by the relay of another worker) or on an fsync never blocks
+the event loop. An OutboxRelay
+running in the background claims the pending messages in batches, publishes them via
+a TransportGateway and deletes them once published. This gives at-least-once delivery
+and messages left behind by a crashed or restarted worker get replayed.
+"""
+
+
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from orders.log import getCustomLogger
+
+
+log = getCustomLogger(__name__)
+
+
+class SQLiteOutbox(object):
+    """An append only outbox stored in a SQLite database running in WAL mode.
+
+    Many workers can share the same database file, pending messages are leased
+    by the relay claiming them so that a message is published by one worker at
+    a time, and a lease which is not acknowledged (crash, restart) expires and
+    the message is claimed again.
+
+    All the statements run on the single writer thread of the outbox, the
+    coroutines only wait for them.
+    """
+
+    def __init__(self, path, leaseTime=30, synchronous='NORMAL', busyTimeout=1.0):
+        self._path = path
+        self._leaseTime = leaseTime
+        self._synchronous = synchronous
+        self._busyTimeout = busyTimeout
+        self._conn = None
+        self._writer = None
+
+    def setup(self):
+        # isolation_level=None puts the connection in autocommit mode, every append
+        # is its own (tiny) transaction and claim manages its own transaction, the
+        # connection is used by the writer thread from here on
+        self._conn = sqlite3.connect(
+            self._path, timeout=self._busyTimeout, isolation_level=None,
+            check_same_thread=False
+        )
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous={}'.format(self._synchronous))
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'message TEXT NOT NULL, '
+            'createdAt REAL NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'leasedUntil REAL NOT NULL DEFAULT 0)'
+        )
+        log.info("Outbox ready: {{ path: {}, pending: {} }}".format(self._path, self.pending()))
+
+    def close(self):
+        if self._writer:
+            # let the statements already handed over to the writer complete
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+        log.info("Outbox closed")
+
+    async def append(self, msg):
+        """Durably appends a json serializable message to the outbox."""
+
+        await self._execute(self._append, json.dumps(msg), time.time())
+
+    async def claim(self, batchSize):
+        """Leases up to batchSize pending messages, oldest first, and returns
+        them as a list of (id, message) tuples.
+        """
+
+        rows = await self._execute(self._claim, batchSize)
+        return [(msgID, json.loads(message)) for msgID, message in rows]
+
+    async def ack(self, msgIDs):
+        """Removes the published messages from the outbox."""
+
+        if msgIDs:
+            await self._execute(self._ack, list(msgIDs))
+
+    async def release(self, msgIDs):
+        """Gives up the lease on messages which could not be published, so that
+        they are claimed again without waiting for the lease to expire.
+        """
+
+        if msgIDs:
+            await self._execute(self._release, list(msgIDs))
+
+    def pending(self):
+        return self._conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _execute(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._writer, func, *args)
+
+    def _append(self, message, createdAt):
+        self._conn.execute(
+            'INSERT INTO outbox (message, createdAt) VALUES (?, ?)', (message, createdAt)
+        )
+
+    def _claim(self, batchSize):
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self._conn.execute(
+                'SELECT id, message FROM outbox WHERE leasedUntil <= ? ORDER BY id LIMIT ?',
+                (now, batchSize)
+            ).fetchall()
+            if rows:
+                self._conn.execute(
+                    'UPDATE outbox SET leasedUntil = ?, attempts = attempts + 1 '
+                    'WHERE id IN ({})'.format(','.join('?' * len(rows))),
+                    [now + self._leaseTime] + [row[0] for row in rows]
+                )
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _ack(self, msgIDs):
+        self._conn.execute(
+            'DELETE FROM outbox WHERE id IN ({})'.format(','.join('?' * len(msgIDs))),
+            msgIDs
+        )
+
+    def _release(self, msgIDs):
+        self._conn.execute(
+            'UPDATE outbox SET leasedUntil = 0 WHERE id IN ({})'.format(
+                ','.join('?' * len(msgIDs))),
+            msgIDs
+        )
+
+
+class OutboxRelay(object):
+    """Publishes the messages of an outbox via a TransportGateway in the background.
+
+    The relay drains the outbox in batches, each batch is published concurrently
+    and only the successfully published messages are acknowledged. When the gateway
+    fails (broker slow or down) the relay backs off exponentially and the messages
+    stay in the outbox until they can be published.
+    """
+
+    def __init__(self, outbox, gateway, batchSize=100, pollInterval=0.5, maxBackoff=30):
+        self._outbox = outbox
+        self._gateway = gateway
+        self._batchSize = batchSize
+        self._pollInterval = pollInterval
+        self._maxBackoff = maxBackoff
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        log.info("Outbox relay started")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        log.info("Outbox relay stopped")
+
+    async def relayOnce(self):
+        """Claims and publishes one batch. Returns the number of messages published
+        or None if any of them failed to be published.
+        """
+
+        batch = await self._outbox.claim(self._batchSize)
+        if not batch:
+            return 0
+
+        results = await asyncio.gather(
+            *[self._gateway.send(msg) for _, msg in batch],
+            return_exceptions=True
+        )
+        sent, failed = [], []
+        for (msgID, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                failed.append(msgID)
+            else:
+                sent.append(msgID)
+        await self._outbox.ack(sent)
+        await self._outbox.release(failed)
+
+        if failed:
+            log.error("OutboxRelay could not publish messages: {{ failed: {}, sent: {} }}".format(
+                len(failed), len(sent)))
+            return None
+        return len(sent)
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _run(self):
+        backoff = self._pollInterval
+        while True:
+            try:
+                relayed = await self.relayOnce()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                log.error("OutboxRelay.relayOnce raised exception: {}".format(exc))
+                relayed = None
+
+            if relayed is None:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self._maxBackoff)
+                continue
+
+            backoff = self._pollInterval
+            # keep draining while there are full batches, otherwise poll
+            if relayed < self._batchSize:
+                await asyncio.sleep(self._pollInterval)
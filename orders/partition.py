@@ -0,0 +1,127 @@
+"""The partition module serialises the transactions of the same key (a user, a card,
+etc) without a global lock.
+
+A PartitionedExecutor keeps a queue per key, created when the first job of the key
+is submitted and dropped once the last one is done. The jobs of a key run one after
+the other in submission order while the queues of different keys run concurrently,
+hence the jobs of the same key never overlap and keep their order, and a slow key
+only ever holds up its own jobs. A key holds at most ``maxQueueDepth`` waiting jobs,
+beyond that the job is rejected with PartitionQueueFull instead of queueing up
+behind it.
+
+The PartitionedTransactionProcessor runs the TransactionProcessor on such an
+executor, keyed by a field of the transaction request.
+"""
+
+
+import asyncio
+import time
+from collections import deque, OrderedDict
+
+from orders.log import getCustomLogger
+from orders.usecases.fields import getField
+
+
+log = getCustomLogger(__name__)
+
+
+class PartitionQueueFull(Exception):
+    pass
+
+
+class PartitionedExecutor(object):
+
+    def __init__(self, maxQueueDepth=100):
+        # key -> deque of (coroutine function, future, time enqueued), the job
+        # running is the first one and leaves the queue only once done
+        self._queues = {}
+        self._maxQueueDepth = maxQueueDepth
+        self._maxKeys = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._waitSeconds = 0.0
+
+    async def submit(self, key, func):
+        """Runs the coroutine function ``func`` after the jobs of the key submitted
+        before it and returns its result, raises PartitionQueueFull if the queue of
+        the key is full.
+        """
+
+        jobs = self._queues.get(key)
+        if jobs is not None and len(jobs) >= self._maxQueueDepth:
+            self._rejected += 1
+            raise PartitionQueueFull("Partition queue is full: {{ key: {}, depth: {} }}".format(
+                key, len(jobs)))
+
+        self._submitted += 1
+        future = asyncio.get_event_loop().create_future()
+        if jobs is None:
+            jobs = self._queues[key] = deque()
+            self._maxKeys = max(self._maxKeys, len(self._queues))
+            jobs.append((func, future, time.monotonic()))
+            asyncio.ensure_future(self._drain(key, jobs))
+        else:
+            jobs.append((func, future, time.monotonic()))
+        # the job keeps its place in the queue even if the caller goes away
+        return await asyncio.shield(future)
+
+    def stats(self):
+        depths = [len(jobs) for jobs in self._queues.values()]
+        completed = self._completed
+        return OrderedDict([
+            ('keys', len(depths)),
+            ('maxKeys', self._maxKeys),
+            ('queued', sum(depths)),
+            ('maxKeyDepth', max(depths) if depths else 0),
+            ('submitted', self._submitted),
+            ('rejected', self._rejected),
+            ('completed', completed),
+            ('meanWaitMs', round(self._waitSeconds / completed * 1000, 3) if completed else None)
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _drain(self, key, jobs):
+        try:
+            while jobs:
+                func, future, enqueuedAt = jobs[0]
+                self._waitSeconds += time.monotonic() - enqueuedAt
+                try:
+                    result = await func()
+                except Exception as exc:
+                    if not future.done():
+                        future.set_exception(exc)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    # the job leaves the queue only once done, so the depth includes it
+                    jobs.popleft()
+                    self._completed += 1
+        finally:
+            # the queue goes with its last job, the next job of the key starts a new one
+            if self._queues.get(key) is jobs:
+                del self._queues[key]
+
+
+class PartitionedTransactionProcessor(object):
+    """Processes the transaction requests of the same key one at a time, in
+    order, via the wrapped TransactionProcessor.
+
+    ``keyPath`` is the dotted path of the key in the transaction request, e.g.
+    ``payment.card``. Requests without the key are processed right away.
+    """
+
+    def __init__(self, transactionProcessor, executor, keyPath='payment.card'):
+        self._transactionProcessor = transactionProcessor
+        self._executor = executor
+        self._keyPath = keyPath.split('.')
+
+    async def process(self, transReq):
+        key = getField(transReq, self._keyPath)
+        if key is None:
+            return await self._transactionProcessor.process(transReq)
+        return await self._executor.submit(key, lambda: self._transactionProcessor.process(transReq))
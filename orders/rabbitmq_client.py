@@ -5,6 +5,7 @@ from functools import wraps
 import aio_pika
 
 from orders.log import getCustomLogger
+from orders.compression import PayloadCodec, PayloadTooLarge
 
 
 log = getCustomLogger(__name__)
@@ -29,16 +30,21 @@ class RabbitMQClient(metaclass=abc.ABCMeta):
 
 
 class AioPikaClient(RabbitMQClient):
-    """An aio-pika based rabbitmq client implemening the RabbitMQClient interface."""
+    """An aio-pika based rabbitmq client implemening the RabbitMQClient interface.
+
+    The message bodies are compressed and decompressed by the ``codec``, a
+    PayloadCodec, the compressed ones are published with their content encoding.
+    """
     
     def __init__(self, username='guest', password='guest',
-            host='localhost', port=5672, virtualhoat='/', loop=None):
+            host='localhost', port=5672, virtualhoat='/', loop=None, codec=None):
         self._username = username
         self._password = password
         self._host = host
         self._port = port
         self._virtualhoat = virtualhoat
         self._loop = loop
+        self._codec = codec or PayloadCodec()
         self._connection = None
         self._channel = None
         self._exchanges = {}
@@ -56,8 +62,8 @@ class AioPikaClient(RabbitMQClient):
     # @try_catch_async
     async def publish(self, msgToPublish, exchange='default_exchange',
             routing_key='', options=None):
-        # only setup if not done before
-        if not self._setupDone:
+        # only setup if not done before for this exchange
+        if exchange not in self._exchanges:
             await self._setUpClient(exchange, options)
         
         # Sending the message
@@ -80,8 +86,8 @@ class AioPikaClient(RabbitMQClient):
     
     # @try_catch_async
     async def consume(self, queue, exchange, on_message, options=None):
-        # only setup if not done before
-        if not self._setupDone:
+        # only setup if not done before for this exchange
+        if exchange not in self._exchanges:
             await self._setUpClient(exchange, options)
 
         if 'set_qos' in options:
@@ -91,7 +97,9 @@ class AioPikaClient(RabbitMQClient):
             await self._createAndBindQueue(queue, exchange, options)
 
         noAck = options.get('noAck', False)
-        await self._queues[queue]['queue'].consume(on_message, no_ack=noAck)
+        await self._queues[queue]['queue'].consume(
+            self._decodingCallback(on_message), no_ack=noAck
+        )
 
     # @try_catch_async
     async def setup(self):
@@ -107,6 +115,9 @@ class AioPikaClient(RabbitMQClient):
     @property
     def connection(self):
         return self._connection
+
+    def stats(self):
+        return self._codec.stats()
     
     #---------------------------------------#
     #           Private Methods             #
@@ -241,13 +252,16 @@ class AioPikaClient(RabbitMQClient):
             log.error("AioPikaClient's json.dumps raised exception for: \
                 {{ data: {}, exc: {} }}".format(data, exc))
 
+        message, contentEncoding = self._codec.encode(message)
+
         delivery = options.get('deliverMode', None)
         deliveryMode = aio_pika.DeliveryMode.NOT_PERSISTENT
         if delivery == 'persistent':
            deliveryMode = aio_pika.DeliveryMode.PERSISTENT
         try:
             formattedMessage = aio_pika.Message(
-                message, delivery_mode=deliveryMode
+                message, delivery_mode=deliveryMode,
+                content_type='application/json', content_encoding=contentEncoding
             )
             return formattedMessage
         except Exception as exc:
@@ -257,3 +271,25 @@ class AioPikaClient(RabbitMQClient):
                 )
             )
             raise exc
+
+    def _decodingCallback(self, on_message):
+        """Wraps the consume callback so that it gets the decompressed body along
+        with the message, as ``on_message(message, body)``, the body is None if it
+        decompresses beyond the max size of the codec. The message itself is left
+        as delivered, aio-pika locks the messages consumed without ack.
+        """
+
+        def callback(message):
+            body = message.body
+            try:
+                body = self._codec.decode(body, message.content_encoding)
+            except PayloadTooLarge as exc:
+                log.error("AioPikaClient refused message body: {{ content_encoding: {}, exc: {} }}".format(
+                    message.content_encoding, exc))
+                body = None
+            except Exception as exc:
+                # the callback gets the body as is, and rejects it as malformed
+                log.error("AioPikaClient could not decode message body: \
+                    {{ content_encoding: {}, exc: {} }}".format(message.content_encoding, exc))
+            return on_message(message, body)
+        return callback
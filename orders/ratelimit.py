@@ -0,0 +1,213 @@
+"""The ratelimit module keeps one misbehaving client or user from flooding the
+``/transact`` api and eating the fraud check and payment capacity of everyone else.
+
+It consists of token bucket limiters, every key (api key, user, card, etc) gets a
+bucket of ``burst`` tokens refilled at ``rate`` tokens per second, and every request
+takes a token or is rejected. The buckets are refilled lazily, i.e. only when the
+key is seen again, and a bucket which has been idle long enough to be full again is
+the same as no bucket, hence such buckets are evicted.
+
+The TokenBucketLimiter keeps the buckets in the memory of the worker, so the limits
+are per worker. The SharedTokenBucketLimiter keeps them in a fixed size hash table in
+an anonymous shared memory map, created before the workers are forked, so that the
+limits hold across all the workers.
+
+The RateLimiter puts a client (api key) and a user limiter in front of the api, the
+client is checked first, before the request body is even parsed.
+"""
+
+
+import hashlib
+import mmap
+import multiprocessing
+import struct
+import time
+from array import array
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+from orders.usecases.fields import getField
+
+
+log = getCustomLogger(__name__)
+
+
+class TokenBucketLimiter(object):
+    """Token buckets in the memory of the worker, the buckets of at most
+    ``maxKeys`` keys are kept in a few flat arrays.
+    """
+
+    def __init__(self, rate, burst, maxKeys=100000):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._maxKeys = maxKeys
+        # key -> slot, from the least to the most recently seen
+        self._slots = OrderedDict()
+        self._freeSlots = []
+        self._tokens = array('d')
+        self._refilledAt = array('d')
+        self._allowed = 0
+        self._rejected = 0
+
+    def allow(self, key, cost=1.0, now=None):
+        now = time.monotonic() if now is None else now
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._allocate(key, now)
+            tokens = self._burst
+        else:
+            self._slots.move_to_end(key)
+            tokens = min(self._burst, self._tokens[slot] + (now - self._refilledAt[slot]) * self._rate)
+        self._refilledAt[slot] = now
+        if tokens < cost:
+            self._tokens[slot] = tokens
+            self._rejected += 1
+            return False
+        self._tokens[slot] = tokens - cost
+        self._allowed += 1
+        return True
+
+    def stats(self):
+        return OrderedDict([
+            ('keys', len(self._slots)),
+            ('allowed', self._allowed),
+            ('rejected', self._rejected)
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _allocate(self, key, now):
+        # the least recently seen buckets which are full again carry no state
+        while self._slots:
+            oldestKey, oldestSlot = next(iter(self._slots.items()))
+            idleTokens = self._tokens[oldestSlot] + (now - self._refilledAt[oldestSlot]) * self._rate
+            if idleTokens < self._burst and len(self._slots) < self._maxKeys:
+                break
+            self._freeSlots.append(self._slots.pop(oldestKey))
+        if self._freeSlots:
+            slot = self._freeSlots.pop()
+        else:
+            slot = len(self._tokens)
+            self._tokens.append(self._burst)
+            self._refilledAt.append(now)
+        self._slots[key] = slot
+        return slot
+
+
+class SharedTokenBucketLimiter(object):
+    """Token buckets in a shared memory hash table of ``slots`` slots, it must be
+    created before the workers are forked.
+
+    Every slot holds the 64 bit hash of its key, the tokens and the refill time.
+    A key is looked up in the ``probes`` slots following its hash, when none of
+    them is free the one idle for the longest is taken over. A lock shared by the
+    workers guards the table.
+    """
+
+    _SLOT = struct.Struct('<Qdd')
+
+    def __init__(self, rate, burst, slots=65536, probes=8):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._numSlots = slots
+        self._probes = min(probes, slots)
+        self._table = mmap.mmap(-1, slots * self._SLOT.size)
+        self._lock = multiprocessing.Lock()
+        self._allowed = 0
+        self._rejected = 0
+
+    def allow(self, key, cost=1.0, now=None):
+        now = time.monotonic() if now is None else now
+        keyHash = _hashKey(key)
+        with self._lock:
+            offset, tokens = self._lookup(keyHash, now)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._SLOT.pack_into(self._table, offset, keyHash, tokens, now)
+        if allowed:
+            self._allowed += 1
+        else:
+            self._rejected += 1
+        return allowed
+
+    def stats(self):
+        return OrderedDict([
+            ('slots', self._numSlots),
+            ('allowed', self._allowed),
+            ('rejected', self._rejected)
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _lookup(self, keyHash, now):
+        """Returns the offset of the slot of the key and its refilled tokens."""
+
+        slotSize = self._SLOT.size
+        first = keyHash % self._numSlots
+        victim, victimRefilledAt = None, None
+        for probe in range(self._probes):
+            offset = (first + probe) % self._numSlots * slotSize
+            slotHash, tokens, refilledAt = self._SLOT.unpack_from(self._table, offset)
+            if slotHash == keyHash:
+                return offset, min(self._burst, tokens + (now - refilledAt) * self._rate)
+            if slotHash == 0:
+                return offset, self._burst
+            if victim is None or refilledAt < victimRefilledAt:
+                victim, victimRefilledAt = offset, refilledAt
+        return victim, self._burst
+
+
+def _hashKey(key):
+    keyHash = int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'little')
+    # 0 marks a free slot
+    return keyHash or 1
+
+
+class RateLimiter(object):
+    """Rate limits the requests per client and per user.
+
+    The client is identified by the ``clientHeader`` (the ip of the peer if the
+    header is missing), the user by ``userKey``, either ``header:<name>`` or a
+    dotted path in the json body, e.g. ``payment.card``. Either limiter may be
+    None.
+    """
+
+    def __init__(self, clientLimiter=None, userLimiter=None, clientHeader='X-API-Key',
+            userKey='payment.card'):
+        self._clientLimiter = clientLimiter
+        self._userLimiter = userLimiter
+        self._clientHeader = clientHeader
+        if userKey.startswith('header:'):
+            self._userHeader, self._userPath = userKey[len('header:'):], None
+        else:
+            self._userHeader, self._userPath = None, userKey.split('.')
+
+    def allow(self, req):
+        if self._clientLimiter is not None:
+            clientKey = req.headers.get(self._clientHeader) or req.ip
+            if not self._clientLimiter.allow(('client', clientKey)):
+                return False
+        if self._userLimiter is not None:
+            userKey = self._getUserKey(req)
+            if userKey is not None and not self._userLimiter.allow(('user', userKey)):
+                return False
+        return True
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _getUserKey(self, req):
+        if self._userHeader is not None:
+            return req.headers.get(self._userHeader)
+        try:
+            # the parsed body is cached on the request, the handler does not parse it again
+            value = req.json
+        except Exception:
+            return None
+        return getField(value, self._userPath)
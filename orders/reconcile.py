@@ -0,0 +1,348 @@
+"""The reconcile module picks up the transactions which never reached a terminal
+status: the ones whose payment or fraud alert failed, and the ones left pending by
+a crash after they were first saved. A request abandoned on its deadline before the
+payment was started is forgotten instead, its client was answered with a failure
+and may well have retried already.
+
+The TransactionProcessor tracks every transaction it saves or gives up on in a
+ReconciliationLedger, a SQLite database in WAL mode shared by all the workers, which
+keeps only the transactions in a non terminal status, indexed by status and by the
+time they were last updated. A transaction reaching a terminal status is deleted
+from it, hence the ledger stays as small as the backlog of stuck transactions and
+the live request path waits for one small local write per save, made on the
+writer thread of the ledger.
+
+A Reconciler running in the background of every worker claims the transactions
+which have not been updated for ``staleAfter`` seconds in batches, leasing them so
+that no other worker picks them up, and resumes them concurrently (at most
+``concurrency`` at once) via TransactionProcessor.resume. A transaction failing
+again is retried after an exponentially growing delay, up to ``maxAttempts``
+times, after which it is left in the ledger for someone to look into.
+
+A pending transaction is checked for fraud again before it is paid. A transaction
+whose payment failed after it was handed to the PaymentProcessor is never paid
+again automatically, the money may have moved, it is kept in the ledger marked
+for manual handling instead (see the ``manual`` stats).
+
+``staleAfter`` must be well above the transaction timeout, so that a transaction
+still being processed by a live request is never resumed at the same time.
+"""
+
+
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from orders.log import getCustomLogger
+from orders.domain.transaction import (
+    Transaction, TransactionStatus, TRANSACTION_PENDING, TRANSACTION_ALERT_ERROR,
+    TRANSACTION_ALERT_DONE, TRANSACTION_PAYMENT_ERROR, TRANSACTION_PAYMENT_COMPLETE
+)
+
+
+log = getCustomLogger(__name__)
+
+
+# the statuses a transaction is left in when it has to be resumed
+RESUMABLE_STATUSES = (TRANSACTION_PENDING, TRANSACTION_ALERT_ERROR, TRANSACTION_PAYMENT_ERROR)
+# a resumed transaction which could not be saved stays in the ledger in its new status
+_CLAIMABLE_STATUSES = RESUMABLE_STATUSES + (TRANSACTION_ALERT_DONE, TRANSACTION_PAYMENT_COMPLETE)
+
+
+class SQLiteReconciliationLedger(object):
+    """The transactions in a resumable status, stored in a SQLite database running
+    in WAL mode which many workers can share.
+
+    The transactionIDs are millisecond timestamps, two transactions created in the
+    same millisecond (by different workers) share one, hence every transaction
+    gets a random ledger key of its own when it is first tracked (or claimed),
+    remembered for as long as the Transaction object lives.
+
+    All the writes run on the single writer thread of the ledger, like the ones
+    of the outbox, the coroutines only wait for them.
+    """
+
+    def __init__(self, path, leaseTime=60, synchronous='NORMAL', busyTimeout=1.0):
+        self._path = path
+        self._leaseTime = leaseTime
+        self._synchronous = synchronous
+        self._busyTimeout = busyTimeout
+        self._conn = None
+        self._writer = None
+        # Transaction -> its ledger key
+        self._keys = weakref.WeakKeyDictionary()
+
+    def setup(self):
+        self._conn = sqlite3.connect(
+            self._path, timeout=self._busyTimeout, isolation_level=None,
+            check_same_thread=False
+        )
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ledger')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous={}'.format(self._synchronous))
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(ledger)')]
+        if columns and 'ledgerKey' not in columns:
+            # a ledger keyed on the transactionID, its rows keep their id as key
+            self._conn.execute('ALTER TABLE ledger RENAME TO ledgerByTransactionID')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS ledger ('
+            'ledgerKey TEXT PRIMARY KEY, '
+            'transactionID INTEGER NOT NULL, '
+            'status INTEGER NOT NULL, '
+            'updatedAt REAL NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'leasedUntil REAL NOT NULL DEFAULT 0, '
+            'transactionData TEXT NOT NULL, '
+            'manual INTEGER NOT NULL DEFAULT 0)'
+        )
+        if columns and 'ledgerKey' not in columns:
+            self._conn.execute(
+                'INSERT INTO ledger (ledgerKey, transactionID, status, updatedAt, attempts, '
+                'leasedUntil, transactionData{0}) SELECT CAST(transactionID AS TEXT), transactionID, '
+                'status, updatedAt, attempts, leasedUntil, transactionData{0} '
+                'FROM ledgerByTransactionID'.format(', manual' if 'manual' in columns else '')
+            )
+            self._conn.execute('DROP TABLE ledgerByTransactionID')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS ledgerStatusUpdatedAt ON ledger (status, updatedAt)'
+        )
+        log.info("Reconciliation ledger ready: {{ path: {}, pending: {} }}".format(
+            self._path, sum(self.pending().values())))
+
+    def close(self):
+        if self._writer:
+            # let the statements already handed over to the writer complete
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+        log.info("Reconciliation ledger closed")
+
+    async def track(self, transaction):
+        """Records the transaction if it is in a resumable status, forgets it otherwise."""
+
+        if transaction.status not in RESUMABLE_STATUSES:
+            await self.forget(transaction)
+            return
+        await self._execute(
+            self._track, self._key(transaction), transaction.transactionID, transaction.status,
+            _encode(transaction), _needsManualHandling(transaction))
+
+    async def forget(self, transaction):
+        """Removes the transaction from the ledger, it is never resumed."""
+
+        ledgerKey = self._keys.pop(transaction, None)
+        if ledgerKey is not None:
+            await self._execute(self._forget, ledgerKey)
+
+    async def claim(self, staleAfter, batchSize, maxAttempts):
+        """Leases up to batchSize transactions not updated for staleAfter seconds,
+        the stalest first, and returns them as a list of (Transaction, attempts).
+        """
+
+        rows = await self._execute(self._claim, staleAfter, batchSize, maxAttempts)
+        batch = []
+        for ledgerKey, attempts, transactionData in rows:
+            transaction = Transaction.fromDict(json.loads(transactionData))
+            self._keys[transaction] = ledgerKey
+            batch.append((transaction, attempts + 1))
+        return batch
+
+    async def retryLater(self, transaction, delay):
+        """Updates the transaction which failed to be resumed, whatever its status,
+        and keeps it from being claimed for ``delay`` seconds.
+        """
+
+        await self._execute(
+            self._retryLater, self._key(transaction), transaction.transactionID,
+            transaction.status, _encode(transaction), _needsManualHandling(transaction), delay)
+
+    def pending(self):
+        """Returns the number of tracked transactions per status name."""
+
+        return OrderedDict(
+            (TransactionStatus.get(status, status), count)
+            for status, count in self._conn.execute(
+                'SELECT status, COUNT(*) FROM ledger GROUP BY status ORDER BY status')
+        )
+
+    def exhausted(self, maxAttempts):
+        return self._conn.execute(
+            'SELECT COUNT(*) FROM ledger WHERE attempts >= ? AND manual = 0', (maxAttempts,)
+        ).fetchone()[0]
+
+    def manual(self):
+        """Returns the ids of the transactions left for manual handling."""
+
+        return [row[0] for row in self._conn.execute(
+            'SELECT transactionID FROM ledger WHERE manual = 1 ORDER BY updatedAt')]
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _execute(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._writer, func, *args)
+
+    def _key(self, transaction):
+        ledgerKey = self._keys.get(transaction)
+        if ledgerKey is None:
+            ledgerKey = self._keys[transaction] = uuid.uuid4().hex
+        return ledgerKey
+
+    def _track(self, ledgerKey, transactionID, status, transactionData, manual):
+        self._conn.execute(
+            'INSERT INTO ledger (ledgerKey, transactionID, status, updatedAt, transactionData, manual) '
+            'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (ledgerKey) DO UPDATE SET '
+            'status = excluded.status, updatedAt = excluded.updatedAt, '
+            'transactionData = excluded.transactionData, manual = excluded.manual',
+            (ledgerKey, transactionID, status, time.time(), transactionData, manual)
+        )
+
+    def _forget(self, ledgerKey):
+        self._conn.execute('DELETE FROM ledger WHERE ledgerKey = ?', (ledgerKey,))
+
+    def _claim(self, staleAfter, batchSize, maxAttempts):
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self._conn.execute(
+                'SELECT ledgerKey, attempts, transactionData FROM ledger '
+                'WHERE status IN ({}) AND updatedAt <= ? AND leasedUntil <= ? AND attempts < ? '
+                'AND manual = 0 '
+                'ORDER BY updatedAt LIMIT ?'.format(','.join('?' * len(_CLAIMABLE_STATUSES))),
+                _CLAIMABLE_STATUSES + (now - staleAfter, now, maxAttempts, batchSize)
+            ).fetchall()
+            if rows:
+                self._conn.execute(
+                    'UPDATE ledger SET leasedUntil = ?, attempts = attempts + 1 '
+                    'WHERE ledgerKey IN ({})'.format(','.join('?' * len(rows))),
+                    [now + self._leaseTime] + [row[0] for row in rows]
+                )
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _retryLater(self, ledgerKey, transactionID, status, transactionData, manual, delay):
+        now = time.time()
+        self._conn.execute(
+            'INSERT INTO ledger (ledgerKey, transactionID, status, updatedAt, leasedUntil, '
+            'transactionData, manual) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (ledgerKey) '
+            'DO UPDATE SET status = excluded.status, leasedUntil = excluded.leasedUntil, '
+            'transactionData = excluded.transactionData, manual = excluded.manual',
+            (ledgerKey, transactionID, status, now, now + delay, transactionData, manual)
+        )
+
+
+def _needsManualHandling(transaction):
+    manual = transaction.status == TRANSACTION_PAYMENT_ERROR and transaction.paymentStarted
+    if manual:
+        log.error("Transaction payment failed after it was started, left for manual handling: \
+            {{ transactionID: {} }}".format(transaction.transactionID))
+    return manual
+
+
+def _encode(transaction):
+    transactionDict = transaction.toDict()['Transaction']
+    del transactionDict['timeline']
+    return json.dumps(transactionDict)
+
+
+class Reconciler(object):
+    """Resumes the stale transactions of a ledger in the background."""
+
+    def __init__(self, ledger, transactionProcessor, staleAfter=300, batchSize=50,
+            concurrency=5, pollInterval=5, retryDelay=30, maxAttempts=10):
+        self._ledger = ledger
+        self._transactionProcessor = transactionProcessor
+        self._staleAfter = staleAfter
+        self._batchSize = batchSize
+        self._concurrency = concurrency
+        self._pollInterval = pollInterval
+        self._retryDelay = retryDelay
+        self._maxAttempts = maxAttempts
+        self._task = None
+        self._resumed = 0
+        self._failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        log.info("Reconciler started")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        log.info("Reconciler stopped")
+
+    async def reconcileOnce(self):
+        """Claims and resumes one batch, returns the number of transactions claimed."""
+
+        batch = await self._ledger.claim(self._staleAfter, self._batchSize, self._maxAttempts)
+        if not batch:
+            return 0
+        semaphore = asyncio.Semaphore(self._concurrency)
+        await asyncio.gather(*[
+            self._resume(transaction, attempts, semaphore) for transaction, attempts in batch
+        ])
+        return len(batch)
+
+    def stats(self):
+        return OrderedDict([
+            ('resumed', self._resumed),
+            ('failed', self._failed),
+            ('pending', self._ledger.pending()),
+            ('exhausted', self._ledger.exhausted(self._maxAttempts)),
+            ('manual', len(self._ledger.manual()))
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _resume(self, transaction, attempts, semaphore):
+        async with semaphore:
+            status = transaction.status
+            try:
+                # the processor updates the ledger once the transaction is saved
+                await self._transactionProcessor.resume(transaction)
+            except Exception as exc:
+                self._failed += 1
+                delay = self._retryDelay * 2 ** (attempts - 1)
+                log.error("Could not resume Transaction: {{ transactionID: {}, status: {}, \
+                    attempts: {}, retryIn: {}, exc: {} }}".format(
+                        transaction.transactionID, TransactionStatus.get(status, status),
+                        attempts, delay, exc))
+                await self._ledger.retryLater(transaction, delay)
+                return
+            self._resumed += 1
+            log.info("Transaction resumed: {{ transactionID: {}, from: {}, to: {} }}".format(
+                transaction.transactionID, TransactionStatus.get(status, status),
+                TransactionStatus.get(transaction.status, transaction.status)))
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self.reconcileOnce()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                log.error("Reconciler.reconcileOnce raised exception: {}".format(exc))
+                claimed = 0
+            # keep going while there are full batches, otherwise poll
+            if claimed < self._batchSize:
+                await asyncio.sleep(self._pollInterval)
@@ -0,0 +1,100 @@
+"""The responses module builds the json responses of the ``/transact`` api with as
+little per request work as possible.
+
+Constant bodies (bad request, server error, every transaction failure status, etc)
+are encoded once at import time, the success body is a byte template where only the
+transaction id is formatted in, and general json encoding is used only for truly
+dynamic fields like the validation errors.
+"""
+
+
+import json
+
+from sanic import response
+
+from orders.domain.transaction import TransactionStatus
+
+
+def encode(obj):
+    # compact separators, same as the ujson encoder sanic uses for response.json
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+BAD_REQUEST = encode({'message': 'Bad Request'})
+SOMETHING_BAD_HAPPENED = encode({'message': 'Something Bad Happened'})
+SERVICE_UNAVAILABLE = encode({'message': 'Service Unavailable'})
+DEADLINE_EXCEEDED = encode({'message': 'Deadline Exceeded'})
+TOO_MANY_REQUESTS = encode({'message': 'Too Many Requests'})
+IDEMPOTENCY_KEY_REUSED = encode({'message': 'Idempotency Key Reused For A Different Request'})
+
+_BAD_REQUEST_WITH_ERRORS = b'{"message":"Bad Request","errors":%s}'
+_TRANSACTION_SUCCESSFULL = b'{"message":"Transaction Successfull","transactionID":%s}'
+
+# the failure body only depends on the transaction status and the fraud status,
+# hence all of them are encoded upfront
+_TRANSACTION_FAILURES = {
+    (code, fraudStatus): encode({
+        'message': 'Something Bad Happened',
+        'transactionStatus': {
+            'code': code,
+            'status': status,
+            'fraudStatus': fraudStatus
+        }
+    })
+    for code, status in TransactionStatus.items()
+    for fraudStatus in (False, True)
+}
+
+
+def jsonResponse(body, status=200, headers=None):
+    """Returns an http response for an already json encoded body."""
+
+    return response.raw(body, status=status, headers=headers, content_type='application/json')
+
+
+def badRequest(errors=None):
+    if not errors:
+        return jsonResponse(BAD_REQUEST, status=400)
+    return jsonResponse(_BAD_REQUEST_WITH_ERRORS % encode(errors), status=400)
+
+
+def somethingBadHappened():
+    return jsonResponse(SOMETHING_BAD_HAPPENED, status=500)
+
+
+def serviceUnavailable():
+    return jsonResponse(SERVICE_UNAVAILABLE, status=503)
+
+
+def deadlineExceeded():
+    return jsonResponse(DEADLINE_EXCEEDED, status=504)
+
+
+def tooManyRequests():
+    return jsonResponse(TOO_MANY_REQUESTS, status=429, headers={'Retry-After': '1'})
+
+
+def idempotencyKeyReused():
+    return jsonResponse(IDEMPOTENCY_KEY_REUSED, status=422)
+
+
+def transactionSuccessfull(transactionID):
+    if isinstance(transactionID, int) and not isinstance(transactionID, bool):
+        encodedID = b'%d' % transactionID
+    else:
+        encodedID = encode(transactionID)
+    return jsonResponse(_TRANSACTION_SUCCESSFULL % encodedID)
+
+
+def transactionFailed(status, fraudStatus):
+    body = _TRANSACTION_FAILURES.get((status, fraudStatus))
+    if body is None:
+        body = encode({
+            'message': 'Something Bad Happened',
+            'transactionStatus': {
+                'code': status,
+                'status': TransactionStatus.get(status),
+                'fraudStatus': fraudStatus
+            }
+        })
+    return jsonResponse(body, status=500)
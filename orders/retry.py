@@ -0,0 +1,142 @@
+"""The retry module provides a reusable retry policy which any TransportGateway or
+PaymentProcessor can be wrapped in.
+
+A RetryPolicy retries only the configured retryable error classes, waits with an
+exponential backoff with full jitter between the attempts and draws every retry from
+a RetryBudget, a token bucket filled by a fraction of the calls made, so that the
+retries never exceed that fraction of the base traffic. When a dependency is down for
+real the budget runs dry and the retries are suppressed instead of turning the
+outage into a retry storm. No retry is started when what is left of the deadline
+of the request (see the deadline module) is shorter than the backoff delay.
+"""
+
+
+import asyncio
+import random
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+from orders.gateway import TransportGateway
+from orders.domain.payment import PaymentProcessor
+from orders.usecases.deadline import currentDeadline
+
+
+log = getCustomLogger(__name__)
+
+
+class RetryBudget(object):
+    """A token bucket which every call deposits ``ratio`` tokens into and every
+    retry withdraws one token from, hence retries are capped to ``ratio`` of
+    the calls. ``maxTokens`` caps how many retries can be saved up for a burst.
+    """
+
+    def __init__(self, ratio=0.1, maxTokens=10):
+        self._ratio = ratio
+        self._maxTokens = maxTokens
+        self._tokens = maxTokens
+
+    def deposit(self):
+        self._tokens = min(self._maxTokens, self._tokens + self._ratio)
+
+    def withdraw(self):
+        """Returns True and takes a token if a retry is allowed."""
+
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+
+class RetryPolicy(object):
+    """Calls a coroutine function and retries it on the retryable errors with
+    jittered exponential backoff, within a retry budget.
+    """
+
+    def __init__(self, name, retryableErrors=(ConnectionError, asyncio.TimeoutError),
+            maxAttempts=3, baseDelay=0.05, maxDelay=1.0, budget=None):
+        self._name = name
+        self._retryableErrors = tuple(retryableErrors)
+        self._maxAttempts = maxAttempts
+        self._baseDelay = baseDelay
+        self._maxDelay = maxDelay
+        self._budget = budget if budget is not None else RetryBudget()
+        self._calls = 0
+        self._retriesAttempted = 0
+        self._retriesSuppressed = 0
+        self._retriesExhausted = 0
+        self._retriesPastDeadline = 0
+        self._retriedSuccesses = 0
+
+    async def call(self, func, *args, **kwargs):
+        self._calls += 1
+        self._budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                result = await func(*args, **kwargs)
+            except self._retryableErrors as exc:
+                if attempt >= self._maxAttempts:
+                    self._retriesExhausted += 1
+                    raise exc
+                delay = random.uniform(0, min(self._maxDelay, self._baseDelay * 2 ** (attempt - 1)))
+                deadline = currentDeadline()
+                if deadline is not None and deadline.remaining() <= delay:
+                    self._retriesPastDeadline += 1
+                    log.info("Retry skipped, no time left before the deadline: {{ policy: {}, \
+                        delay: {:.3f}, exc: {} }}".format(self._name, delay, exc))
+                    raise exc
+                if not self._budget.withdraw():
+                    self._retriesSuppressed += 1
+                    log.info("Retry suppressed, budget exhausted: {{ policy: {}, exc: {} }}".format(
+                        self._name, exc))
+                    raise exc
+                self._retriesAttempted += 1
+                log.info("Retrying: {{ policy: {}, attempt: {}, delay: {:.3f}, exc: {} }}".format(
+                    self._name, attempt + 1, delay, exc))
+                await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                if attempt > 1:
+                    self._retriedSuccesses += 1
+                return result
+
+    def stats(self):
+        return OrderedDict([
+            ('calls', self._calls),
+            ('retriesAttempted', self._retriesAttempted),
+            ('retriesSuppressed', self._retriesSuppressed),
+            ('retriesExhausted', self._retriesExhausted),
+            ('retriesPastDeadline', self._retriesPastDeadline),
+            ('retriedSuccesses', self._retriedSuccesses),
+            ('budgetTokens', round(self._budget.tokens, 3))
+        ])
+
+
+class RetryingTransportGateway(TransportGateway):
+    """A TransportGateway which sends via the wrapped gateway under a RetryPolicy."""
+
+    def __init__(self, gateway, policy):
+        self._gateway = gateway
+        self._policy = policy
+
+    async def send(self, msgToSend):
+        return await self._policy.call(self._gateway.send, msgToSend)
+
+
+class RetryingPaymentProcessor(PaymentProcessor):
+    """A PaymentProcessor which pays via the wrapped processor under a RetryPolicy.
+
+    Only errors which guarantee that the payment did not go through should be
+    configured as retryable for payments, else a retry may charge twice.
+    """
+
+    def __init__(self, paymentProcessor, policy):
+        self._paymentProcessor = paymentProcessor
+        self._policy = policy
+
+    async def pay(self, payment):
+        return await self._policy.call(self._paymentProcessor.pay, payment)
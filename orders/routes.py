@@ -7,5 +7,11 @@ def addRoutes(app):
 
     # Add different routes for each of the controllers
     app.add_route(controllers.transactionHandler, '/transact', methods=['POST'])
+    app.add_route(controllers.readinessHandler, '/health/ready', methods=['GET'])
+    app.add_route(controllers.metricsHandler, '/metrics', methods=['GET'])
+    app.add_route(controllers.velocityHandler, '/admin/velocity/<user>', methods=['GET'])
+    app.add_route(controllers.faultsHandler, '/admin/faults', methods=['GET', 'DELETE'])
+    app.add_route(controllers.faultScenarioHandler, '/admin/faults/scenario', methods=['PUT', 'DELETE'])
+    app.add_route(controllers.faultHandler, '/admin/faults/<dependency>', methods=['PUT', 'DELETE'])
     # In real app, there will multiple routes, which will be added here one by one
     # This means this one single place to have access to all the routes
\ No newline at end of file
@@ -1,18 +1,20 @@
-from asyncio import sleep
-from aiohttp import ClientSession
+import asyncio
+import signal
 from sanic import Sanic
 # from sanic.log import logger as log
 
 from orders.log import getCustomLogger
 from orders.routes import addRoutes
 from orders.usecases.transact import TransactionProcessor, TransactionValidator
-from orders.usecases.fraudcheck import ExternalFraudChecker, InProcessFraudChecker
-from orders.usecases.alert import (
-    ExternalServiceAlertSender, InProcessAlertSender, MessageBrokerAlertSender
-)
-from orders.gateway import HTTPTransportGateway, RabbitMqTransportGateway
+from orders import metrics
 from orders.mongodb_client import DummyMongoDBClient
-from orders.rabbitmq_client import AioPikaClient
+from orders.idempotency import IdempotencyGuard, InMemoryIdempotencyStore
+from orders.startup import StartupReport
+from orders.loopmonitor import LoopMonitor, setEventLoopPolicy
+
+# NOTE: the gateways, alert senders, fraud checkers and clients (aiohttp, aio-pika)
+# are imported lazily where they get instantiated, so that a worker only pays the
+# import cost of the backends it is actually configured to use.
 
 app = Sanic('orders', configure_logging=True)
 
@@ -26,19 +28,279 @@ async def setupDB(host, port, name, user, password):
     return db
 
 
+async def setupJournal(app):
+    """Sets up the local journal of transactions as the Repository, used when
+    ``DB_BACKEND`` is ``journal``, the journal can be used by a single worker only.
+    """
+
+    from orders.journal import JournalRepository
+    log.info("Setting up Journal")
+    journal = JournalRepository(
+        app.config.JOURNAL_PATH,
+        segmentSize=int(app.config.get('JOURNAL_SEGMENT_SIZE', 64 * 1024 * 1024)),
+        fsync=str(app.config.get('JOURNAL_FSYNC', False)).lower() in ('1', 'true'),
+        compactRatio=float(app.config.get('JOURNAL_COMPACT_RATIO', 0.5))
+    )
+    await journal.setup()
+    metrics.register('journal', journal.stats)
+    return journal
+
+
+def setupRepositoryCache(app, repository):
+    """Wraps the repository in a read through cache of ``DB_CACHE_SIZE`` entries,
+    0 (the default) disables the cache. Nothing on the request path reads the
+    transactions back, hence the cache only pays off for the readers of the
+    repository (status checks, reconciliation).
+    """
+
+    maxSize = int(app.config.get('DB_CACHE_SIZE', 0))
+    if maxSize <= 0:
+        return repository
+    from orders.cache import CachingRepository
+    cachingRepository = CachingRepository(
+        repository,
+        maxSize=maxSize,
+        ttl=float(app.config.get('DB_CACHE_TTL', 60)),
+        negativeTtl=float(app.config.get('DB_CACHE_NEGATIVE_TTL', 5))
+    )
+    metrics.register('repositoryCache', cachingRepository.stats)
+    return cachingRepository
+
+
 def getTransactionInteractor(app):
     """Initialize all the moving parts, this is the place for all
     the Dependency Injection.
     """
 
-    # instantiate the type of transport gateway that would be used to
-    # send request/communicate with external alert service, external fraud checking service, etc.
-    # alertSenderGateway = HTTPTransportGateway(
-    #     client=app.HTTPClient,
-    #     host=app.config.ALERT_SENDER_SERVICE_HOST,
-    #     uri=app.config.ALERT_SENDER_SERVICE_URI,
-    #     method='POST'
-    # )
+    # instantiate the alert sender and the fraud checker configured for the app
+    alertSender = getAlertSender(app)
+    fraudChecker = getFraudChecker(app)
+    # create the transaction interactor
+    return TransactionProcessor(
+        transactionRepo=app.DB,
+	    validator=TransactionValidator(),
+	    fraudChecker=fraudChecker,
+	    alerter=alertSender,
+	    paymentProcessorFactory=getPaymentProcessorFactory(app),
+	    ledger=app.ReconciliationLedger
+    )
+
+
+def partitionTransactionInteractor(app, transInteractor):
+    """Serialises the transactions of the same ``PARTITION_KEY`` (a dotted path in
+    the transaction request), an empty key disables it.
+    """
+
+    keyPath = app.config.get('PARTITION_KEY', 'payment.card')
+    if not keyPath:
+        return transInteractor
+    from orders.partition import PartitionedExecutor, PartitionedTransactionProcessor
+    executor = PartitionedExecutor(
+        maxQueueDepth=int(app.config.get('PARTITION_MAX_QUEUE_DEPTH', 100))
+    )
+    metrics.register('partitions', executor.stats)
+    return PartitionedTransactionProcessor(transInteractor, executor, keyPath=keyPath)
+
+
+def getRetryPolicy(app, name, retryableErrors):
+    """Creates the retry policy of one operation, its metrics are exported
+    under ``retry.<name>``.
+    """
+
+    from orders.retry import RetryBudget, RetryPolicy
+    policy = RetryPolicy(
+        name,
+        retryableErrors=retryableErrors,
+        maxAttempts=int(app.config.get('RETRY_MAX_ATTEMPTS', 3)),
+        baseDelay=float(app.config.get('RETRY_BASE_DELAY', 0.05)),
+        maxDelay=float(app.config.get('RETRY_MAX_DELAY', 1.0)),
+        budget=RetryBudget(
+            ratio=float(app.config.get('RETRY_BUDGET_RATIO', 0.1)),
+            maxTokens=float(app.config.get('RETRY_BUDGET_MAX_TOKENS', 10))
+        )
+    )
+    metrics.register('retry.{}'.format(name), policy.stats)
+    return policy
+
+
+def getConcurrencyLimiter(app, name):
+    """Creates the adaptive concurrency limiter of one dependency, its metrics are
+    exported under ``concurrencyLimit.<name>``. None if ``CONCURRENCY_LIMIT_ALGORITHM``
+    is not set.
+    """
+
+    algorithm = app.config.get('CONCURRENCY_LIMIT_ALGORITHM')
+    if not algorithm:
+        return None
+    from orders.concurrency import AdaptiveConcurrencyLimiter
+    limiter = AdaptiveConcurrencyLimiter(
+        name,
+        algorithm=algorithm,
+        initialLimit=int(app.config.get('CONCURRENCY_LIMIT_INITIAL', 20)),
+        minLimit=int(app.config.get('CONCURRENCY_LIMIT_MIN', 1)),
+        maxLimit=int(app.config.get('CONCURRENCY_LIMIT_MAX', 200)),
+        maxQueue=int(app.config.get('CONCURRENCY_LIMIT_MAX_QUEUE', 50)),
+        tolerance=float(app.config.get('CONCURRENCY_LIMIT_TOLERANCE', 2.0)),
+        backoffRatio=float(app.config.get('CONCURRENCY_LIMIT_BACKOFF_RATIO', 0.9)),
+        minWindow=int(app.config.get('CONCURRENCY_LIMIT_MIN_WINDOW', 20)),
+        percentile=float(app.config.get('CONCURRENCY_LIMIT_PERCENTILE', 0.9))
+    )
+    metrics.register('concurrencyLimit.{}'.format(name), limiter.stats)
+    return limiter
+
+
+def setupFaults(app):
+    """Returns the registry of the faults injected into the dependencies, None
+    unless ``FAULT_INJECTION`` is on. The dependencies register their names as
+    they are wrapped, see injectFaults, and the admin endpoints are served only
+    if ``ADMIN_TOKEN`` is set too.
+    """
+
+    if str(app.config.get('FAULT_INJECTION', False)).lower() not in ('1', 'true'):
+        return None
+    from orders.faults import FaultRegistry
+    log.info("Fault injection is on: {{ adminEndpoints: {} }}".format(
+        bool(app.config.get('ADMIN_TOKEN'))))
+    return FaultRegistry()
+
+
+async def activateFaults(app):
+    """Activates the profiles and the scenario of ``FAULTS_PATH``, if any, once
+    all the dependencies are wrapped.
+    """
+
+    path = app.config.get('FAULTS_PATH')
+    if getattr(app, 'Faults', None) is None or not path:
+        return
+    import json
+    with open(path) as f:
+        config = json.load(f)
+    for name, profile in config.get('profiles', {}).items():
+        app.Faults.activate(name, profile)
+    if config.get('scenario'):
+        await app.Faults.runScenario(config['scenario'])
+
+
+def injectFaults(app, name, dependency):
+    """Wraps the dependency so that the faults of ``name`` are injected into its
+    calls, if fault injection is on, which registers ``name`` as a fault target.
+    """
+
+    if getattr(app, 'Faults', None) is None:
+        return dependency
+    from orders.faults import wrapDependency
+    return wrapDependency(dependency, app.Faults.register(name))
+
+
+def limitGateway(app, name, gateway):
+    limiter = getConcurrencyLimiter(app, name)
+    if limiter is None:
+        return gateway
+    from orders.concurrency import LimitedTransportGateway
+    return LimitedTransportGateway(gateway, limiter)
+
+
+def limitRepository(app, repository):
+    limiter = getConcurrencyLimiter(app, 'repository')
+    if limiter is None:
+        return repository
+    from orders.concurrency import LimitedRepository
+    return LimitedRepository(repository, limiter)
+
+
+def getPaymentProcessorFactory(app):
+    """Returns the factory of the payment processors used by the transaction
+    interactor, every processor is wrapped in the payments retry policy, and in
+    the concurrency limiter of its payment provider if configured.
+
+    Only a refused connection is retried, for anything else the payment may
+    have gone through already.
+    """
+
+    from orders.domain.payment import (
+        getPaymentProcessor, PAYMENT_PROCESSORS, DEFAULT_PAYMENT_PROCESSOR
+    )
+    from orders.retry import RetryingPaymentProcessor
+    policy = getRetryPolicy(app, 'paymentProcessor', (ConnectionRefusedError,))
+    # processor class -> limiter, every payment provider gets its own limit, keyed
+    # on the class the method resolves to rather than on the method the client
+    # sent, so that unknown methods share the limit of the fallback processor
+    limiters = {}
+    # the processors are created per payment, their fault targets are registered
+    # here so that they are known before the first one
+    if getattr(app, 'Faults', None) is not None:
+        for processorClass in set(PAYMENT_PROCESSORS.values()) | {DEFAULT_PAYMENT_PROCESSOR}:
+            app.Faults.register('paymentProcessor.{}'.format(processorClass.__name__))
+
+    def paymentProcessorFactory(paymentMethod):
+        paymentProcessor = getPaymentProcessor(paymentMethod)
+        provider = type(paymentProcessor).__name__
+        paymentProcessor = injectFaults(
+            app, 'paymentProcessor.{}'.format(provider), paymentProcessor)
+        if app.config.get('CONCURRENCY_LIMIT_ALGORITHM'):
+            from orders.concurrency import LimitedPaymentProcessor
+            if provider not in limiters:
+                limiters[provider] = getConcurrencyLimiter(
+                    app, 'paymentProcessor.{}'.format(provider))
+            paymentProcessor = LimitedPaymentProcessor(paymentProcessor, limiters[provider])
+        return RetryingPaymentProcessor(paymentProcessor, policy)
+
+    return paymentProcessorFactory
+
+
+def getAlertSender(app):
+    """Returns the configured AlertSender (see getBaseAlertSender), which digests
+    the alerts per ``ALERT_DIGEST_GROUP_BY`` group every ``ALERT_DIGEST_WINDOW``
+    seconds unless the window is 0.
+    """
+
+    alertSender = injectFaults(app, 'alertSender', getBaseAlertSender(app))
+    windowSeconds = float(app.config.get('ALERT_DIGEST_WINDOW', 0))
+    if windowSeconds <= 0:
+        return alertSender
+
+    from orders.usecases.alert import DigestingAlertSender
+    highSeverityAmount = app.config.get('ALERT_DIGEST_HIGH_SEVERITY_AMOUNT')
+    app.AlertDigester = DigestingAlertSender(
+        alertSender,
+        groupBy=app.config.get('ALERT_DIGEST_GROUP_BY', 'card'),
+        windowSeconds=windowSeconds,
+        maxGroups=int(app.config.get('ALERT_DIGEST_MAX_GROUPS', 100)),
+        highSeverityAmount=float(highSeverityAmount) if highSeverityAmount else None,
+        maxImmediatePerWindow=int(app.config.get('ALERT_DIGEST_MAX_IMMEDIATE', 10)),
+        maxAttempts=int(app.config.get('ALERT_DIGEST_MAX_ATTEMPTS', 3))
+    )
+    metrics.register('alertDigest', app.AlertDigester.stats)
+    return app.AlertDigester
+
+
+def getBaseAlertSender(app):
+    """Returns the AlertSender configured by ``ALERT_SENDER``, one of ``broker``
+    (default), ``http`` or ``inprocess``.
+
+    For the broker alert sender, if an alert outbox is configured, the alerts are
+    appended to the outbox in the request path and the outbox relay publishes them
+    to the message broker in the background.
+    """
+
+    alertSenderType = app.config.get('ALERT_SENDER', 'broker')
+    if alertSenderType == 'inprocess':
+        from orders.usecases.alert import InProcessAlertSender
+        return InProcessAlertSender()
+
+    if alertSenderType == 'http':
+        from orders.gateway import HTTPTransportGateway
+        from orders.usecases.alert import ExternalServiceAlertSender
+        alertSenderGateway = HTTPTransportGateway(
+            client=app.HTTPClient,
+            host=app.config.ALERT_SENDER_SERVICE_HOST,
+            uri=app.config.ALERT_SENDER_SERVICE_URI,
+            method='POST'
+        )
+        return ExternalServiceAlertSender(gateway=alertSenderGateway)
+
+    from orders.gateway import RabbitMqTransportGateway
+    from orders.retry import RetryingTransportGateway
     alertSenderGateway = RabbitMqTransportGateway(
         rabbitMqClient=app.MessageBrokerClient,
         exchange='dummy-exchange',
@@ -51,92 +313,526 @@ def getTransactionInteractor(app):
             'deliverMode': 'persistent'
         }
     )
+    alertSenderGateway = injectFaults(app, 'alertSenderGateway', alertSenderGateway)
+    alertSenderGateway = RetryingTransportGateway(
+        limitGateway(app, 'alertSenderGateway', alertSenderGateway),
+        getRetryPolicy(app, 'alertSenderGateway', (ConnectionError, asyncio.TimeoutError))
+    )
+    if app.AlertOutbox:
+        from orders.outbox import OutboxRelay
+        from orders.usecases.alert import OutboxAlertSender
+        app.AlertOutboxRelay = OutboxRelay(
+            outbox=app.AlertOutbox,
+            gateway=alertSenderGateway,
+            batchSize=int(app.config.get('ALERT_OUTBOX_BATCH_SIZE', 100))
+        )
+        return OutboxAlertSender(outbox=app.AlertOutbox)
+
+    from orders.usecases.alert import MessageBrokerAlertSender
+    return MessageBrokerAlertSender(messageGateway=alertSenderGateway)
+
+
+def getFraudChecker(app):
+    """Returns the FraudChecker configured by ``FRAUD_CHECKER``, one of ``external``
+    (default) or ``inprocess``, screened by the fraud rules in ``FRAUD_RULES_PATH``
+    if configured. The user of a transaction is identified by ``FRAUD_USER_KEY``,
+    the velocity of the users is tracked only if the rules or the model read it.
+    """
+
+    userKey = app.config.get('FRAUD_USER_KEY', 'payment.card')
+    rulesConfig = None
+    rulesPath = app.config.get('FRAUD_RULES_PATH')
+    if rulesPath:
+        import json
+        with open(rulesPath) as f:
+            rulesConfig = json.load(f)
+    model = None
+    modelPath = app.config.get('FRAUD_MODEL_PATH')
+    if app.config.get('FRAUD_CHECKER', 'external') == 'inprocess' and modelPath:
+        from orders.usecases.fraudmodel import loadFraudModel
+        model = loadFraudModel(modelPath)
+    if (rulesConfig and rulesConfig.get('velocity')) or (model and model.usesHistory):
+        app.VelocityStore = setupVelocityStore(app)
+
+    fraudChecker = injectFaults(app, 'fraudChecker', getBaseFraudChecker(app, model, userKey))
+    if rulesConfig is not None:
+        from orders.usecases.fraudcheck import FraudRules, RuleBasedFraudChecker
+        rules = FraudRules(rulesConfig, velocity=app.VelocityStore, userKey=userKey)
+        fraudChecker = RuleBasedFraudChecker(rules, fallback=fraudChecker)
+        metrics.register('fraudRules', fraudChecker.stats)
+    if app.VelocityStore is not None:
+        from orders.usecases.fraudcheck import VelocityRecordingFraudChecker
+        # every transaction counts towards the velocity of its user
+        fraudChecker = VelocityRecordingFraudChecker(fraudChecker, app.VelocityStore, userKey=userKey)
+    return fraudChecker
+
+
+def getBaseFraudChecker(app, model=None, userKey='payment.card'):
+    if app.config.get('FRAUD_CHECKER', 'external') == 'inprocess':
+        from orders.usecases.fraudcheck import InProcessFraudChecker
+        if model is None:
+            return InProcessFraudChecker()
+        fraudChecker = InProcessFraudChecker(
+            model=model,
+            history=app.VelocityStore if model.usesHistory else None,
+            maxBatchSize=int(app.config.get('FRAUD_MODEL_MAX_BATCH_SIZE', 256)),
+            maxBatchDelay=float(app.config.get('FRAUD_MODEL_MAX_BATCH_DELAY', 0.001)),
+            userKey=userKey
+        )
+        metrics.register('fraudModel', fraudChecker.stats)
+        return fraudChecker
+
+    from aiohttp import ClientConnectionError
+    from orders.gateway import HTTPTransportGateway
+    from orders.retry import RetryingTransportGateway
+    from orders.usecases.fraudcheck import ExternalFraudChecker
     fraudCheckerGateway = HTTPTransportGateway(
         client=app.HTTPClient,
         host=app.config.FRAUD_CHECKER_SERVICE_HOST,
         uri=app.config.FRAUD_CHECKER_SERVICE_URI,
         method='POST'
     )
+    # the fraud check has no side effects, connection errors and timeouts are retried
+    fraudCheckerGateway = injectFaults(app, 'fraudCheckerGateway', fraudCheckerGateway)
+    fraudCheckerGateway = RetryingTransportGateway(
+        limitGateway(app, 'fraudCheckerGateway', fraudCheckerGateway),
+        getRetryPolicy(app, 'fraudCheckerGateway', (ClientConnectionError, asyncio.TimeoutError))
+    )
+    return ExternalFraudChecker(gateway=fraudCheckerGateway)
 
-    # instantiate the alert sender
-    alertSender = InProcessAlertSender()
-    #alertSender = ExternalServiceAlertSender(gateway=alertSenderGateway)
-    alertSender = MessageBrokerAlertSender(messageGateway=alertSenderGateway)
 
-    # instantiate the fraud checker (could also have been the InProcessFraudChecker )
-    # fraudChecker = InProcessFraudChecker()
-    fraudChecker = ExternalFraudChecker(gateway=fraudCheckerGateway)
-    # create the transaction interactor
-    return TransactionProcessor(
-        transactionRepo=app.DB,
-	    validator=TransactionValidator(),                
-	    fraudChecker=fraudChecker,             
-	    alerter=alertSender
+def needsHTTPClient(app):
+    return app.config.get('FRAUD_CHECKER', 'external') == 'external' or (
+        app.config.get('ALERT_SENDER', 'broker') == 'http')
+
+
+def needsMessageBroker(app):
+    return app.config.get('ALERT_SENDER', 'broker') == 'broker' or (
+        app.config.get('RUN_MODE', 'server') == 'consumer')
+
+
+def setupAlertOutbox(app):
+    """Returns the durable outbox the alerts are appended to, or None when no
+    ``ALERT_OUTBOX_PATH`` is configured and alerts are published directly.
+    """
+
+    path = app.config.get('ALERT_OUTBOX_PATH')
+    if not path or app.config.get('ALERT_SENDER', 'broker') != 'broker':
+        return None
+    from orders.outbox import SQLiteOutbox
+    log.info("Setting up Alert Outbox...")
+    outbox = SQLiteOutbox(
+        path,
+        leaseTime=int(app.config.get('ALERT_OUTBOX_LEASE_TIME', 30)),
+        synchronous=app.config.get('ALERT_OUTBOX_SYNCHRONOUS', 'NORMAL')
+    )
+    outbox.setup()
+    return outbox
+
+
+def setupReconciliationLedger(app):
+    """Returns the ledger of the transactions to be resumed, or None when no
+    ``RECONCILE_LEDGER_PATH`` is configured and nothing is reconciled.
+    """
+
+    path = app.config.get('RECONCILE_LEDGER_PATH')
+    if not path:
+        return None
+    from orders.reconcile import SQLiteReconciliationLedger
+    log.info("Setting up Reconciliation Ledger...")
+    ledger = SQLiteReconciliationLedger(
+        path,
+        leaseTime=int(app.config.get('RECONCILE_LEASE_TIME', 60)),
+        synchronous=app.config.get('RECONCILE_SYNCHRONOUS', 'NORMAL')
+    )
+    ledger.setup()
+    return ledger
+
+
+def getReconciler(app, transInteractor):
+    """Creates the Reconciler resuming the stale transactions of the ledger via
+    the (unpartitioned) transaction interactor.
+    """
+
+    from orders.reconcile import Reconciler
+    reconciler = Reconciler(
+        app.ReconciliationLedger,
+        transInteractor,
+        staleAfter=float(app.config.get('RECONCILE_STALE_AFTER', 300)),
+        batchSize=int(app.config.get('RECONCILE_BATCH_SIZE', 50)),
+        concurrency=int(app.config.get('RECONCILE_CONCURRENCY', 5)),
+        pollInterval=float(app.config.get('RECONCILE_POLL_INTERVAL', 5)),
+        retryDelay=float(app.config.get('RECONCILE_RETRY_DELAY', 30)),
+        maxAttempts=int(app.config.get('RECONCILE_MAX_ATTEMPTS', 10))
     )
+    metrics.register('reconciler', reconciler.stats)
+    return reconciler
+
+
+def setupVelocityStore(app):
+    """Creates the store of the per user transaction velocity, consulted by the
+    fraud rules, the fraud model and the controllers, loading the snapshot of the
+    previous run if ``VELOCITY_SNAPSHOT_PATH`` is configured.
+    """
+
+    from orders.velocity import VelocityStore
+    log.info("Setting up Velocity Store...")
+    store = VelocityStore(
+        windowSeconds=int(app.config.get('VELOCITY_WINDOW_SECONDS', 600)),
+        bucketSeconds=int(app.config.get('VELOCITY_BUCKET_SECONDS', 10)),
+        maxUsers=int(app.config.get('VELOCITY_MAX_USERS', 100000))
+    )
+    snapshotPath = app.config.get('VELOCITY_SNAPSHOT_PATH')
+    if snapshotPath:
+        store.load(snapshotPath)
+    metrics.register('velocity', store.stats)
+    return store
+
+
+def setupRateLimiter(app):
+    """Creates the rate limiter of the ``/transact`` api, None if neither a client
+    nor a user rate is configured. It is created before the workers are forked,
+    so that with the ``shared`` backend the limits hold across all of them.
+    """
+
+    from orders.ratelimit import RateLimiter, SharedTokenBucketLimiter, TokenBucketLimiter
+    shared = app.config.get('RATE_LIMIT_BACKEND', 'local') == 'shared'
+
+    def getLimiter(name):
+        rate = float(app.config.get('RATE_LIMIT_{}_RATE'.format(name), 0))
+        if rate <= 0:
+            return None
+        burst = float(app.config.get('RATE_LIMIT_{}_BURST'.format(name), rate))
+        if shared:
+            limiter = SharedTokenBucketLimiter(
+                rate, burst, slots=int(app.config.get('RATE_LIMIT_SHARED_SLOTS', 65536)))
+        else:
+            limiter = TokenBucketLimiter(
+                rate, burst, maxKeys=int(app.config.get('RATE_LIMIT_MAX_KEYS', 100000)))
+        metrics.register('rateLimit.{}'.format(name.lower()), limiter.stats)
+        return limiter
+
+    clientLimiter = getLimiter('CLIENT')
+    userLimiter = getLimiter('USER')
+    if clientLimiter is None and userLimiter is None:
+        return None
+    return RateLimiter(
+        clientLimiter=clientLimiter,
+        userLimiter=userLimiter,
+        clientHeader=app.config.get('RATE_LIMIT_CLIENT_HEADER', 'X-API-Key'),
+        userKey=app.config.get('RATE_LIMIT_USER_KEY', 'payment.card')
+    )
+
+
+def setupSharedCache(app):
+    """Creates the cache shared by all the workers of the node, None if
+    ``SHARED_CACHE_SLOTS`` is 0. It has to be created before the workers are forked.
+    """
+
+    slots = int(app.config.get('SHARED_CACHE_SLOTS', 0))
+    if slots <= 0:
+        return None
+    from orders.sharedcache import SharedMemoryCache
+    cache = SharedMemoryCache(
+        slots=slots,
+        maxValueSize=int(app.config.get('SHARED_CACHE_MAX_VALUE_SIZE', 1024)),
+        ways=int(app.config.get('SHARED_CACHE_WAYS', 8)),
+        stripes=int(app.config.get('SHARED_CACHE_STRIPES', 64))
+    )
+    metrics.register('sharedCache', cache.stats)
+    return cache
+
+
+def setupIdempotencyGuard(app):
+    """Creates the guard used by the controllers to process an ``Idempotency-Key``
+    only once. The in memory store can be backed by a shared store so that the
+    keys are honoured across workers, which needs the shared cache.
+    """
+
+    ttl = int(app.config.get('IDEMPOTENCY_KEY_TTL', 86400))
+    backend = None
+    if app.config.get('IDEMPOTENCY_BACKEND', 'local') == 'shared':
+        if not getattr(app, 'SharedCache', None):
+            raise ValueError("IDEMPOTENCY_BACKEND=shared needs the shared cache, set SHARED_CACHE_SLOTS")
+        from orders.idempotency import SharedMemoryIdempotencyStore
+        backend = SharedMemoryIdempotencyStore(app.SharedCache)
+    store = InMemoryIdempotencyStore(
+        maxSize=int(app.config.get('IDEMPOTENCY_MAX_KEYS', 100000)),
+        ttl=ttl,
+        backend=backend
+    )
+    return IdempotencyGuard(
+        store, ttl=ttl, inFlightTtl=float(app.config.get('IDEMPOTENCY_IN_FLIGHT_TTL', 120)))
 
 
 def setupAiohttpClientSession(loop):
+    from aiohttp import ClientSession
     return ClientSession(loop=loop)
 
 async def setupMessageBroker(app, loop):
+    from orders.compression import PayloadCodec
+    from orders.rabbitmq_client import AioPikaClient
+    level = app.config.get('MESSAGE_BROKER_COMPRESSION_LEVEL')
+    codec = PayloadCodec(
+        algorithm=app.config.get('MESSAGE_BROKER_COMPRESSION') or None,
+        level=int(level) if level else None,
+        threshold=int(app.config.get('MESSAGE_BROKER_COMPRESSION_THRESHOLD', 1024)),
+        maxSize=int(app.config.get('MESSAGE_BROKER_MAX_BODY_SIZE', 1024 * 1024))
+    )
     client = AioPikaClient(
         username=app.config.MESSAGE_BROKER_SERVICE_USERNAME,
         password=app.config.MESSAGE_BROKER_SERVICE_PASSWORD,
         host=app.config.MESSAGE_BROKER_SERVICE_HOST,
         port=int(app.config.MESSAGE_BROKER_SERVICE_PORT),
         virtualhoat=app.config.MESSAGE_BROKER_SERVICE_VIRTUALHOST,
-        loop=loop
+        loop=loop,
+        codec=codec
     )
-    
+    metrics.register('brokerCompression', client.stats)
+
     # setup the connection and channel that will be used across the app
     log.info("Setting up Message Broker...")
     await client.setup()
     return client
 
+async def setupDependencies(app, loop, report):
+    """Sets up all the dependencies and the usecase interactors on the app. This
+    is shared by both the run modes, the http server and the queue consumer.
+
+    Independent dependencies are set up concurrently and the time each of them
+    takes is recorded in the startup report.
+    """
+
+    app.HTTPClient = None
+    app.DB = None
+    app.MessageBrokerClient = None
+    app.AlertOutbox = None
+    app.AlertOutboxRelay = None
+    app.VelocityStore = None
+    app.AlertDigester = None
+    app.ReconciliationLedger = None
+    app.Reconciler = None
+    app.Faults = setupFaults(app)
+
+    async def db():
+        if app.config.get('DB_BACKEND', 'mongodb') == 'journal':
+            app.DB = await setupJournal(app)
+        else:
+            app.DB = await setupDB(
+                app.config.DB_HOST, int(app.config.DB_PORT), app.config.DB_NAME,
+                app.config.DB_USER, app.config.DB_PASSWORD
+            )
+        repository = injectFaults(app, 'repository', app.DB)
+        app.DB = setupRepositoryCache(app, limitRepository(app, repository))
+
+    async def messageBroker():
+        app.MessageBrokerClient = await setupMessageBroker(app, loop)
+
+    # add async http client to the app using aiohttp, only if some gateway needs it
+    if needsHTTPClient(app):
+        app.HTTPClient = report.measure('httpClient', setupAiohttpClientSession, loop)
+    # setup the DB and the message broker connections concurrently
+    setups = [report.timed('db', db())]
+    if needsMessageBroker(app):
+        setups.append(report.timed('messageBroker', messageBroker()))
+    await asyncio.gather(*setups)
+    # setup the local outbox for the alerts if configured
+    app.AlertOutbox = report.measure('alertOutbox', setupAlertOutbox, app)
+    app.ReconciliationLedger = report.measure('reconciliationLedger', setupReconciliationLedger, app)
+    # get the usecase interactors here, so that app can use the interactors
+    # to perform the usecases, here get/create the transaction specific interactor
+    app.TransInteractor = report.measure('interactors', getTransactionInteractor, app)
+    if app.ReconciliationLedger:
+        app.Reconciler = getReconciler(app, app.TransInteractor)
+    app.TransInteractor = partitionTransactionInteractor(app, app.TransInteractor)
+    # every dependency is wrapped by now, hence the fault targets are all known
+    await activateFaults(app)
+    # start relaying the alerts left in the outbox (including the ones left behind
+    # by a previous run) to the message broker
+    if app.AlertOutboxRelay:
+        app.AlertOutboxRelay.start()
+    # resume the transactions left behind, by this or any previous run
+    if app.Reconciler:
+        app.Reconciler.start()
+
+
+async def closeDependencies(app):
+    if getattr(app, 'Faults', None):
+        await app.Faults.close()
+    # stop resuming transactions, the claimed ones are claimed again once their lease expires
+    if getattr(app, 'Reconciler', None):
+        await app.Reconciler.stop()
+    # send out the alerts still being digested while the senders are up
+    if getattr(app, 'AlertDigester', None):
+        await app.AlertDigester.close()
+    # stop relaying, the pending alerts stay in the outbox for the next run
+    if getattr(app, 'AlertOutboxRelay', None):
+        await app.AlertOutboxRelay.stop()
+    # close the db connection
+    if getattr(app, 'DB', None):
+        log.info("Closing Db connection...")
+        await app.DB.close()
+    # close the message broker connection
+    if getattr(app, 'MessageBrokerClient', None):
+        log.info("Closing message broker connection...")
+        await app.MessageBrokerClient.close()
+    if getattr(app, 'AlertOutbox', None):
+        app.AlertOutbox.close()
+    if getattr(app, 'ReconciliationLedger', None):
+        app.ReconciliationLedger.close()
+    if getattr(app, 'VelocityStore', None) and app.config.get('VELOCITY_SNAPSHOT_PATH'):
+        app.VelocityStore.snapshot(app.config.VELOCITY_SNAPSHOT_PATH)
+
+
+def startLoopMonitor(app):
+    """Starts monitoring the lag and the stalls of the running event loop, the
+    monitor is exported under the ``eventLoop`` metrics. A ``LOOP_MONITOR_INTERVAL``
+    of 0 disables it.
+    """
+
+    interval = float(app.config.get('LOOP_MONITOR_INTERVAL', 0.05))
+    if interval <= 0:
+        return None
+    monitor = LoopMonitor(
+        interval=interval,
+        stallThreshold=float(app.config.get('LOOP_STALL_THRESHOLD', 0.1))
+    )
+    monitor.start()
+    metrics.register('eventLoop', monitor.stats)
+    return monitor
+
+
+async def stopLoopMonitor(app):
+    if getattr(app, 'LoopMonitor', None):
+        await app.LoopMonitor.stop()
+        metrics.unregister('eventLoop')
+        app.LoopMonitor = None
+
+
+async def warmUp(app, loop):
+    """Sets up the dependencies in the background once the server is listening,
+    the app turns ready (see the readiness endpoint) only when this completes.
+    If the warm up fails the server is stopped, just like a failing
+    ``before_server_start`` listener would have done.
+    """
+
+    try:
+        await setupDependencies(app, loop, app.StartupReport)
+        # guard the transaction usecase against client retries
+        app.IdempotencyGuard = app.StartupReport.measure(
+            'idempotencyGuard', setupIdempotencyGuard, app)
+    except Exception as exc:
+        log.error("Warm up raised exception, stopping server: {}".format(exc))
+        app.stop()
+        return
+
+    app.StartupReport.done()
+    app.Ready = True
+
+
 @app.listener('before_server_start')
 async def before_start(app, loop):
     # add the api routes
     addRoutes(app)
-    # first add async http client to the app using aiohttp
-    app.HTTPClient = setupAiohttpClientSession(loop)
-    # now setup the DB connections
-    app.DB = await setupDB(
-        app.config.DB_HOST, int(app.config.DB_PORT), app.config.DB_NAME,
-        app.config.DB_USER, app.config.DB_PASSWORD
-    )
-    # get the message broker connection
-    app.MessageBrokerClient = await setupMessageBroker(app, loop)
-    # get the usecase interactors here, so that app can use the interactors
-    # to perform the usecases, here get/create the transaction specific interactor
-    app.TransInteractor = getTransactionInteractor(app)
-    
+    app.Ready = False
+    app.StartupReport = StartupReport()
+
     log.info('Starting server on http://{}:{}'.format(app.config.HOST, app.config.PORT))
 
 
 @app.listener('after_server_start')
 async def after_start(app, loop):
     log.info("\nServer Started.\n")
+    # monitor the loop right away, so that stalls during the warm up show up too
+    app.LoopMonitor = startLoopMonitor(app)
+    # warm up in the background, so that the readiness endpoint can be polled while
+    # the dependencies are being set up
+    app.WarmUp = asyncio.ensure_future(warmUp(app, loop))
 
 
 @app.listener('before_server_stop')
 async def before_stop(app, loop):
     log.info("Stopping Server....")
+    app.Ready = False
+    warmUpTask = getattr(app, 'WarmUp', None)
+    if warmUpTask and not warmUpTask.done():
+        warmUpTask.cancel()
+    await stopLoopMonitor(app)
 
 
 @app.listener('after_server_stop')
 async def after_stop(app, loop):
-    # close the db connection
-    log.info("Closing Db connection...")
-    await app.DB.close()
-    # close the message broker connection
-    log.info("Closing message broker connection...")
-    await app.MessageBrokerClient.close()
+    await closeDependencies(app)
+
+
+def getTransactionConsumer(app):
+    """Creates the consumer which takes transaction requests from the message
+    broker and publishes the results to the reply exchange.
+    """
+
+    from orders.gateway import RabbitMqTransportGateway
+    from orders.consumer import TransactionConsumer
+    replyGateway = RabbitMqTransportGateway(
+        rabbitMqClient=app.MessageBrokerClient,
+        exchange=app.config.get('CONSUMER_REPLY_EXCHANGE', 'dummy-transactions-reply'),
+        routing_key=app.config.get('CONSUMER_REPLY_ROUTING_KEY', 'dummy-transactions-result'),
+        options={
+            'exchangeType': 'topic',
+            'deliverMode': 'persistent'
+        }
+    )
+    return TransactionConsumer(
+        rabbitMqClient=app.MessageBrokerClient,
+        transInteractor=app.TransInteractor,
+        replyGateway=replyGateway,
+        queue=app.config.get('CONSUMER_QUEUE', 'dummy-transactions'),
+        exchange=app.config.get('CONSUMER_EXCHANGE', 'dummy-exchange'),
+        options={
+            'set_qos': int(app.config.get('CONSUMER_PREFETCH', 10)),
+            'exchangeType': 'topic',
+            'queueDurable': True,
+            'bindingKey': app.config.get('CONSUMER_BINDING_KEY', 'dummy-transactions')
+        },
+        concurrency=int(app.config.get('CONSUMER_CONCURRENCY', 10)),
+        timeout=float(app.config.get('TRANSACTION_TIMEOUT', 30))
+    )
 
 
 def startServer():
     # app.config.from_envvar('SANIC_APP_ORDERS_SETTINGS')
+    setEventLoopPolicy(app.config.get('EVENT_LOOP', 'auto'))
+    app.RateLimiter = setupRateLimiter(app)
+    app.SharedCache = setupSharedCache(app)
     app.run(host=app.config.HOST, port=int(app.config.PORT), workers=int(app.config.WORKERS))
-        
+
+
+def startConsumer():
+    """Runs the service as a queue consumer instead of an http server."""
+
+    loopType = setEventLoopPolicy(app.config.get('EVENT_LOOP', 'auto'))
+    log.info("Using the {} event loop".format(loopType))
+    loop = asyncio.get_event_loop()
+    app.LoopMonitor = startLoopMonitor(app)
+    report = StartupReport()
+    loop.run_until_complete(setupDependencies(app, loop, report))
+    consumer = getTransactionConsumer(app)
+    loop.run_until_complete(report.timed('consumer', consumer.start()))
+    report.done()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        log.info("Stopping Consumer....")
+        loop.run_until_complete(consumer.stop())
+        loop.run_until_complete(stopLoopMonitor(app))
+        loop.run_until_complete(closeDependencies(app))
+        loop.close()
+
 
 if __name__ == "__main__":
-    startServer()
+    if app.config.get('RUN_MODE', 'server') == 'consumer':
+        startConsumer()
+    else:
+        startServer()
@@ -0,0 +1,206 @@
+"""The sharedcache module is a key value cache shared by all the workers of a node,
+so that a value cached by one worker (an idempotency result, a verdict, etc) is a
+hit in every other one, and the node keeps one copy of it instead of one per worker.
+
+The SharedMemoryCache is a fixed size hash table in an anonymous shared memory map,
+created before the workers are forked. The table is set associative: a key hashes
+to one bucket of ``ways`` slots and lives in one of them, when none of them is free
+or expired the least recently read one is evicted, which makes the eviction an
+approximate LRU at the cost of a scan of a handful of slots.
+
+Every slot holds the 128 bit hash of its key, a sequence number, the length of the
+value, the expiry and last read times, and room for a value of up to
+``maxValueSize`` bytes; larger values are not cached. The buckets are spread over
+``stripes`` locks, writers take the lock of the bucket while readers take no lock
+at all: a writer makes the sequence number of the slot odd while it rewrites the
+slot and even again once done, and a reader retries a slot whose sequence number
+was odd or changed while it read it (a seqlock).
+"""
+
+
+import hashlib
+import mmap
+import multiprocessing
+import struct
+import time
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+
+
+log = getCustomLogger(__name__)
+
+
+class SharedMemoryCache(object):
+    """A fixed size shared memory cache of bytes values, it must be created
+    before the workers are forked.
+
+    The times are monotonic, which on linux is the same clock in all the
+    processes of the node.
+    """
+
+    # keyHash1, keyHash2, sequence, length, expiresAt, readAt
+    _HEADER = struct.Struct('<QQIIdd')
+    _SEQUENCE = struct.Struct('<I')
+    _READ_AT = struct.Struct('<d')
+    _SEQUENCE_OFFSET = 16
+    _READ_AT_OFFSET = 32
+    _READ_RETRIES = 4
+
+    def __init__(self, slots=65536, maxValueSize=1024, ways=8, stripes=64):
+        self._ways = ways
+        self._numBuckets = max(1, slots // ways)
+        self._maxValueSize = maxValueSize
+        self._slotSize = self._HEADER.size + maxValueSize
+        self._bucketSize = self._ways * self._slotSize
+        self._table = mmap.mmap(-1, self._numBuckets * self._bucketSize)
+        self._locks = [multiprocessing.Lock() for _ in range(min(stripes, self._numBuckets))]
+        self._hits = 0
+        self._misses = 0
+        self._sets = 0
+        self._evictions = 0
+        self._tooLarge = 0
+        self._contended = 0
+
+    @property
+    def maxValueSize(self):
+        return self._maxValueSize
+
+    def get(self, key, now=None):
+        """Returns the value of the key or None if it is missing or has expired."""
+
+        now = time.monotonic() if now is None else now
+        hash1, hash2 = _hashKey(key)
+        bucket = hash1 % self._numBuckets
+        table = self._table
+        header = self._HEADER
+        for way in range(self._ways):
+            offset = bucket * self._bucketSize + way * self._slotSize
+            for _ in range(self._READ_RETRIES):
+                slotHash1, slotHash2, sequence, length, expiresAt, _ = header.unpack_from(table, offset)
+                if sequence & 1:
+                    # a writer is rewriting the slot
+                    self._contended += 1
+                    continue
+                if slotHash1 != hash1 or slotHash2 != hash2:
+                    break
+                value = table[offset + header.size:offset + header.size + length]
+                if self._SEQUENCE.unpack_from(table, offset + self._SEQUENCE_OFFSET)[0] != sequence:
+                    self._contended += 1
+                    continue
+                if expiresAt <= now:
+                    self._misses += 1
+                    return None
+                # racing with a writer at worst leaves a slightly wrong read time
+                self._READ_AT.pack_into(table, offset + self._READ_AT_OFFSET, now)
+                self._hits += 1
+                return value
+        self._misses += 1
+        return None
+
+    def set(self, key, value, ttl, now=None):
+        """Caches the bytes value for ttl seconds, returns False if the value is
+        larger than ``maxValueSize`` and is not cached.
+        """
+
+        if len(value) > self._maxValueSize:
+            self._tooLarge += 1
+            return False
+        now = time.monotonic() if now is None else now
+        hash1, hash2 = _hashKey(key)
+        bucket = hash1 % self._numBuckets
+        with self._locks[bucket % len(self._locks)]:
+            offset = self._findSlot(bucket, hash1, hash2, now)
+            self._write(offset, hash1, hash2, value, now + ttl, now)
+        self._sets += 1
+        return True
+
+    def add(self, key, value, ttl, now=None):
+        """Caches the bytes value for ttl seconds only if the key has no live
+        value, atomically across the workers, returns True if it was cached.
+        """
+
+        if len(value) > self._maxValueSize:
+            self._tooLarge += 1
+            return False
+        now = time.monotonic() if now is None else now
+        hash1, hash2 = _hashKey(key)
+        bucket = hash1 % self._numBuckets
+        with self._locks[bucket % len(self._locks)]:
+            offset = self._findSlot(bucket, hash1, hash2, now)
+            slotHash1, slotHash2, _, _, expiresAt, _ = self._HEADER.unpack_from(self._table, offset)
+            if slotHash1 == hash1 and slotHash2 == hash2 and expiresAt > now:
+                return False
+            self._write(offset, hash1, hash2, value, now + ttl, now)
+        self._sets += 1
+        return True
+
+    def delete(self, key):
+        hash1, hash2 = _hashKey(key)
+        bucket = hash1 % self._numBuckets
+        with self._locks[bucket % len(self._locks)]:
+            for way in range(self._ways):
+                offset = bucket * self._bucketSize + way * self._slotSize
+                slotHash1, slotHash2 = self._HEADER.unpack_from(self._table, offset)[:2]
+                if slotHash1 == hash1 and slotHash2 == hash2:
+                    self._write(offset, 0, 0, b'', 0.0, 0.0)
+                    return True
+        return False
+
+    def stats(self):
+        """The counters are of this worker, the table is shared by all of them."""
+
+        lookups = self._hits + self._misses
+        return OrderedDict([
+            ('slots', self._numBuckets * self._ways),
+            ('maxValueSize', self._maxValueSize),
+            ('hits', self._hits),
+            ('misses', self._misses),
+            ('hitRate', round(self._hits / lookups, 4) if lookups else None),
+            ('sets', self._sets),
+            ('evictions', self._evictions),
+            ('tooLarge', self._tooLarge),
+            ('contendedReads', self._contended)
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _findSlot(self, bucket, hash1, hash2, now):
+        """Returns the offset of the slot of the key in the bucket: its own one, a
+        free or expired one, or the least recently read one.
+        """
+
+        free, victim, victimReadAt = None, None, None
+        for way in range(self._ways):
+            offset = bucket * self._bucketSize + way * self._slotSize
+            slotHash1, slotHash2, _, _, expiresAt, readAt = self._HEADER.unpack_from(self._table, offset)
+            if slotHash1 == hash1 and slotHash2 == hash2:
+                return offset
+            if free is None and ((slotHash1 == 0 and slotHash2 == 0) or expiresAt <= now):
+                free = offset
+            elif victim is None or readAt < victimReadAt:
+                victim, victimReadAt = offset, readAt
+        if free is not None:
+            return free
+        self._evictions += 1
+        return victim
+
+    def _write(self, offset, hash1, hash2, value, expiresAt, readAt):
+        table = self._table
+        sequence = self._SEQUENCE.unpack_from(table, offset + self._SEQUENCE_OFFSET)[0]
+        # odd while the slot is being rewritten, the readers retry or skip it
+        self._SEQUENCE.pack_into(table, offset + self._SEQUENCE_OFFSET, (sequence + 1) & 0xFFFFFFFF)
+        valueOffset = offset + self._HEADER.size
+        table[valueOffset:valueOffset + len(value)] = value
+        self._HEADER.pack_into(
+            table, offset, hash1, hash2, (sequence + 1) & 0xFFFFFFFF, len(value), expiresAt, readAt)
+        self._SEQUENCE.pack_into(table, offset + self._SEQUENCE_OFFSET, (sequence + 2) & 0xFFFFFFFF)
+
+
+def _hashKey(key):
+    digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+    hash1, hash2 = struct.unpack('<QQ', digest)
+    # a hash of 0, 0 marks a free slot
+    return hash1 or 1, hash2
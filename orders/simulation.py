@@ -0,0 +1,409 @@
+"""The simulation module runs the real TransactionProcessor against simulated
+dependencies on a virtual time event loop, for capacity planning.
+
+The VirtualTimeEventLoop never waits: whenever there is nothing ready to run it
+jumps the clock straight to the next scheduled timer, hence an ``asyncio.sleep``
+of an hour costs nothing and an hour of traffic is simulated in however long the
+CPU takes to run the code. The latency of each dependency is drawn from a pluggable
+distribution (constant, uniform, exponential, lognormal fitted from percentiles or
+an empirical one built from a production histogram).
+
+The service is modelled as a number of workers, each with a limit on the
+transactions in flight and on the transactions queued waiting for it, plus an
+optional CPU time per transaction during which the worker's event loop is busy.
+
+    $ python -m orders.simulation --transactions 1000000 --rate 2000 \\
+        --workers 4 --concurrency 200 --latencies latencies.json
+
+where latencies.json looks like::
+
+    {
+        "fraudChecker": {"type": "lognormal", "p50": 0.04, "p99": 0.3},
+        "repository": {"type": "histogram", "bounds": [0, 0.005, 0.01, 0.05],
+                       "counts": [700, 250, 50]},
+        "alertSender": {"type": "constant", "value": 0.002},
+        "paymentProcessor": {"type": "uniform", "low": 0.05, "high": 0.5},
+        "cpu": {"type": "constant", "value": 0.0005}
+    }
+"""
+
+
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import math
+import random
+import selectors
+import time
+from collections import Counter, OrderedDict
+
+from orders.domain.order import Repository
+from orders.domain.payment import PaymentProcessor
+from orders.usecases.alert import AlertSender
+from orders.usecases.fraudcheck import FraudChecker
+from orders.usecases.transact import (
+    TransactionProcessor, TransactionRequest, TransactionValidator
+)
+
+
+#---------------------------------------#
+#          Virtual Time Loop            #
+#---------------------------------------#
+
+class _VirtualTimeSelector(selectors.SelectSelector):
+    """A selector which instead of blocking for timeout seconds advances the
+    virtual clock by timeout and returns right away.
+
+    Nothing in a simulation does real I/O, hence no file descriptor is ever
+    polled, which saves a syscall per loop iteration.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        if timeout is not None and timeout > 0:
+            self.now += timeout
+        return []
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """An event loop whose clock only moves when there is nothing to run."""
+
+    def __init__(self):
+        self._virtualTimeSelector = _VirtualTimeSelector()
+        super().__init__(self._virtualTimeSelector)
+
+    def time(self):
+        return self._virtualTimeSelector.now
+
+
+#---------------------------------------#
+#       Latency Distributions           #
+#---------------------------------------#
+
+class Constant(object):
+    def __init__(self, value):
+        self._value = value
+
+    def sample(self, rng):
+        return self._value
+
+
+class Uniform(object):
+    def __init__(self, low, high):
+        self._low = low
+        self._high = high
+
+    def sample(self, rng):
+        return rng.uniform(self._low, self._high)
+
+
+class Exponential(object):
+    def __init__(self, mean):
+        self._rate = 1.0 / mean
+
+    def sample(self, rng):
+        return rng.expovariate(self._rate)
+
+
+class LogNormal(object):
+    """Lognormal latency, usually fitted from the p50 and p99 of a dependency
+    using ``LogNormal.fromPercentiles``.
+    """
+
+    # z score of the 99th percentile of the standard normal distribution
+    _Z99 = 2.3263478740408408
+
+    def __init__(self, mu, sigma):
+        self._mu = mu
+        self._sigma = sigma
+
+    @classmethod
+    def fromPercentiles(cls, p50, p99):
+        mu = math.log(p50)
+        return cls(mu, (math.log(p99) - mu) / cls._Z99)
+
+    def sample(self, rng):
+        return rng.lognormvariate(self._mu, self._sigma)
+
+
+class Histogram(object):
+    """Empirical latency taken from a production histogram, ``bounds`` are the
+    bucket boundaries (one more than ``counts``). A bucket is picked with the
+    probability of its count and the latency is uniform within the bucket.
+    """
+
+    def __init__(self, bounds, counts):
+        if len(bounds) != len(counts) + 1:
+            raise ValueError("A histogram needs len(counts) + 1 bounds")
+        self._bounds = bounds
+        total = float(sum(counts))
+        self._cumulative = []
+        cumulative = 0
+        for count in counts:
+            cumulative += count
+            self._cumulative.append(cumulative / total)
+
+    def sample(self, rng):
+        bucket = bisect.bisect_left(self._cumulative, rng.random())
+        bucket = min(bucket, len(self._cumulative) - 1)
+        return rng.uniform(self._bounds[bucket], self._bounds[bucket + 1])
+
+
+def latencyFromConfig(config):
+    """Builds a latency distribution from its json config."""
+
+    latencyType = config['type']
+    if latencyType == 'constant':
+        return Constant(config['value'])
+    if latencyType == 'uniform':
+        return Uniform(config['low'], config['high'])
+    if latencyType == 'exponential':
+        return Exponential(config['mean'])
+    if latencyType == 'lognormal':
+        if 'p50' in config:
+            return LogNormal.fromPercentiles(config['p50'], config['p99'])
+        return LogNormal(config['mu'], config['sigma'])
+    if latencyType == 'histogram':
+        return Histogram(config['bounds'], config['counts'])
+    raise ValueError("Unknown latency type: {}".format(latencyType))
+
+
+# the same ranges the dummy dependencies sleep for
+DEFAULT_LATENCIES = {
+    'fraudChecker': Uniform(0.1, 1),
+    'repository': Constant(0.5),
+    'alertSender': Uniform(0.05, 0.5),
+    'paymentProcessor': Uniform(0.05, 0.5),
+    'cpu': Constant(0)
+}
+
+
+#---------------------------------------#
+#       Simulated Dependencies          #
+#---------------------------------------#
+
+class SimulatedFraudChecker(FraudChecker):
+    def __init__(self, latency, rng, fraudRate=0.02):
+        self._latency = latency
+        self._rng = rng
+        self._fraudRate = fraudRate
+
+    async def isFraud(self, transaction):
+        await asyncio.sleep(self._latency.sample(self._rng))
+        return self._rng.random() < self._fraudRate
+
+
+class SimulatedRepository(Repository):
+    def __init__(self, latency, rng):
+        self._latency = latency
+        self._rng = rng
+        self._nextID = 0
+
+    async def findByID(self, uID):
+        await asyncio.sleep(self._latency.sample(self._rng))
+        return None
+
+    async def store(self, objToStore):
+        await asyncio.sleep(self._latency.sample(self._rng))
+        if not objToStore.transactionID:
+            self._nextID += 1
+            objToStore.transactionID = self._nextID
+        return objToStore
+
+
+class SimulatedAlertSender(AlertSender):
+    def __init__(self, latency, rng):
+        self._latency = latency
+        self._rng = rng
+
+    async def send(self, alertObject):
+        await asyncio.sleep(self._latency.sample(self._rng))
+
+
+class SimulatedPaymentProcessor(PaymentProcessor):
+    def __init__(self, latency, rng, errorRate=0.0):
+        self._latency = latency
+        self._rng = rng
+        self._errorRate = errorRate
+
+    async def pay(self, payment):
+        await asyncio.sleep(self._latency.sample(self._rng))
+        if self._errorRate and self._rng.random() < self._errorRate:
+            raise Exception("Simulated payment error")
+        return True
+
+
+#---------------------------------------#
+#             Simulation                #
+#---------------------------------------#
+
+class _Worker(object):
+    """A worker process with a limit on the transactions it runs concurrently
+    and on the ones queued for it, and an event loop busy for the cpu time of
+    each transaction.
+    """
+
+    def __init__(self, concurrency, maxQueue):
+        self.slots = asyncio.Semaphore(concurrency)
+        self.cpu = asyncio.Lock()
+        self.maxQueue = maxQueue
+        self.queued = 0
+
+
+class CapacitySimulation(object):
+    """Drives Poisson arrivals of transactions through the real TransactionProcessor
+    spread over the workers and reports throughput, queueing and latencies.
+    """
+
+    def __init__(self, workers=1, concurrency=100, maxQueue=1000, latencies=None,
+            fraudRate=0.02, paymentErrorRate=0.0, requests=None, seed=None):
+        self._rng = random.Random(seed)
+        self._latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self._numWorkers = workers
+        self._concurrency = concurrency
+        self._maxQueue = maxQueue
+        self._requests = requests or [{
+            'order': {'id': 1234, 'name': 'simulated order', 'cost': 123.00, 'currency': 'INR'},
+            'paymentMethod': 'amazonpay',
+            'payment': {'card': 1234567887654321, 'type': 'wallet', 'amount': 123.00, 'currency': 'INR'}
+        }]
+        paymentProcessor = SimulatedPaymentProcessor(
+            self._latencies['paymentProcessor'], self._rng, paymentErrorRate)
+        self._processor = TransactionProcessor(
+            transactionRepo=SimulatedRepository(self._latencies['repository'], self._rng),
+            validator=TransactionValidator(),
+            fraudChecker=SimulatedFraudChecker(self._latencies['fraudChecker'], self._rng, fraudRate),
+            alerter=SimulatedAlertSender(self._latencies['alertSender'], self._rng),
+            paymentProcessorFactory=lambda paymentMethod: paymentProcessor
+        )
+
+    def run(self, transactions, rate):
+        """Simulates ``transactions`` arriving at ``rate`` per second and returns
+        the report.
+        """
+
+        loop = VirtualTimeEventLoop()
+        try:
+            return loop.run_until_complete(self._simulate(transactions, rate))
+        finally:
+            loop.close()
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    async def _simulate(self, transactions, rate):
+        loop = asyncio.get_event_loop()
+        workers = [_Worker(self._concurrency, self._maxQueue) for _ in range(self._numWorkers)]
+        self._queueTimes = []
+        self._latencyTimes = []
+        self._statuses = Counter()
+        self._rejected = 0
+        self._maxQueued = 0
+
+        startTime = loop.time()
+        tasks = set()
+        for i in range(transactions):
+            await asyncio.sleep(self._rng.expovariate(rate))
+            worker = workers[i % self._numWorkers]
+            if worker.queued >= worker.maxQueue:
+                self._rejected += 1
+                continue
+            request = self._requests[i % len(self._requests)]
+            task = asyncio.ensure_future(self._transact(loop, worker, request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(list(tasks))
+
+        return self._report(transactions, loop.time() - startTime)
+
+    async def _transact(self, loop, worker, request):
+        arrivalTime = loop.time()
+        worker.queued += 1
+        self._maxQueued = max(self._maxQueued, worker.queued)
+        async with worker.slots:
+            worker.queued -= 1
+            self._queueTimes.append(loop.time() - arrivalTime)
+            cpuTime = self._latencies['cpu'].sample(self._rng)
+            if cpuTime:
+                async with worker.cpu:
+                    await asyncio.sleep(cpuTime)
+            transaction = await self._processor.process(TransactionRequest(
+                order=request['order'],
+                paymentMethod=request['paymentMethod'],
+                payment=request['payment']
+            ))
+        self._latencyTimes.append(loop.time() - arrivalTime)
+        self._statuses[transaction.status] += 1
+
+    def _report(self, transactions, duration):
+        completed = len(self._latencyTimes)
+        return OrderedDict([
+            ('transactions', transactions),
+            ('completed', completed),
+            ('rejected', self._rejected),
+            ('virtualSeconds', round(duration, 3)),
+            ('throughput', round(completed / duration, 3) if duration else None),
+            ('maxQueuedPerWorker', self._maxQueued),
+            ('queueTime', _percentiles(self._queueTimes)),
+            ('latency', _percentiles(self._latencyTimes)),
+            ('statuses', dict(self._statuses))
+        ])
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    last = len(values) - 1
+    return OrderedDict(
+        ('p{}'.format(p), round(values[min(last, int(math.ceil(p / 100.0 * len(values))) - 1)], 6))
+        for p in (50, 90, 99, 99.9)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Capacity simulation of the transaction pipeline')
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=1000, help='arrivals per (virtual) second')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=100, help='max transactions in flight per worker')
+    parser.add_argument('--max-queue', type=int, default=1000, help='max transactions queued per worker')
+    parser.add_argument('--latencies', help='json file with the latency distribution of each dependency')
+    parser.add_argument('--requests', help='jsonl file of transaction request bodies to replay')
+    parser.add_argument('--fraud-rate', type=float, default=0.02)
+    parser.add_argument('--payment-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    # the pipeline logs every payment, which would dominate the simulation time
+    logging.disable(logging.INFO)
+
+    latencies = {}
+    if args.latencies:
+        with open(args.latencies) as f:
+            latencies = {name: latencyFromConfig(config) for name, config in json.load(f).items()}
+    requests = None
+    if args.requests:
+        with open(args.requests) as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+
+    simulation = CapacitySimulation(
+        workers=args.workers, concurrency=args.concurrency, maxQueue=args.max_queue,
+        latencies=latencies, fraudRate=args.fraud_rate,
+        paymentErrorRate=args.payment_error_rate, requests=requests, seed=args.seed
+    )
+    start = time.perf_counter()
+    report = simulation.run(args.transactions, args.rate)
+    report['wallSeconds'] = round(time.perf_counter() - start, 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""The startup module keeps track of how long each step of a worker's warm up
+takes, so that slow restarts and scale outs can be traced to the dependency
+responsible for them.
+"""
+
+
+import time
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+
+
+log = getCustomLogger(__name__)
+
+
+class StartupReport(object):
+    """Records the wall time of the named startup steps of a worker.
+
+    Steps may run concurrently, hence the total time is measured separately and
+    is usually less than the sum of the steps.
+    """
+
+    def __init__(self):
+        self._startTime = time.perf_counter()
+        self._endTime = None
+        self._steps = OrderedDict()
+
+    async def timed(self, name, awaitable):
+        """Awaits the awaitable and records how long it took under name."""
+
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self._steps[name] = time.perf_counter() - start
+
+    def measure(self, name, func, *args, **kwargs):
+        """Calls func and records how long it took under name."""
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._steps[name] = time.perf_counter() - start
+
+    def done(self):
+        self._endTime = time.perf_counter()
+        log.info("Startup completed: {}".format(self.toDict()))
+
+    @property
+    def isDone(self):
+        return self._endTime is not None
+
+    def toDict(self):
+        endTime = self._endTime or time.perf_counter()
+        return {
+            'totalMs': round((endTime - self._startTime) * 1000, 3),
+            'stepsMs': OrderedDict(
+                (name, round(duration * 1000, 3)) for name, duration in self._steps.items()
+            )
+        }
@@ -2,7 +2,8 @@
 classes the describe the alert sending methods.
 
 It has an AlertSender interface which other concrete AlertSenders like InProcessAlertSender,
-MessageBrokerAlertSender, ExternalServiceAlertSEnder, etc implement.
+MessageBrokerAlertSender, OutboxAlertSender, ExternalServiceAlertSEnder, DigestingAlertSender,
+etc implement.
 
 This package also consists of all those concrete AlertSender implementation mentioned
 above.
@@ -10,7 +11,10 @@ above.
 
 
 import abc
+import asyncio
 import random
+import time
+from collections import OrderedDict
 
 from asyncio import sleep
 # from sanic.log import logger as log
@@ -64,6 +68,17 @@ class InProcessAlertSender(metaclass=abc.ABCMeta):
     
 
 
+def createBrokerAlertMessage(alertObject):
+    """Returns the alert message published to the message broker for the alert
+    object, directly or via the outbox.
+    """
+
+    return {
+        'alertTypes': ['sms', 'email'],
+        'message': alertObject.toDict()
+    }
+
+
 class MessageBrokerAlertSender(AlertSender):
     """This alertSender sends message via some message broker
     using a message gateway dependency injected into the constructor.
@@ -80,7 +95,7 @@ class MessageBrokerAlertSender(AlertSender):
         """
 
         # first create the appropriate message(post body) that needs to be sent according via the gateway
-        alertMsg = self._createAlertMessage(alertObject)
+        alertMsg = createBrokerAlertMessage(alertObject)
         # send the alertMsg via the gateway using its send method
         try:
             # not saving the response beacuse this is primarily a notification which doens't need to
@@ -90,18 +105,28 @@ class MessageBrokerAlertSender(AlertSender):
         except Exception as exc:
             # Log and raise error
             raise exc
-    
-    #---------------------------------------#
-    #           Private Methods             #
-    #---------------------------------------#
 
-    def _createAlertMessage(self, alertObject):
-        alertDict = alertObject.toDict()
-        alertMsg = {
-            'alertTypes': ['sms', 'email'],
-            'message': alertDict
-        }
-        return alertMsg
+
+class OutboxAlertSender(AlertSender):
+    """This alertSender never waits on the message broker. It appends the alert
+    message to a durable outbox (dependency injected into the constructor) from
+    where it is relayed to the message broker asynchronously.
+    """
+
+    def __init__(self, outbox):
+        self._outbox = outbox
+
+    async def send(self, alertObject):
+        """Takes an alert object as input and appends the same alert message
+        that MessageBrokerAlertSender would have published to the outbox.
+        """
+
+        alertMsg = createBrokerAlertMessage(alertObject)
+        try:
+            await self._outbox.append(alertMsg)
+        except Exception as exc:
+            # Log and raise error
+            raise exc
 
 
 class ExternalServiceAlertSender(AlertSender):
@@ -139,3 +164,195 @@ class ExternalServiceAlertSender(AlertSender):
         # taht may be addeed
         return alertObject.toDict()
 
+
+class AlertDigest(object):
+    """The alerts of one group collected over a window, sent as a single alert."""
+
+    def __init__(self, groupBy, key, windowSeconds, maxSamples):
+        self._groupBy = groupBy
+        self.key = key
+        self._windowSeconds = windowSeconds
+        self._maxSamples = maxSamples
+        self._transactionIDs = set()
+        self._samples = []
+        self._duplicates = 0
+        self._totalAmount = 0
+        self._firstSeen = int(time.time()*1000)
+        self._lastSeen = self._firstSeen
+        self.firstAlert = None
+        self.attempts = 0
+
+    def add(self, alertObject, amount):
+        transactionID = alertObject.transactionID
+        if transactionID in self._transactionIDs:
+            self._duplicates += 1
+            return
+        if self.firstAlert is None:
+            self.firstAlert = alertObject
+        self._transactionIDs.add(transactionID)
+        if len(self._samples) < self._maxSamples:
+            self._samples.append(transactionID)
+        self._totalAmount += amount
+        self._lastSeen = int(time.time()*1000)
+
+    @property
+    def count(self):
+        return len(self._transactionIDs)
+    def toDict(self):
+        return {
+            'AlertDigest': {
+                'groupBy': self._groupBy,
+                'key': self.key,
+                'count': self.count,
+                'duplicates': self._duplicates,
+                'totalAmount': self._totalAmount,
+                'firstSeen': self._firstSeen,
+                'lastSeen': self._lastSeen,
+                'windowSeconds': self._windowSeconds,
+                'sampleTransactionIDs': self._samples
+            }
+        }
+
+
+class DigestingAlertSender(AlertSender):
+    """This alertSender aggregates the alerts before sending them via another
+    AlertSender (dependency injected into the constructor), so that the alert
+    traffic stays bounded however many fraudulent transactions come in.
+
+    The alerts are grouped by ``groupBy`` (``card`` or ``paymentMethod``) for
+    ``windowSeconds``, repeats of the same transaction are counted once, and at
+    the end of the window one AlertDigest per group is sent, or the alert itself if
+    it was alone in its group. At most ``maxGroups`` groups are kept per window, the
+    alerts of any further group go to a catch all ``*`` group.
+
+    ``send`` returns as soon as the alert is added to its digest, the window is
+    never waited for on the request path, hence the alerts buffered in a worker
+    are lost if it crashes before the end of the window (wrap a durable sender,
+    like the OutboxAlertSender, to keep them once they are out of the buffer). A
+    digest failing to send is sent again at the end of the next window, up to
+    ``maxAttempts`` times, after which it is dropped and logged.
+
+    The high severity alerts, those of an amount of at least ``highSeverityAmount``,
+    are sent right away, but at most ``maxImmediatePerWindow`` of them per window,
+    the rest are digested too. Hence at most ``maxGroups + 1 + maxImmediatePerWindow``
+    alerts, plus the retried digests, are sent per window.
+    """
+
+    GROUP_BY = ('card', 'paymentMethod')
+
+    def __init__(self, alertSender, groupBy='card', windowSeconds=60, maxGroups=100,
+            maxSamples=10, highSeverityAmount=None, maxImmediatePerWindow=10, maxAttempts=3):
+        if groupBy not in self.GROUP_BY:
+            raise ValueError("Unknown alert digest group: {}".format(groupBy))
+        self._alertSender = alertSender
+        self._groupBy = groupBy
+        self._windowSeconds = windowSeconds
+        self._maxGroups = maxGroups
+        self._maxSamples = maxSamples
+        self._highSeverityAmount = highSeverityAmount
+        self._maxImmediatePerWindow = maxImmediatePerWindow
+        self._maxAttempts = maxAttempts
+        self._digests = OrderedDict()
+        # the digests which failed to send, sent again with the next window
+        self._retries = []
+        self._immediateSent = 0
+        self._flushHandle = None
+        self._flushes = set()
+        self._received = 0
+        self._sent = 0
+        self._retried = 0
+        self._failed = 0
+
+    async def send(self, alertObject):
+        """Takes an alert object (a Transaction) as input and either sends it
+        right away, if it is of high severity, or adds it to the digest of its
+        group to be sent at the end of the window.
+        """
+
+        self._received += 1
+        payment = alertObject.payment if isinstance(alertObject.payment, dict) else {}
+        amount = payment.get('amount') or 0
+        self._scheduleFlush()
+        if (self._highSeverityAmount is not None and amount >= self._highSeverityAmount
+                and self._immediateSent < self._maxImmediatePerWindow):
+            self._immediateSent += 1
+            await self._alertSender.send(alertObject)
+            self._sent += 1
+            return
+
+        key = self._getKey(alertObject, payment)
+        digest = self._digests.get(key)
+        if digest is None:
+            if len(self._digests) >= self._maxGroups:
+                key = '*'
+                digest = self._digests.get(key)
+            if digest is None:
+                digest = self._digests[key] = AlertDigest(
+                    self._groupBy, key, self._windowSeconds, self._maxSamples)
+        digest.add(alertObject, amount)
+
+    async def close(self):
+        """Sends the digests of the current window, and the ones to be retried,
+        right away, dropping those which do not make it.
+        """
+
+        if self._flushHandle is not None:
+            self._flushHandle.cancel()
+            self._flushHandle = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self._flush(final=True)
+
+    def stats(self):
+        return OrderedDict([
+            ('received', self._received),
+            ('sent', self._sent),
+            ('pendingGroups', len(self._digests)),
+            ('retrying', len(self._retries)),
+            ('retried', self._retried),
+            ('failed', self._failed)
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _getKey(self, alertObject, payment):
+        if self._groupBy == 'paymentMethod':
+            return alertObject.paymentMethod
+        return payment.get('card')
+
+    def _scheduleFlush(self):
+        if self._flushHandle is None:
+            self._flushHandle = asyncio.get_event_loop().call_later(
+                self._windowSeconds, self._startFlush)
+
+    def _startFlush(self):
+        self._flushHandle = None
+        task = asyncio.ensure_future(self._flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, final=False):
+        digests = self._retries + list(self._digests.values())
+        self._digests, self._retries = OrderedDict(), []
+        self._immediateSent = 0
+        for digest in digests:
+            alert = digest.firstAlert if digest.count == 1 else digest
+            digest.attempts += 1
+            try:
+                await self._alertSender.send(alert)
+            except Exception as exc:
+                log.error("AlertSender.send raised exception for the digest of: {{ {}: {}, count: {}, \
+                    attempts: {}, exc: {} }}".format(self._groupBy, digest.key, digest.count,
+                        digest.attempts, exc))
+                if final or digest.attempts >= self._maxAttempts:
+                    self._failed += 1
+                    log.error("Alert digest dropped: {}".format(digest.toDict()))
+                else:
+                    self._retried += 1
+                    self._retries.append(digest)
+            else:
+                self._sent += 1
+        if self._retries:
+            self._scheduleFlush()
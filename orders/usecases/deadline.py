@@ -0,0 +1,94 @@
+"""The deadline module of the usecases package consists of the Deadline of a request
+which is carried along with the request through the usecases.
+
+Every dependency call made on behalf of the request (fraud check, alert, repository)
+gets only what is left of the request's time budget, and no new work is started for
+a request whose deadline has already passed, since nobody is waiting for its answer
+anymore. A payment is only started within the deadline, but is never cut short by it
+once started, since cancelling the call would not undo the payment.
+
+The deadline of the call in progress is also available to the code it calls via
+currentDeadline, e.g. for a RetryPolicy not to start a retry past it.
+"""
+
+
+import asyncio
+import contextlib
+import contextvars
+import time
+
+
+# the deadline of the dependency call in progress, set by withDeadline and deadlineScope
+_currentDeadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """A point in (monotonic) time by which a request has to be answered."""
+
+    def __init__(self, timeout):
+        self._timeout = timeout
+        self._expiresAt = time.monotonic() + timeout
+
+    def __repr__(self):
+        return '{{ Deadline: {{ timeout: {0}, remaining: {1:.3f} }} }}'.format(
+            self._timeout, self.remaining())
+
+    def remaining(self):
+        """Returns the seconds left before the deadline, 0 if it has passed."""
+
+        return max(0.0, self._expiresAt - time.monotonic())
+
+    @property
+    def expired(self):
+        return self._expiresAt <= time.monotonic()
+
+
+def currentDeadline():
+    """Returns the Deadline of the dependency call in progress, None if it has none."""
+
+    return _currentDeadline.get()
+
+
+@contextlib.contextmanager
+def deadlineScope(deadline):
+    """Makes the deadline the current one for the calls made within the scope,
+    without cutting them short.
+    """
+
+    token = _currentDeadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _currentDeadline.reset(token)
+
+
+async def withDeadline(deadline, awaitable, operation):
+    """Awaits the awaitable within whatever is left of the deadline and raises
+    DeadlineExceeded if it does not complete in time, or if the deadline has
+    already passed in which case the awaitable is not even started. A timeout of
+    the awaitable itself (e.g. of the http client) while there is time left is
+    raised as is.
+
+    A None deadline means no deadline.
+    """
+
+    if deadline is None:
+        return await awaitable
+
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded("Deadline exceeded before {}".format(operation))
+    try:
+        with deadlineScope(deadline):
+            return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        if not deadline.expired:
+            raise
+        raise DeadlineExceeded("Deadline exceeded during {} after {:.3f}s".format(
+            operation, remaining))
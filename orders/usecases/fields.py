@@ -0,0 +1,22 @@
+"""The fields module of the usecases package reads the fields of a request, or of
+a transaction, by their dotted path in the config (e.g. ``payment.card``), for the
+components which key their state on one (partitions, rate limits, fraud rules).
+"""
+
+
+def getField(obj, path):
+    """Returns the value at the path (a list of names, e.g. ``['payment', 'card']``)
+    in the object, whose first name is an attribute unless the object is a dict,
+    None if it is missing or is not a str or a number.
+    """
+
+    value = obj
+    for i, name in enumerate(path):
+        if isinstance(value, dict):
+            value = value.get(name)
+        elif i == 0:
+            value = getattr(value, name, None)
+        else:
+            return None
+    # lists, dicts, etc can not be hashed and are not meaningful keys anyway
+    return value if isinstance(value, (str, int, float)) and not isinstance(value, bool) else None
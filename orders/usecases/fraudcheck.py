@@ -2,7 +2,7 @@
 classes the describe the fraud checking methods.
 
 It has a FraudChecker interface which other concrete FraudCheckers like InProcessAlertSender,
-ExternalFraudChecker, etc implement.
+ExternalFraudChecker, RuleBasedFraudChecker, VelocityRecordingFraudChecker, etc implement.
 
 This package also consists of all those concrete FraudCheckers implementations mentioned
 above.
@@ -10,11 +10,14 @@ above.
 
 
 import abc
+import asyncio
 import random
+from collections import OrderedDict
 
 from asyncio import sleep
 
 from orders.log import getCustomLogger
+from orders.usecases.fields import getField
 
 
 log = getCustomLogger(__name__)
@@ -39,11 +42,89 @@ class FraudChecker(metaclass=abc.ABCMeta):
 
         
 class InProcessFraudChecker(FraudChecker):
-    """This is a sample in pocesss fraud chekcer which does not
-    communicate with any other external service.
+    """This is an in process fraud checker which does not communicate with any
+    other external service.
+
+    With a fraud model (see the fraudmodel module) the transactions are scored by
+    the model, the concurrent isFraud calls are grouped into micro batches of up
+    to ``maxBatchSize`` transactions, waiting at most ``maxBatchDelay`` seconds
+    for a batch to fill, and every batch is scored with one matrix operation.
+    ``history``, if given, is consulted for the ``(count, amount)`` of the recent
+    transactions of the user at ``userKey``.
+
+    Without a model it is a dummy which answers randomly.
     """
 
+    def __init__(self, model=None, history=None, maxBatchSize=256, maxBatchDelay=0.001,
+            userKey='payment.card'):
+        self._model = model
+        self._history = history
+        self._userPath = userKey.split('.')
+        self._maxBatchSize = maxBatchSize
+        self._maxBatchDelay = maxBatchDelay
+        # (feature row, future) of the transactions waiting for the next batch
+        self._batch = []
+        self._flushHandle = None
+        self._batches = 0
+        self._scored = 0
+
     async def isFraud(self, transaction):
+        if self._model is None:
+            return await self._dummyIsFraud(transaction)
+
+        history = (0, 0)
+        if self._history is not None:
+            user = getField(transaction, self._userPath)
+            if user is not None:
+                history = self._history.get(user)
+        row = self._model.extract(transaction.toDict()['Transaction'], history)
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._batch.append((row, future))
+        if len(self._batch) >= self._maxBatchSize:
+            self._flush()
+        elif self._flushHandle is None:
+            if self._maxBatchDelay > 0:
+                self._flushHandle = loop.call_later(self._maxBatchDelay, self._flush)
+            else:
+                self._flushHandle = loop.call_soon(self._flush)
+        return await future
+
+    def stats(self):
+        return OrderedDict([
+            ('batches', self._batches),
+            ('scored', self._scored),
+            ('meanBatchSize', round(self._scored / self._batches, 2) if self._batches else None)
+        ])
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _flush(self):
+        if self._flushHandle is not None:
+            self._flushHandle.cancel()
+            self._flushHandle = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        self._batches += 1
+        self._scored += len(batch)
+        try:
+            scores = self._model.score([row for row, _ in batch])
+        except Exception as exc:
+            log.error("Fraud model raised exception scoring a batch of {}: {}".format(len(batch), exc))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        threshold = self._model.threshold
+        for (_, future), score in zip(batch, scores):
+            # the caller may have given up on the transaction (deadline)
+            if not future.done():
+                future.set_result(bool(score >= threshold))
+
+    async def _dummyIsFraud(self, transaction):
         """Returns True/False randomly beacuse it is a dummy service implementation.
 
         To make thins interesting, this method sleeps for some seconds to mimic the actual
@@ -105,3 +186,175 @@ class ExternalFraudChecker(FraudChecker):
     def _createTransactionMessage(self, transaction):
         transactionObj = transaction.toDict()
         return transactionObj['Transaction']
+
+
+# decisions of the fraud rules
+ALLOW = 'allow'
+BLOCK = 'block'
+
+
+class FraudRules(object):
+    """A rule set compiled from a config dict into a list of checks, each of which
+    returns ALLOW, BLOCK or None (no decision) for a transaction, the first
+    decision wins. The config looks like::
+
+        {
+            "blockedCards": [4111111111111111],
+            "blockedUsers": ["someone@example.com"],
+            "blockedPaymentMethods": ["stolenwallet"],
+            "blockAmountAbove": 100000,
+            "velocity": {"maxTransactions": 20, "maxAmount": 50000, "maxUsers": 100000},
+            "allowedCards": [1234567887654321],
+            "allowedUsers": [],
+            "trustedAmountLimit": 5000,
+            "allowAmountBelow": 10
+        }
+
+    The user of a transaction is the value at ``userKey``, a dotted path in the
+    transaction, e.g. ``payment.card``; the user rules and the velocity limits
+    skip the transactions without one.
+
+    The block rules are checked before the allow rules, the allow listed cards and
+    users are allowed only up to ``trustedAmountLimit`` (any amount if not set),
+    and any other transaction below ``allowAmountBelow`` is allowed.
+
+    The velocity limits are checked against the given velocity store (see the
+    velocity module), which the transactions are recorded in by a
+    VelocityRecordingFraudChecker of the same ``userKey``. Without a store the
+    rules keep their own, of the ``windowSeconds`` and ``maxUsers`` of the
+    velocity config, and record the transactions they evaluate in it.
+    """
+
+    def __init__(self, config, velocity=None, userKey='payment.card'):
+        self._checks = []
+        self._velocity = velocity
+        self._ownsVelocity = False
+        self._userPath = userKey.split('.')
+        self._compile(config)
+
+    def evaluate(self, transaction):
+        """Returns a tuple of (decision, rule name), the decision is None when no
+        rule is sure about the transaction.
+        """
+
+        payment = transaction.payment if isinstance(transaction.payment, dict) else {}
+        amount = payment.get('amount') or 0
+        user = getField(transaction, self._userPath)
+        if self._ownsVelocity and user is not None:
+            self._velocity.record(user, amount)
+        for name, check in self._checks:
+            decision = check(transaction, user, payment, amount)
+            if decision is not None:
+                return decision, name
+        return None, None
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _compile(self, config):
+        checks = self._checks
+
+        blockedCards = frozenset(config.get('blockedCards', ()))
+        if blockedCards:
+            checks.append(('blockedCard',
+                lambda t, user, payment, amount: BLOCK if payment.get('card') in blockedCards else None))
+        blockedUsers = frozenset(config.get('blockedUsers', ()))
+        if blockedUsers:
+            checks.append(('blockedUser',
+                lambda t, user, payment, amount: BLOCK if user in blockedUsers else None))
+        blockedPaymentMethods = frozenset(config.get('blockedPaymentMethods', ()))
+        if blockedPaymentMethods:
+            checks.append(('blockedPaymentMethod',
+                lambda t, user, payment, amount: BLOCK if t.paymentMethod in blockedPaymentMethods else None))
+        blockAmountAbove = config.get('blockAmountAbove')
+        if blockAmountAbove is not None:
+            checks.append(('blockAmountAbove',
+                lambda t, user, payment, amount: BLOCK if amount > blockAmountAbove else None))
+
+        velocity = config.get('velocity')
+        if velocity:
+            if self._velocity is None:
+                from orders.velocity import VelocityStore
+                self._velocity = VelocityStore(
+                    windowSeconds=float(velocity.get('windowSeconds', 600)),
+                    maxUsers=int(velocity.get('maxUsers', 100000))
+                )
+                self._ownsVelocity = True
+            maxTransactions = velocity.get('maxTransactions', float('inf'))
+            maxAmount = velocity.get('maxAmount', float('inf'))
+
+            def velocityCheck(t, user, payment, amount):
+                if user is None:
+                    return None
+                count, total = self._velocity.get(user)
+                return BLOCK if count > maxTransactions or total > maxAmount else None
+
+            checks.append(('velocity', velocityCheck))
+
+        allowedCards = frozenset(config.get('allowedCards', ()))
+        allowedUsers = frozenset(config.get('allowedUsers', ()))
+        trustedAmountLimit = config.get('trustedAmountLimit', float('inf'))
+        if allowedCards:
+            checks.append(('allowedCard', lambda t, user, payment, amount: ALLOW if (
+                payment.get('card') in allowedCards and amount <= trustedAmountLimit) else None))
+        if allowedUsers:
+            checks.append(('allowedUser', lambda t, user, payment, amount: ALLOW if (
+                user in allowedUsers and amount <= trustedAmountLimit) else None))
+        allowAmountBelow = config.get('allowAmountBelow')
+        if allowAmountBelow is not None:
+            checks.append(('allowAmountBelow',
+                lambda t, user, payment, amount: ALLOW if amount < allowAmountBelow else None))
+
+
+class RuleBasedFraudChecker(FraudChecker):
+    """Screens the transactions with the in process FraudRules and asks the
+    fallback FraudChecker (usually the ExternalFraudChecker) only about the
+    transactions no rule is sure about.
+    """
+
+    def __init__(self, rules, fallback):
+        self._rules = rules
+        self._fallback = fallback
+        self._decisions = OrderedDict([(ALLOW, 0), (BLOCK, 0), ('fallback', 0)])
+        self._rulesHit = {}
+
+    async def isFraud(self, transaction):
+        decision, rule = self._rules.evaluate(transaction)
+        if decision is None:
+            self._decisions['fallback'] += 1
+            return await self._fallback.isFraud(transaction)
+
+        self._decisions[decision] += 1
+        self._rulesHit[rule] = self._rulesHit.get(rule, 0) + 1
+        if decision == BLOCK:
+            log.info("Transaction blocked by fraud rule: {{ transactionID: {}, rule: {} }}".format(
+                transaction.transactionID, rule))
+            return True
+        return False
+
+    def stats(self):
+        return OrderedDict([
+            ('decisions', dict(self._decisions)),
+            ('rules', dict(self._rulesHit))
+        ])
+
+
+class VelocityRecordingFraudChecker(FraudChecker):
+    """Records every transaction in the velocity store, under the user at
+    ``userKey``, before checking it with the wrapped FraudChecker, so that the
+    velocity rules and the user history of the fraud model count the transaction
+    being checked too.
+    """
+
+    def __init__(self, fraudChecker, velocity, userKey='payment.card'):
+        self._fraudChecker = fraudChecker
+        self._velocity = velocity
+        self._userPath = userKey.split('.')
+
+    async def isFraud(self, transaction):
+        user = getField(transaction, self._userPath)
+        if user is not None:
+            payment = transaction.payment if isinstance(transaction.payment, dict) else {}
+            self._velocity.record(user, payment.get('amount') or 0)
+        return await self._fraudChecker.isFraud(transaction)
@@ -0,0 +1,186 @@
+"""The fraudmodel module of the usecases package consists of the fraud scoring models
+the InProcessFraudChecker scores batches of transactions with.
+
+A model is loaded from a json file which names the features it uses and holds its
+parameters, the features of every transaction are extracted into a row of a matrix
+and a whole batch of transactions is scored with a few NumPy operations. Two types of
+models are supported, a logistic regression::
+
+    {
+        "type": "linear",
+        "features": ["logAmount", "itemCount", "paymentMethod=paytm", "userTransactions"],
+        "weights": [0.8, -0.1, 0.4, 0.05],
+        "bias": -6.5,
+        "threshold": 0.5
+    }
+
+and an ensemble of binary decision trees (e.g. exported from a gradient boosting
+library) whose leaf values are summed up and squashed with the logistic function,
+every tree is a set of parallel node arrays where a leaf has a left child of -1::
+
+    {
+        "type": "trees",
+        "features": ["amount", "amountOverCost"],
+        "trees": [
+            {"feature": [0, 1, 0, 0, 0], "threshold": [1000, 1.5, 0, 0, 0],
+             "left": [1, 3, -1, -1, -1], "right": [2, 4, -1, -1, -1],
+             "value": [0, 0, 2.5, -3.0, 0.5]}
+        ],
+        "bias": 0,
+        "threshold": 0.5
+    }
+
+The available features are ``amount``, ``logAmount``, ``orderCost``, ``itemCount``,
+``amountOverCost``, ``paymentMethod=<name>`` (1 for that payment method, else 0) and
+the user history ones ``userTransactions`` and ``userAmount``.
+
+NumPy is imported only when a model is loaded.
+"""
+
+
+import abc
+import json
+import math
+
+
+class FraudModelError(Exception):
+    pass
+
+
+_HISTORY_FEATURES = frozenset(('userTransactions', 'userAmount'))
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0.0
+
+
+def _compileFeature(name):
+    """Returns a function of (transaction dict, user history) -> float."""
+
+    if name == 'amount':
+        return lambda t, history: _number((t.get('payment') or {}).get('amount'))
+    if name == 'logAmount':
+        return lambda t, history: math.log1p(max(0.0, _number((t.get('payment') or {}).get('amount'))))
+    if name == 'orderCost':
+        return lambda t, history: _number((t.get('order') or {}).get('cost'))
+    if name == 'itemCount':
+        return lambda t, history: len((t.get('order') or {}).get('items') or ())
+    if name == 'amountOverCost':
+        def amountOverCost(t, history):
+            cost = _number((t.get('order') or {}).get('cost'))
+            return _number((t.get('payment') or {}).get('amount')) / cost if cost else 0.0
+        return amountOverCost
+    if name.startswith('paymentMethod='):
+        paymentMethod = name[len('paymentMethod='):]
+        return lambda t, history: 1.0 if t.get('paymentMethod') == paymentMethod else 0.0
+    if name == 'userTransactions':
+        return lambda t, history: history[0]
+    if name == 'userAmount':
+        return lambda t, history: history[1]
+    raise FraudModelError("Unknown fraud model feature: {}".format(name))
+
+
+class FraudModel(metaclass=abc.ABCMeta):
+    """Base of the models, extracts the feature rows and turns the raw scores
+    into fraud probabilities.
+    """
+
+    def __init__(self, features, bias=0.0, threshold=0.5):
+        import numpy
+        self._np = numpy
+        self._featureNames = list(features)
+        self._features = [_compileFeature(name) for name in features]
+        self._bias = float(bias)
+        self.threshold = float(threshold)
+
+    @property
+    def usesHistory(self):
+        """True if any of the features is a user history one."""
+
+        return any(name in _HISTORY_FEATURES for name in self._featureNames)
+
+    def extract(self, transaction, history=(0, 0)):
+        """Returns the feature row of a ``Transaction.toDict()['Transaction']`` dict."""
+
+        return [feature(transaction, history) for feature in self._features]
+
+    def score(self, rows):
+        """Returns the fraud probability of every feature row."""
+
+        X = self._np.asarray(rows, dtype=self._np.float64).reshape(len(rows), len(self._features))
+        return 1.0 / (1.0 + self._np.exp(-(self._rawScores(X) + self._bias)))
+
+    @abc.abstractmethod
+    def _rawScores(self, X):
+        """Returns the raw score of every row of the feature matrix X."""
+        pass
+
+
+class LinearFraudModel(FraudModel):
+
+    def __init__(self, features, weights, bias=0.0, threshold=0.5):
+        super().__init__(features, bias, threshold)
+        if len(weights) != len(features):
+            raise FraudModelError("A weight is needed for each of the {} features".format(len(features)))
+        self._weights = self._np.asarray(weights, dtype=self._np.float64)
+
+    def _rawScores(self, X):
+        return X @ self._weights
+
+
+class TreeEnsembleFraudModel(FraudModel):
+    """All the rows descend all the trees level by level at once, so a batch
+    costs a handful of array operations per tree level.
+    """
+
+    def __init__(self, features, trees, bias=0.0, threshold=0.5):
+        super().__init__(features, bias, threshold)
+        np = self._np
+        self._trees = []
+        for tree in trees:
+            arrays = tuple(np.asarray(tree[key]) for key in ('feature', 'threshold', 'left', 'right', 'value'))
+            feature, threshold, left, right, value = arrays
+            if len({len(array) for array in arrays}) != 1:
+                raise FraudModelError("The node arrays of a tree must be of the same length")
+            self._trees.append((
+                feature.astype(np.intp), threshold.astype(np.float64), left.astype(np.intp),
+                right.astype(np.intp), value.astype(np.float64), self._depth(left, right)
+            ))
+
+    def _rawScores(self, X):
+        np = self._np
+        rows = np.arange(len(X))
+        scores = np.zeros(len(X))
+        for feature, threshold, left, right, value, depth in self._trees:
+            nodes = np.zeros(len(X), dtype=np.intp)
+            for _ in range(depth):
+                isLeaf = left[nodes] < 0
+                goLeft = X[rows, feature[nodes]] <= threshold[nodes]
+                nodes = np.where(isLeaf, nodes, np.where(goLeft, left[nodes], right[nodes]))
+            scores += value[nodes]
+        return scores
+
+    @staticmethod
+    def _depth(left, right):
+        depth, level = 0, [0]
+        while level:
+            level = [child for node in level for child in (left[node], right[node]) if child >= 0]
+            if level:
+                depth += 1
+        return depth
+
+
+def loadFraudModel(path):
+    with open(path) as f:
+        config = json.load(f)
+    modelType = config.get('type')
+    common = dict(
+        features=config['features'],
+        bias=config.get('bias', 0.0),
+        threshold=config.get('threshold', 0.5)
+    )
+    if modelType == 'linear':
+        return LinearFraudModel(weights=config['weights'], **common)
+    if modelType == 'trees':
+        return TreeEnsembleFraudModel(trees=config['trees'], **common)
+    raise FraudModelError("Unknown fraud model type: {}".format(modelType))
@@ -0,0 +1,199 @@
+"""The schema module of the usecases package compiles declarative request schemas
+into fast validator functions.
+
+A schema is a plain dict using a small subset of JSON Schema keywords: ``type``,
+``properties``, ``required``, ``items``, ``minimum``, ``maximum``, ``minLength``,
+``maxLength``, ``maxItems``, ``pattern`` and ``enum``. ``compileSchema`` walks the
+schema once (at import/startup time) and returns a closure which validates a value
+in a single pass and returns all the errors found, so that no schema interpretation
+happens per request.
+"""
+
+
+import re
+
+
+_TYPES = {
+    'object': (dict,),
+    'array': (list,),
+    'string': (str,),
+    'number': (int, float),
+    'integer': (int,),
+    'boolean': (bool,),
+    'null': (type(None),)
+}
+
+
+class SchemaError(Exception):
+    pass
+
+
+def compileSchema(schema):
+    """Compiles the schema and returns a validate function which takes a value
+    and returns a list of error messages, empty when the value is valid.
+    """
+
+    check = _compile(schema, '$')
+
+    def validate(value):
+        errors = []
+        check(value, errors)
+        return errors
+
+    return validate
+
+
+#---------------------------------------#
+#           Private Methods             #
+#---------------------------------------#
+
+# NOTE: the paths used in the error messages are known when compiling, hence they
+# are baked into the checks and nothing is formatted for valid values. Array items
+# get the '[]' placeholder which is filled with the item index on error.
+
+def _compile(schema, path):
+    checks = []
+    typeCheck = _compileType(schema.get('type'), path)
+
+    if 'enum' in schema:
+        checks.append(_compileEnum(schema['enum'], path))
+    if 'minimum' in schema or 'maximum' in schema:
+        checks.append(_compileRange(schema.get('minimum'), schema.get('maximum'), path))
+    if 'minLength' in schema or 'maxLength' in schema:
+        checks.append(_compileLength(schema.get('minLength'), schema.get('maxLength'), path))
+    if 'pattern' in schema:
+        checks.append(_compilePattern(schema['pattern'], path))
+    if 'properties' in schema or 'required' in schema:
+        checks.append(_compileObject(
+            schema.get('properties', {}), schema.get('required', ()), path))
+    if 'items' in schema or 'maxItems' in schema:
+        checks.append(_compileArray(schema.get('items'), schema.get('maxItems'), path))
+
+    checks = tuple(checks)
+
+    def check(value, errors):
+        if typeCheck is not None and not typeCheck(value, errors):
+            # the other checks make no sense for a value of the wrong type
+            return
+        for valueCheck in checks:
+            valueCheck(value, errors)
+
+    return check
+
+
+def _compileType(schemaType, path):
+    if schemaType is None:
+        return None
+    typeNames = (schemaType,) if isinstance(schemaType, str) else tuple(schemaType)
+    for typeName in typeNames:
+        if typeName not in _TYPES:
+            raise SchemaError("Unknown schema type: {}".format(typeName))
+    pythonTypes = tuple(t for typeName in typeNames for t in _TYPES[typeName])
+    # bool is a subclass of int, but true/false is not a valid number or integer
+    allowsBool = 'boolean' in typeNames
+    message = '{}: expected {}'.format(path, ' or '.join(typeNames))
+
+    def typeCheck(value, errors):
+        if not isinstance(value, pythonTypes) or (
+                isinstance(value, bool) and not allowsBool):
+            errors.append(message)
+            return False
+        return True
+
+    return typeCheck
+
+
+def _compileEnum(values, path):
+    allowed = frozenset(values)
+    message = '{}: expected one of {}'.format(path, ', '.join(sorted(str(v) for v in values)))
+
+    def enumCheck(value, errors):
+        if value not in allowed:
+            errors.append(message)
+
+    return enumCheck
+
+
+def _compileRange(minimum, maximum, path):
+    minimumMessage = '{}: must be >= {}'.format(path, minimum)
+    maximumMessage = '{}: must be <= {}'.format(path, maximum)
+
+    def rangeCheck(value, errors):
+        if not isinstance(value, (int, float)):
+            return
+        if minimum is not None and value < minimum:
+            errors.append(minimumMessage)
+        elif maximum is not None and value > maximum:
+            errors.append(maximumMessage)
+
+    return rangeCheck
+
+
+def _compileLength(minLength, maxLength, path):
+    minLengthMessage = '{}: must be at least {} characters'.format(path, minLength)
+    maxLengthMessage = '{}: must be at most {} characters'.format(path, maxLength)
+
+    def lengthCheck(value, errors):
+        if not isinstance(value, str):
+            return
+        if minLength is not None and len(value) < minLength:
+            errors.append(minLengthMessage)
+        elif maxLength is not None and len(value) > maxLength:
+            errors.append(maxLengthMessage)
+
+    return lengthCheck
+
+
+def _compilePattern(pattern, path):
+    match = re.compile(pattern).match
+    message = '{}: must match {}'.format(path, pattern)
+
+    def patternCheck(value, errors):
+        if isinstance(value, str) and match(value) is None:
+            errors.append(message)
+
+    return patternCheck
+
+
+def _compileObject(properties, required, path):
+    prefix = '' if path == '$' else path + '.'
+    propertyChecks = tuple(
+        (name, _compile(propertySchema, prefix + name))
+        for name, propertySchema in properties.items()
+    )
+    required = tuple((name, '{}{}: is required'.format(prefix, name)) for name in required)
+
+    def objectCheck(value, errors):
+        if not isinstance(value, dict):
+            return
+        for name, message in required:
+            if name not in value:
+                errors.append(message)
+        for name, propertyCheck in propertyChecks:
+            if name in value:
+                propertyCheck(value[name], errors)
+
+    return objectCheck
+
+
+def _compileArray(items, maxItems, path):
+    itemsPath = path + '[]'
+    itemCheck = _compile(items, itemsPath) if items is not None else None
+    maxItemsMessage = '{}: must have at most {} items'.format(path, maxItems)
+
+    def arrayCheck(value, errors):
+        if not isinstance(value, list):
+            return
+        if maxItems is not None and len(value) > maxItems:
+            errors.append(maxItemsMessage)
+            return
+        if itemCheck is not None:
+            for index, item in enumerate(value):
+                numErrors = len(errors)
+                itemCheck(item, errors)
+                if len(errors) != numErrors:
+                    itemPath = '{}[{}]'.format(path, index)
+                    for i in range(numErrors, len(errors)):
+                        errors[i] = errors[i].replace(itemsPath, itemPath, 1)
+
+    return arrayCheck
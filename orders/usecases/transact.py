@@ -26,7 +26,9 @@ import abc
 #from sanic.log import logger as log
 
 from orders.log import getCustomLogger
-from orders.domain.transaction import Transaction
+from orders.usecases.schema import compileSchema
+from orders.usecases.deadline import DeadlineExceeded, deadlineScope, withDeadline
+from orders.domain.transaction import Transaction, TransactionStatus
 from orders.domain.payment import getPaymentProcessor
 from orders.domain.transaction import (
     TRANSACTION_PENDING, TRANSACTION_FRAUDULENT, TRANSACTION_ALERT_INITIATED,
@@ -38,15 +40,71 @@ from orders.domain.transaction import (
 log = getCustomLogger(__name__)
 
 
+_CURRENCY = {'type': 'string', 'pattern': '^[A-Z]{3}$'}
+_AMOUNT = {'type': 'number', 'minimum': 0}
+
+# The schema of the transaction request body, for example:
+# {"order": {"id": 1234, "name": "some book", "cost": 123.00, "currency": "INR"},
+#  "paymentMethod": "amazonpay",
+#  "payment": {"card": 1234567887654321, "type": "wallet", "amount": 123.00, "currency": "INR"}}
+TRANSACTION_REQUEST_SCHEMA = {
+    'type': 'object',
+    'required': ['order', 'paymentMethod', 'payment'],
+    'properties': {
+        'order': {
+            'type': 'object',
+            'required': ['cost'],
+            'properties': {
+                'id': {'type': ['integer', 'string']},
+                'name': {'type': 'string', 'maxLength': 256},
+                'cost': _AMOUNT,
+                'currency': _CURRENCY,
+                'items': {
+                    'type': 'array',
+                    'maxItems': 100,
+                    'items': {
+                        'type': 'object',
+                        'required': ['name', 'cost'],
+                        'properties': {
+                            'name': {'type': 'string', 'maxLength': 256},
+                            'cost': _AMOUNT,
+                            'quantity': {'type': 'integer', 'minimum': 1},
+                            'discount': _AMOUNT
+                        }
+                    }
+                }
+            }
+        },
+        'paymentMethod': {'type': 'string', 'minLength': 1, 'maxLength': 32},
+        'payment': {
+            'type': 'object',
+            'properties': {
+                'card': {'type': ['integer', 'string']},
+                'type': {'type': 'string', 'maxLength': 32},
+                'amount': _AMOUNT,
+                'currency': _CURRENCY
+            }
+        }
+    }
+}
+
+# compiled once at import time, returns the list of all the errors in the request body
+validateTransactionRequest = compileSchema(TRANSACTION_REQUEST_SCHEMA)
+
+
 class TransactionRequest(object):
     """This a data which is passed to the TransactionProcessor service 
     doTransaction method
     """
 
-    def __init__(self, order, paymentMethod, payment):
+    def __init__(self, order, paymentMethod, payment, deadline=None, validated=False):
 	    self.order = order
 	    self.paymentMethod = paymentMethod
 	    self.payment = payment
+	    # the Deadline by which the request has to be answered, None for no deadline
+	    self.deadline = deadline
+	    # True when built out of a body already validated against the request schema
+	    self.validated = validated
 
 
 class TransactionProcessor(object):
@@ -54,11 +112,16 @@ class TransactionProcessor(object):
 	as dependencies injected and exposes methods to process/validate a transaction.
 	"""
 
-    def __init__(self, transactionRepo, validator, fraudChecker, alerter):
+    def __init__(self, transactionRepo, validator, fraudChecker, alerter,
+            paymentProcessorFactory=getPaymentProcessor, ledger=None):
 	    self._transactionRepo = transactionRepo
 	    self._validator = validator                   
 	    self._fraudChecker = fraudChecker                  
 	    self._alerter = alerter
+	    # returns the PaymentProcessor for a paymentMethod
+	    self._paymentProcessorFactory = paymentProcessorFactory
+	    # tracks the transactions left in a non terminal status for the Reconciler
+	    self._ledger = ledger
 
 
     async def process(self, transReq):
@@ -68,6 +131,13 @@ class TransactionProcessor(object):
         
         It also checks if the transaction is fraudulent or not and sends
 		an alert if it is fraudulent.
+
+        Every dependency call gets only what is left of the request's deadline,
+        DeadlineExceeded is raised as soon as the deadline has passed. The payment
+        is the exception, it is only started within the deadline but never cut
+        short once started, since the money may have moved by then, and its outcome
+        is always saved. A transaction abandoned before its payment was started
+        is never resumed by the Reconciler.
         """
 
         # step 1:  validate the Transaction Request -> Order, PaymentMethod, PaymentInfo
@@ -77,27 +147,85 @@ class TransactionProcessor(object):
                 object: {} }}".format(transReq))
         # step 2: Create new domain Transaction ojbect with fraud status false and transaction status pending
         transaction = self._createTransaction(transReq)
+        deadline = transReq.deadline
+        # the status the transaction was last saved (hence tracked) with, only a
+        # transaction which passed the fraud check and was saved, or whose fraud
+        # alert failed, is tracked for the Reconciler
+        savedStatus = None
         try:
-            await self._fraudCheck(transaction)
+            await self._fraudCheck(transaction, deadline)
             # save trnsaction to Db so that if payment processing fails, we will have some transaction data
             # db to check for pending statuses
-            await self._saveTransaction(transaction)
-            # save transction raise exception, payment processing will not proceed
-            await self._processPayment(transaction)
-            # if process payment is successfully done, then go and update the tranasction in DB
-            await self._saveTransaction(transaction)
+            await self._saveTransaction(transaction, deadline)
+            savedStatus = transaction.status
+            # save transction raise exception, payment processing will not proceed, neither
+            # does it for a request nobody is waiting for anymore
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded("Deadline exceeded before PaymentProcessor.pay")
+            try:
+                await self._processPayment(transaction, deadline)
+            finally:
+                # update the tranasction in DB whatever the outcome of the payment, money may
+                # have moved by now, hence it is saved whatever is left of the deadline
+                await self._saveTransaction(transaction)
+                savedStatus = transaction.status
+        except DeadlineExceeded as exc:
+            log.info("Abandoning Transaction: {{ transactionID: {}, status: {}, timeline: {}, exc: {} }}".format(
+                transaction.transactionID, transaction.status, transaction.timeline, exc))
+            if transaction.paymentStarted:
+                await self._trackUnsaved(transaction, savedStatus)
+            else:
+                # the client is told the transaction failed, it must never be paid
+                # behind its back by the Reconciler (a retry may have paid already)
+                await self._untrack(transaction)
+            raise exc
         except Exception:
+            await self._trackUnsaved(transaction, savedStatus)
             return transaction
         return transaction
 
+    async def resume(self, transaction):
+        """Picks up a transaction left behind in a non terminal status (by a failed
+        alert or payment, or by a crash after it was first saved) and runs the
+        steps it did not complete, raises the exception of the step failing again.
+
+        A pending transaction is checked for fraud again before it is paid. A
+        transaction whose payment failed is paid again only if the payment was
+        never started, the ledger keeps the others for manual handling since the
+        money may have moved. A transaction already in a terminal status (whose
+        earlier resume could not be saved) is only saved.
+        """
+
+        if transaction.status == TRANSACTION_ALERT_ERROR:
+            await self._raiseAlert(transaction)
+        elif transaction.status == TRANSACTION_PENDING:
+            try:
+                await self._fraudCheck(transaction)
+            except Exception:
+                # a fraudulent transaction whose alert is done is saved as such, below
+                if not transaction.fraudStatus or transaction.status != TRANSACTION_ALERT_DONE:
+                    raise
+            else:
+                await self._processPayment(transaction)
+        elif transaction.status == TRANSACTION_PAYMENT_ERROR:
+            if transaction.paymentStarted:
+                raise ValueError("Transaction payment was started, it needs manual handling")
+            await self._processPayment(transaction)
+        elif transaction.status not in (TRANSACTION_ALERT_DONE, TRANSACTION_PAYMENT_COMPLETE):
+            raise ValueError("Transaction can not be resumed from status: {}".format(
+                TransactionStatus.get(transaction.status, transaction.status)))
+        await self._saveTransaction(transaction)
+        return transaction
+
     #---------------------------------------#
     #           Private Methods             #
     #---------------------------------------#
 
-    async def _fraudCheck(self, transaction):
+    async def _fraudCheck(self, transaction, deadline=None):
         isFraud = False
         try:
-            isFraud = await self._fraudChecker.isFraud(transaction)
+            isFraud = await withDeadline(
+                deadline, self._fraudChecker.isFraud(transaction), 'FraudChecker.isFraud')
         except Exception as exc:
             log.error("FraudChecker.isFraud raised exception for: {{ transactionID: {}, \
                 exc: {} }}".format(transaction.transactionID, exc))
@@ -108,15 +236,15 @@ class TransactionProcessor(object):
                 transaction.updateFraudStatus(True)
                 transaction.updateStatus(TRANSACTION_FRAUDULENT)
                 try:
-                    await self._raiseAlert(transaction)
+                    await self._raiseAlert(transaction, deadline)
                 except Exception as e:
                     raise e
                 raise Exception("FraudulentTransaction")
    
-    async def _raiseAlert(self, transaction):
+    async def _raiseAlert(self, transaction, deadline=None):
         try:
             transaction.updateStatus(TRANSACTION_ALERT_INITIATED)
-            await self._alerter.send(transaction)
+            await withDeadline(deadline, self._alerter.send(transaction), 'AlertSender.send')
             transaction.updateStatus(TRANSACTION_ALERT_DONE)
         except Exception as exc:
             transaction.updateStatus(TRANSACTION_ALERT_ERROR)
@@ -124,13 +252,16 @@ class TransactionProcessor(object):
                 exc: {} }}".format(transaction.transactionID, exc))
             raise exc
     
-    async def _processPayment(self, transaction):
+    async def _processPayment(self, transaction, deadline=None):
         paymentMethod = transaction.paymentMethod
         payment = transaction.payment
         try:
-            paymentProcessor = getPaymentProcessor(paymentMethod)
+            paymentProcessor = self._paymentProcessorFactory(paymentMethod)
             transaction.updateStatus(TRANSACTION_PAYMENT_INITIATED)
-            await paymentProcessor.pay(payment)
+            # the payment is not cut short by the deadline, cancelling a payment in flight
+            # would not undo it, but no retry of it is started past the deadline
+            with deadlineScope(deadline):
+                await paymentProcessor.pay(payment)
             # payment processing is done, update status and transaction end time
             transaction.updateStatus(TRANSACTION_PAYMENT_COMPLETE)
             transaction.updateTransactionEndTime()
@@ -142,13 +273,44 @@ class TransactionProcessor(object):
                 payment: {}, exc: {} }}".format(paymentMethod, payment, exc))
             raise exc
         
-    async def _saveTransaction(self, transaction):
+    async def _saveTransaction(self, transaction, deadline=None):
         try:
-            await self._transactionRepo.store(transaction)
+            await withDeadline(
+                deadline, self._transactionRepo.store(transaction), 'TransactionRepo.store')
         except Exception as exc:
             log.error("TransactionRepo.store raised exception for: {{ transactionID: {}, \
                 exc: {} }}".format(transaction.transactionID, exc))
             raise exc
+        await self._track(transaction)
+
+    async def _trackUnsaved(self, transaction, savedStatus):
+        """Tracks a transaction whose latest status could not be saved, if it was
+        saved before (e.g. the outcome of its payment could not be) or its fraud
+        alert failed.
+        """
+
+        if transaction.status == savedStatus:
+            return
+        if savedStatus is not None or transaction.status == TRANSACTION_ALERT_ERROR:
+            await self._track(transaction)
+
+    async def _track(self, transaction):
+        if self._ledger is None:
+            return
+        try:
+            await self._ledger.track(transaction)
+        except Exception as exc:
+            log.error("ReconciliationLedger.track raised exception for: {{ transactionID: {}, \
+                exc: {} }}".format(transaction.transactionID, exc))
+
+    async def _untrack(self, transaction):
+        if self._ledger is None:
+            return
+        try:
+            await self._ledger.forget(transaction)
+        except Exception as exc:
+            log.error("ReconciliationLedger.forget raised exception for: {{ transactionID: {}, \
+                exc: {} }}".format(transaction.transactionID, exc))
 
     def _createTransaction(self, transReq):
         transaction = Transaction(transReq.order, transReq.paymentMethod, transReq.payment)
@@ -182,9 +344,20 @@ class TransactionValidator(Validator):
         """This method takes in a transaction Request object, and tries
         to validate the request object and returns a boolean whether it is
         valid or not.
+
+        A request built out of an already validated body (see the controllers
+        and the consumer) is not validated again.
         """
 
-        # dummy service -> hence -> validating always by default
-        # real service should have a specific validity check based on the actual Transaction object
+        if transReq.validated:
+            return True
+        errors = validateTransactionRequest({
+            'order': transReq.order,
+            'paymentMethod': transReq.paymentMethod,
+            'payment': transReq.payment
+        })
+        if errors:
+            log.info("Invalid TransactionRequest: {{ errors: {} }}".format(errors))
+            return False
         return True
 
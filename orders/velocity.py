@@ -0,0 +1,213 @@
+"""The velocity module keeps the per user transaction velocity, i.e. how many
+transactions and how much value a user did in the last ``windowSeconds``, for the
+fraud rules, the fraud model and the controllers. A user is whatever key the
+transactions are recorded under, e.g. the card of the payment.
+
+Every user gets a slot in a few flat arrays instead of an object per event: a ring
+of ``windowSeconds / bucketSeconds`` time buckets of counts and amounts, the running
+totals of the ring and the last bucket it was advanced to. Recording and querying
+advance the ring of the user to the current bucket, clearing the buckets which fell
+out of the window and subtracting them from the totals, hence both are O(1) (at most
+one pass over the ring of one user).
+
+The users are kept in least recently used order, users idle for longer than the
+window have nothing to count and are evicted, and beyond ``maxUsers`` the least
+recently used users are evicted anyway, so the memory stays bounded at a dozen
+bytes per bucket per user. The store can be snapshotted to a json file on shutdown
+and loaded back on start up, the buckets are in wall clock time so they stay valid
+across restarts.
+"""
+
+
+import json
+import os
+import time
+from array import array
+from collections import OrderedDict
+
+from orders.log import getCustomLogger
+
+
+log = getCustomLogger(__name__)
+
+
+class VelocityStore(object):
+
+    def __init__(self, windowSeconds=600, bucketSeconds=10, maxUsers=100000):
+        self._bucketSeconds = bucketSeconds
+        self._numBuckets = max(1, int(round(windowSeconds / bucketSeconds)))
+        self._maxUsers = maxUsers
+        # userID -> slot, from the least to the most recently used
+        self._slots = OrderedDict()
+        self._freeSlots = []
+        self._counts = array('I')
+        self._amounts = array('d')
+        self._totalCounts = array('I')
+        self._totalAmounts = array('d')
+        self._lastBuckets = array('q')
+        self._evictions = 0
+
+    @property
+    def windowSeconds(self):
+        return self._numBuckets * self._bucketSeconds
+
+    def record(self, userID, amount=0, now=None):
+        """Records a transaction of ``amount`` by the user."""
+
+        bucket = self._bucket(now)
+        slot = self._slots.get(userID)
+        if slot is None:
+            slot = self._allocate(userID, bucket)
+        else:
+            self._slots.move_to_end(userID)
+            self._advance(slot, bucket)
+        index = slot * self._numBuckets + bucket % self._numBuckets
+        self._counts[index] += 1
+        self._amounts[index] += amount
+        self._totalCounts[slot] += 1
+        self._totalAmounts[slot] += amount
+
+    def get(self, userID, now=None):
+        """Returns the (count, amount) of the transactions of the user within the window."""
+
+        slot = self._slots.get(userID)
+        if slot is None:
+            return 0, 0
+        self._advance(slot, self._bucket(now))
+        return self._totalCounts[slot], self._totalAmounts[slot]
+
+    def evictIdle(self, now=None):
+        """Evicts the least recently recorded users who have nothing left in the window."""
+
+        bucket = self._bucket(now)
+        while self._slots:
+            userID, slot = next(iter(self._slots.items()))
+            self._advance(slot, bucket)
+            if self._totalCounts[slot]:
+                break
+            self._evict(userID)
+
+    def stats(self):
+        return OrderedDict([
+            ('users', len(self._slots)),
+            ('slots', len(self._lastBuckets)),
+            ('evictions', self._evictions),
+            ('windowSeconds', self.windowSeconds)
+        ])
+
+    def snapshot(self, path):
+        """Writes the users with transactions in the window to path, atomically,
+        as json.
+        """
+
+        self.evictIdle()
+        numBuckets = self._numBuckets
+        users = []
+        for userID, slot in self._slots.items():
+            base = slot * numBuckets
+            users.append([
+                userID,
+                self._lastBuckets[slot],
+                self._counts[base:base + numBuckets].tolist(),
+                self._amounts[base:base + numBuckets].tolist()
+            ])
+        state = {
+            'bucketSeconds': self._bucketSeconds,
+            'numBuckets': numBuckets,
+            # from the least to the most recently used
+            'users': users
+        }
+        tmpPath = '{}.tmp'.format(path)
+        with open(tmpPath, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmpPath, path)
+        log.info("Velocity store snapshotted: {{ path: {}, users: {} }}".format(path, len(users)))
+
+    def load(self, path):
+        """Loads a snapshot written by a store of the same bucket layout, returns
+        False if there is no snapshot to load or it can not be read.
+        """
+
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            layout = (state['bucketSeconds'], state['numBuckets'])
+            users = state['users']
+        except (ValueError, KeyError, TypeError) as exc:
+            log.error("Velocity snapshot can not be read, ignoring it: {{ path: {}, error: {} }}".format(
+                path, exc))
+            return False
+        if layout != (self._bucketSeconds, self._numBuckets):
+            log.error("Velocity snapshot has a different bucket layout, ignoring it: {}".format(path))
+            return False
+        numBuckets = self._numBuckets
+        for userID, lastBucket, counts, amounts in users:
+            if userID in self._slots or len(counts) != numBuckets or len(amounts) != numBuckets:
+                continue
+            slot = self._allocate(userID, lastBucket)
+            base = slot * numBuckets
+            self._counts[base:base + numBuckets] = array('I', counts)
+            self._amounts[base:base + numBuckets] = array('d', amounts)
+            self._totalCounts[slot] = sum(counts)
+            self._totalAmounts[slot] = sum(amounts)
+        self.evictIdle()
+        log.info("Velocity store loaded: {{ path: {}, users: {} }}".format(path, len(self._slots)))
+        return True
+
+    #---------------------------------------#
+    #           Private Methods             #
+    #---------------------------------------#
+
+    def _bucket(self, now):
+        return int((time.time() if now is None else now) // self._bucketSeconds)
+
+    def _advance(self, slot, bucket):
+        lastBucket = self._lastBuckets[slot]
+        if bucket <= lastBucket:
+            return
+        numBuckets = self._numBuckets
+        base = slot * numBuckets
+        if bucket - lastBucket >= numBuckets:
+            # the whole window has passed
+            for index in range(base, base + numBuckets):
+                self._counts[index] = 0
+                self._amounts[index] = 0.0
+            self._totalCounts[slot] = 0
+            self._totalAmounts[slot] = 0.0
+        else:
+            for b in range(lastBucket + 1, bucket + 1):
+                index = base + b % numBuckets
+                self._totalCounts[slot] -= self._counts[index]
+                self._totalAmounts[slot] -= self._amounts[index]
+                self._counts[index] = 0
+                self._amounts[index] = 0.0
+        self._lastBuckets[slot] = bucket
+
+    def _allocate(self, userID, bucket):
+        self.evictIdle(bucket * self._bucketSeconds)
+        while len(self._slots) >= self._maxUsers:
+            self._evict(next(iter(self._slots)))
+        if self._freeSlots:
+            slot = self._freeSlots.pop()
+            base = slot * self._numBuckets
+            for index in range(base, base + self._numBuckets):
+                self._counts[index] = 0
+                self._amounts[index] = 0.0
+            self._totalCounts[slot] = 0
+            self._totalAmounts[slot] = 0.0
+            self._lastBuckets[slot] = bucket
+        else:
+            slot = len(self._lastBuckets)
+            self._counts.extend((0,) * self._numBuckets)
+            self._amounts.extend((0.0,) * self._numBuckets)
+            self._totalCounts.append(0)
+            self._totalAmounts.append(0.0)
+            self._lastBuckets.append(bucket)
+        self._slots[userID] = slot
+        return slot
+
+    def _evict(self, userID):
+        self._freeSlots.append(self._slots.pop(userID))
+        self._evictions += 1
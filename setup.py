@@ -84,9 +84,22 @@ DEV_REQUIRES = [
 ] + TEST_REQUIRES
 
 
+# offline analytics (orders.analytics)
+ANALYTICS_REQUIRES = [
+    "numpy",
+]
+
+# scoring model of the in process fraud checker (orders.usecases.fraudmodel)
+FRAUD_MODEL_REQUIRES = [
+    "numpy",
+]
+
+
 EXTRAS_REQUIRE = {
     'dev': DEV_REQUIRES,
-    'test': TEST_REQUIRES
+    'test': TEST_REQUIRES,
+    'analytics': ANALYTICS_REQUIRES,
+    'fraudmodel': FRAUD_MODEL_REQUIRES
 }
 
 PACKAGE_DATA = {
@@ -0,0 +1,103 @@
+"""Fake dependencies of the transaction usecase, recording what they were asked."""
+
+
+import asyncio
+
+from orders.usecases.transact import (
+    TransactionProcessor, TransactionRequest, TransactionValidator
+)
+
+
+class FakeRepository(object):
+
+    def __init__(self, failing=False):
+        self.failing = failing
+        # transactionID -> the statuses it was saved with, in order
+        self.saved = {}
+
+    async def store(self, transaction):
+        if self.failing:
+            raise ConnectionError("db down")
+        self.saved.setdefault(transaction.transactionID, []).append(transaction.status)
+
+
+class FakeFraudChecker(object):
+
+    def __init__(self, fraud=False, error=None):
+        self.fraud = fraud
+        self.error = error
+        self.checked = []
+
+    async def isFraud(self, transaction):
+        self.checked.append(transaction.transactionID)
+        if self.error is not None:
+            raise self.error
+        return self.fraud
+
+
+class FakeAlertSender(object):
+
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    async def send(self, transaction):
+        if self.error is not None:
+            raise self.error
+        self.sent.append(transaction.transactionID)
+
+
+class FakePaymentProcessor(object):
+
+    def __init__(self, delay=0, error=None, factoryError=None):
+        self.delay = delay
+        self.error = error
+        # raised by the factory, before the payment is started
+        self.factoryError = factoryError
+        self.paid = []
+
+    async def pay(self, payment):
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self.paid.append(payment)
+
+    def factory(self, paymentMethod):
+        if self.factoryError is not None:
+            raise self.factoryError
+        return self
+
+
+class FakeLedger(object):
+
+    def __init__(self):
+        # transactionID -> status of the tracked transactions
+        self.tracked = {}
+
+    async def track(self, transaction):
+        self.tracked[transaction.transactionID] = transaction.status
+
+    async def forget(self, transaction):
+        self.tracked.pop(transaction.transactionID, None)
+
+
+def newProcessor(repository=None, fraudChecker=None, alerter=None, paymentProcessor=None,
+        ledger=None):
+    return TransactionProcessor(
+        transactionRepo=repository or FakeRepository(),
+        validator=TransactionValidator(),
+        fraudChecker=fraudChecker or FakeFraudChecker(),
+        alerter=alerter or FakeAlertSender(),
+        paymentProcessorFactory=(paymentProcessor or FakePaymentProcessor()).factory,
+        ledger=ledger
+    )
+
+
+def newRequest(deadline=None):
+    return TransactionRequest(
+        order={'id': 1, 'cost': 10.0},
+        paymentMethod='paytm',
+        payment={'card': 1234, 'amount': 10.0},
+        deadline=deadline,
+        validated=True
+    )
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from orders.domain.transaction import Transaction
+from orders.usecases.alert import AlertDigest, DigestingAlertSender
+
+
+class FlakyAlertSender(object):
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = 0
+        self.sent = []
+
+    async def send(self, alertObject):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("alert gateway is down")
+        self.sent.append(alertObject)
+
+
+def newTransaction(transactionID, card=1234):
+    transaction = Transaction(order={'cost': 10.0}, paymentMethod='paytm', payment={'card': card, 'amount': 10.0})
+    transaction.transactionID = transactionID
+    return transaction
+
+
+def test_alert_is_done_once_added_to_its_digest():
+    alertSender = FlakyAlertSender()
+    digester = DigestingAlertSender(alertSender, windowSeconds=0.01)
+
+    async def run():
+        await asyncio.gather(digester.send(newTransaction(1)), digester.send(newTransaction(2)))
+        sentBeforeWindow = len(alertSender.sent)
+        await asyncio.sleep(0.05)
+        return sentBeforeWindow
+
+    assert asyncio.run(run()) == 0
+    assert len(alertSender.sent) == 1
+    assert isinstance(alertSender.sent[0], AlertDigest)
+    assert alertSender.sent[0].count == 2
+
+
+def test_failed_digest_is_sent_again_with_the_next_window():
+    alertSender = FlakyAlertSender(failures=1)
+    digester = DigestingAlertSender(alertSender, windowSeconds=0.01)
+
+    async def run():
+        await asyncio.gather(digester.send(newTransaction(1)), digester.send(newTransaction(2)))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+    assert alertSender.attempts == 2
+    assert alertSender.sent[0].count == 2
+    assert digester.stats()['retried'] == 1
+
+
+def test_digest_given_up_on_is_dropped():
+    alertSender = FlakyAlertSender(failures=10)
+    digester = DigestingAlertSender(alertSender, windowSeconds=0.01, maxAttempts=2)
+
+    async def run():
+        await digester.send(newTransaction(1))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+    assert alertSender.attempts == 2
+    assert digester.stats()['failed'] == 1
+    assert digester.stats()['retrying'] == 0
+
+
+def test_close_sends_the_buffered_digests():
+    alertSender = FlakyAlertSender()
+    digester = DigestingAlertSender(alertSender, windowSeconds=60)
+
+    async def run():
+        await digester.send(newTransaction(1))
+        await digester.close()
+
+    asyncio.run(run())
+
+    assert len(alertSender.sent) == 1
+
+
+def test_unknown_group_is_rejected():
+    with pytest.raises(ValueError):
+        DigestingAlertSender(FlakyAlertSender(), groupBy='userID')
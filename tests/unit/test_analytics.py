@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from orders.analytics import analyse, parseChunk
+from orders.domain.transaction import (
+    TRANSACTION_FRAUDULENT, TRANSACTION_PAYMENT_COMPLETE, TRANSACTION_PAYMENT_ERROR,
+    TRANSACTION_PAYMENT_INITIATED
+)
+
+
+def newRecord(paymentMethod, status, startTime, latencyMs, paymentLatencyMs=None,
+        fraudStatus=False):
+    timeline = [[11, 0]]
+    if paymentLatencyMs is not None:
+        timeline += [[TRANSACTION_PAYMENT_INITIATED, 1.0], [status, 1.0 + paymentLatencyMs]]
+    return json.dumps({'Transaction': {
+        'transactionID': startTime,
+        'paymentMethod': paymentMethod,
+        'status': status,
+        'fraudStatus': fraudStatus,
+        'transactionStartTime': startTime,
+        'transactionEndTime': startTime + latencyMs,
+        'timeline': timeline
+    }})
+
+
+LINES = [
+    newRecord('paytm', TRANSACTION_PAYMENT_COMPLETE, 1000, 100, paymentLatencyMs=80),
+    newRecord('paytm', TRANSACTION_PAYMENT_COMPLETE, 2000, 200, paymentLatencyMs=150),
+    newRecord('paytm', TRANSACTION_PAYMENT_ERROR, 3000, 300, paymentLatencyMs=250),
+    newRecord('card', TRANSACTION_FRAUDULENT, 4000, 10, fraudStatus=True),
+    '',
+    'not json',
+]
+
+
+def test_lines_which_are_not_transactions_are_skipped():
+    columns = parseChunk(LINES)
+
+    assert len(columns['startTime']) == 4
+    assert list(columns['latency']) == [100, 200, 300, 10]
+
+
+def test_groups_report_counts_rates_and_latency_percentiles():
+    report = analyse(LINES, groupBy=('paymentMethod',))
+
+    assert [row['paymentMethod'] for row in report] == ['card', 'paytm']
+    card, paytm = report
+    assert (card['count'], card['fraudRate'], card['successRate']) == (1, 1.0, 0.0)
+    assert card['paymentLatencyMs'] is None
+    assert (paytm['count'], paytm['fraudRate']) == (3, 0.0)
+    assert paytm['successRate'] == round(2 / 3, 6)
+    assert paytm['latencyMs']['p50'] == pytest.approx(200, rel=0.03)
+    assert paytm['paymentLatencyMs']['p99'] == pytest.approx(250, rel=0.03)
+
+
+def test_report_does_not_depend_on_the_chunk_size():
+    groupBy = ('status', 'paymentMethod', 'bucket')
+
+    assert analyse(LINES, groupBy, bucketSeconds=2, chunkSize=1) == \
+        analyse(LINES, groupBy, bucketSeconds=2, chunkSize=100)
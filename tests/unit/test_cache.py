@@ -0,0 +1,63 @@
+import asyncio
+
+from orders.cache import CachingRepository
+from orders.domain.order import Repository
+
+
+class SlowRepository(Repository):
+
+    def __init__(self):
+        self.records = {}
+        self.reads = 0
+
+    async def findByID(self, uID):
+        self.reads += 1
+        record = self.records.get(uID)
+        await asyncio.sleep(0.01)
+        return record
+
+    async def store(self, domainObject):
+        self.records[domainObject.transactionID] = domainObject.toDict()
+        return domainObject
+
+
+class Record(object):
+
+    def __init__(self, transactionID, status):
+        self.transactionID = transactionID
+        self.status = status
+
+    def toDict(self):
+        return {'transactionID': self.transactionID, 'status': self.status}
+
+
+def test_read_overtaken_by_an_evicted_store_is_not_cached():
+    backend = SlowRepository()
+    backend.records[1] = {'transactionID': 1, 'status': 'old'}
+    cache = CachingRepository(backend, maxSize=1)
+
+    async def scenario():
+        read = asyncio.ensure_future(cache.findByID(1))
+        while not backend.reads:
+            await asyncio.sleep(0)
+        await cache.store(Record(1, 'new'))
+        # evicts the stored record of 1
+        await cache.store(Record(2, 'new'))
+        assert (await read)['status'] == 'old'
+        return await cache.findByID(1)
+
+    assert asyncio.run(scenario())['status'] == 'new'
+    assert backend.reads == 2
+
+
+def test_reads_are_cached():
+    backend = SlowRepository()
+    backend.records[1] = {'transactionID': 1, 'status': 'old'}
+    cache = CachingRepository(backend)
+
+    async def scenario():
+        await cache.findByID(1)
+        return await cache.findByID(1)
+
+    assert asyncio.run(scenario())['status'] == 'old'
+    assert backend.reads == 1
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from orders.compression import CODECS, PayloadCodec, PayloadTooLarge, UnsupportedEncoding
+
+
+BODY = json.dumps({'order': {'cost': 10.0, 'items': [{'name': 'book', 'cost': 10.0}] * 50}}).encode()
+
+
+@pytest.mark.parametrize('algorithm', sorted(CODECS))
+def test_body_is_compressed_and_decoded_back(algorithm):
+    codec = PayloadCodec(algorithm=algorithm, threshold=100)
+
+    compressed, encoding = codec.encode(BODY)
+
+    assert encoding == algorithm
+    assert len(compressed) < len(BODY)
+    assert codec.decode(compressed, encoding) == BODY
+
+
+def test_small_body_is_sent_as_is():
+    codec = PayloadCodec(algorithm='gzip', threshold=len(BODY) + 1)
+
+    assert codec.encode(BODY) == (BODY, None)
+    assert codec.decode(BODY, None) == BODY
+
+
+@pytest.mark.parametrize('algorithm', sorted(CODECS))
+def test_body_decompressing_beyond_the_max_size_is_refused(algorithm):
+    bomb, encoding = PayloadCodec(algorithm=algorithm, threshold=0).encode(b'0' * 10 * 1024 * 1024)
+    codec = PayloadCodec(maxSize=1024)
+
+    with pytest.raises(PayloadTooLarge):
+        codec.decode(bomb, encoding)
+    assert codec.stats()['tooLarge'] == 1
+
+
+def test_truncated_and_unknown_bodies_are_refused():
+    compressed, encoding = PayloadCodec(algorithm='gzip', threshold=0).encode(BODY)
+    codec = PayloadCodec()
+
+    with pytest.raises(ValueError):
+        codec.decode(compressed[:len(compressed) // 2], encoding)
+    with pytest.raises(UnsupportedEncoding):
+        codec.decode(compressed, 'br')
@@ -0,0 +1,55 @@
+import asyncio
+import random
+
+import pytest
+
+from orders.concurrency import AdaptiveConcurrencyLimiter
+
+
+def feed(limiter, latencies):
+    """Feeds the latencies to the limiter as calls made at its limit."""
+
+    for latency in latencies:
+        limiter._onSample(latency, limiter.limit)
+
+
+def noisyLatencies(count, median=0.05, sigma=0.5, seed=1):
+    rng = random.Random(seed)
+    return [rng.lognormvariate(0, sigma) * median for _ in range(count)]
+
+
+@pytest.mark.parametrize('algorithm', ['aimd', 'gradient'])
+def test_noisy_latency_without_queueing_does_not_shrink_the_limit(algorithm):
+    limiter = AdaptiveConcurrencyLimiter('dependency', algorithm=algorithm, initialLimit=20)
+
+    feed(limiter, noisyLatencies(20000))
+
+    assert limiter.limit >= 20
+
+
+@pytest.mark.parametrize('algorithm', ['aimd', 'gradient'])
+def test_queueing_shrinks_the_limit(algorithm):
+    limiter = AdaptiveConcurrencyLimiter('dependency', algorithm=algorithm, initialLimit=50)
+    feed(limiter, noisyLatencies(1000))
+    limit = limiter.limit
+
+    feed(limiter, noisyLatencies(200, median=0.5))
+
+    assert limiter.limit < limit
+
+
+def test_limit_is_cut_at_most_once_per_window():
+    limiter = AdaptiveConcurrencyLimiter('dependency', algorithm='aimd', initialLimit=20, backoffRatio=0.5)
+
+    async def timeout():
+        raise asyncio.TimeoutError()
+
+    async def run():
+        for _ in range(5):
+            with pytest.raises(asyncio.TimeoutError):
+                await limiter.call(timeout)
+
+    asyncio.run(run())
+
+    assert limiter.limit == 10
+    assert limiter.stats()['drops'] == 5
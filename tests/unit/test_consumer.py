@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from orders.consumer import TransactionConsumer
+from orders.domain.transaction import TRANSACTION_PAYMENT_COMPLETE
+from tests.unit.fakes import newProcessor
+
+
+BODY = json.dumps({
+    'order': {'id': 1, 'cost': 10.0},
+    'paymentMethod': 'paytm',
+    'payment': {'card': 1234, 'amount': 10.0}
+}).encode()
+
+
+class FakeMessage(object):
+
+    def __init__(self, redelivered=False):
+        self.correlation_id = 'c1'
+        self.redelivered = redelivered
+        self.settled = None
+
+    def ack(self):
+        self.settled = 'ack'
+
+    def nack(self, requeue):
+        self.settled = 'nack' if requeue else 'nack-drop'
+
+    async def reject(self, requeue):
+        self.settled = 'reject' if not requeue else 'reject-requeue'
+
+
+class FakeRabbitMqClient(object):
+
+    async def consume(self, queue, exchange, callback, options):
+        self.options = options
+
+
+class FakeReplyGateway(object):
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class FailingInteractor(object):
+
+    async def process(self, transReq):
+        raise ConnectionError("db down")
+
+
+def consume(messages, interactor=None):
+    """Delivers (message, body) pairs to a consumer and returns the replies."""
+
+    replyGateway = FakeReplyGateway()
+    consumer = TransactionConsumer(
+        FakeRabbitMqClient(), interactor or newProcessor(), replyGateway, 'transactions',
+        'orders', concurrency=2)
+
+    async def run():
+        await consumer.start()
+        for message, body in messages:
+            consumer._onMessage(message, body)
+        await consumer.stop()
+
+    asyncio.run(run())
+    return replyGateway.sent
+
+
+def test_processed_transaction_is_replied_to_and_acked():
+    message = FakeMessage()
+
+    replies = consume([(message, BODY)])
+
+    assert message.settled == 'ack'
+    assert replies[0]['correlationID'] == 'c1'
+    assert replies[0]['transactionStatus']['code'] == TRANSACTION_PAYMENT_COMPLETE
+
+
+def test_malformed_and_oversized_messages_are_rejected_for_good():
+    malformed, oversized = FakeMessage(), FakeMessage()
+
+    replies = consume([(malformed, b'{"order": 1}'), (oversized, None)])
+
+    assert (malformed.settled, oversized.settled) == ('reject', 'reject')
+    assert sorted(reply['message'] for reply in replies) == ['Bad Request', 'Payload Too Large']
+
+
+def test_failed_message_is_requeued_only_once():
+    first, redelivered = FakeMessage(), FakeMessage(redelivered=True)
+
+    replies = consume([(first, BODY), (redelivered, BODY)], interactor=FailingInteractor())
+
+    assert (first.settled, redelivered.settled) == ('nack', 'reject')
+    assert [reply['message'] for reply in replies] == ['Something Bad Happened']
+
+
+def test_prefetch_bounds_the_concurrency():
+    consumer = TransactionConsumer(
+        FakeRabbitMqClient(), None, None, 'transactions', 'orders',
+        options={'set_qos': 5}, concurrency=20)
+
+    assert consumer._concurrency == 5
@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from orders.usecases.deadline import Deadline, DeadlineExceeded, withDeadline
+
+
+def test_call_outliving_the_deadline_exceeds_it():
+
+    async def run():
+        await withDeadline(Deadline(0.01), asyncio.sleep(1), 'sleep')
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+
+
+def test_own_timeout_of_the_call_is_not_taken_for_the_deadline():
+
+    async def timingOut():
+        raise asyncio.TimeoutError("http client timeout")
+
+    async def run():
+        await withDeadline(Deadline(10), timingOut(), 'timingOut')
+
+    with pytest.raises(asyncio.TimeoutError) as excInfo:
+        asyncio.run(run())
+    assert not isinstance(excInfo.value, DeadlineExceeded)
+    assert str(excInfo.value) == "http client timeout"
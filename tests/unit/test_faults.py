@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from orders.faults import FaultRegistry, FaultScenario
+
+
+def test_only_registered_dependencies_get_faults():
+    registry = FaultRegistry(seed=1)
+    injector = registry.register('repository')
+
+    registry.activate('repository', {'blackout': True})
+
+    assert registry.get('repository') is injector
+    with pytest.raises(KeyError):
+        registry.activate('anything', {'blackout': True})
+    assert 'anything' not in registry
+    assert list(registry.toDict()['dependencies']) == ['repository']
+
+
+def test_activated_profile_fails_the_calls():
+    registry = FaultRegistry(seed=1)
+    injector = registry.register('repository')
+    registry.activate('repository', {'blackout': True, 'error': 'timeout'})
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(injector.inject())
+
+    registry.clear()
+    asyncio.run(injector.inject())
+    assert injector.toDict()['errors'] == 1
+
+
+def test_scenario_of_unknown_target_is_rejected():
+    registry = FaultRegistry(seed=1)
+    registry.register('repository')
+
+    with pytest.raises(ValueError):
+        FaultScenario(registry, {'steps': [{'at': 0, 'target': 'anything', 'profile': {'blackout': True}}]})
+    FaultScenario(registry, {'steps': [{'at': 0, 'target': 'repository', 'profile': {'blackout': True}}]})
@@ -0,0 +1,24 @@
+from orders.usecases.fields import getField
+from orders.usecases.transact import TransactionRequest
+
+
+def newRequest(payment):
+    return TransactionRequest(order={'cost': 10.0}, paymentMethod='paytm', payment=payment)
+
+
+def test_field_is_read_from_the_attributes_then_the_dicts():
+    request = newRequest({'card': 1234, 'owner': {'name': 'someone'}})
+
+    assert getField(request, ['payment', 'card']) == 1234
+    assert getField(request, ['payment', 'owner', 'name']) == 'someone'
+    assert getField({'payment': {'card': 1234}}, ['payment', 'card']) == 1234
+
+
+def test_missing_or_unhashable_field_is_none():
+    request = newRequest({'card': [1, 2], 'flag': True})
+
+    assert getField(request, ['payment', 'card']) is None
+    assert getField(request, ['payment', 'flag']) is None
+    assert getField(request, ['payment', 'missing', 'name']) is None
+    assert getField(request, ['paymentMethod', 'name']) is None
+    assert getField(request, ['missing']) is None
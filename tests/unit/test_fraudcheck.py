@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from orders.domain.transaction import Transaction
+from orders.usecases.fraudcheck import (
+    ALLOW, BLOCK, FraudRules, InProcessFraudChecker, VelocityRecordingFraudChecker
+)
+from orders.usecases.fraudmodel import LinearFraudModel
+from orders.velocity import VelocityStore
+from tests.unit.fakes import FakeFraudChecker
+
+
+def newTransaction(card=1234, amount=10.0):
+    payment = {'amount': amount}
+    if card is not None:
+        payment['card'] = card
+    return Transaction(order={'cost': amount}, paymentMethod='paytm', payment=payment)
+
+
+def test_user_rules_match_the_user_key_of_the_request():
+    rules = FraudRules({'blockedUsers': [1111], 'allowedUsers': [2222]})
+
+    assert rules.evaluate(newTransaction(card=1111)) == (BLOCK, 'blockedUser')
+    assert rules.evaluate(newTransaction(card=2222)) == (ALLOW, 'allowedUser')
+    assert rules.evaluate(newTransaction(card=None)) == (None, None)
+
+
+def test_velocity_counts_the_transactions_of_the_same_card():
+    rules = FraudRules({'velocity': {'maxTransactions': 2}})
+
+    decisions = [rules.evaluate(newTransaction(card=1111))[0] for _ in range(3)]
+    other = rules.evaluate(newTransaction(card=2222))[0]
+    withoutCard = [rules.evaluate(newTransaction(card=None))[0] for _ in range(3)]
+
+    assert decisions == [None, None, BLOCK]
+    assert other is None
+    assert withoutCard == [None, None, None]
+
+
+def test_velocity_rules_read_what_the_recorder_records():
+    store = VelocityStore()
+    rules = FraudRules({'velocity': {'maxTransactions': 1}}, velocity=store, userKey='order.user')
+    fraudChecker = VelocityRecordingFraudChecker(FakeFraudChecker(), store, userKey='order.user')
+
+    for _ in range(2):
+        transaction = Transaction(order={'user': 'someone'}, paymentMethod='paytm', payment={})
+        asyncio.run(fraudChecker.isFraud(transaction))
+
+    assert rules.evaluate(transaction) == (BLOCK, 'velocity')
+
+
+def test_idle_users_are_evicted_as_new_ones_arrive():
+    store = VelocityStore(windowSeconds=60, bucketSeconds=10)
+    for card in range(100):
+        store.record(card, 1.0, now=0)
+
+    store.record('late', 1.0, now=120)
+
+    assert store.stats()['users'] == 1
+    assert store.stats()['evictions'] == 100
+
+
+def test_snapshot_is_plain_json_and_loads_back(tmp_path):
+    path = str(tmp_path / 'velocity.json')
+    store = VelocityStore(windowSeconds=60, bucketSeconds=10)
+    store.record(1111, 5.0)
+    store.record(1111, 7.5)
+    store.record('someone', 1.0)
+
+    store.snapshot(path)
+    loaded = VelocityStore(windowSeconds=60, bucketSeconds=10)
+
+    with open(path) as f:
+        assert json.load(f)['users'][0][0] == 1111
+    assert loaded.load(path)
+    assert loaded.get(1111) == (2, 12.5)
+    assert loaded.get('someone') == (1, 1.0)
+
+
+def test_snapshot_of_another_layout_is_ignored(tmp_path):
+    path = str(tmp_path / 'velocity.json')
+    store = VelocityStore(windowSeconds=60, bucketSeconds=10)
+    store.record(1111, 5.0)
+    store.snapshot(path)
+
+    loaded = VelocityStore(windowSeconds=60, bucketSeconds=5)
+
+    assert not loaded.load(path)
+    assert loaded.get(1111) == (0, 0)
+
+
+def test_model_history_is_read_by_the_user_key():
+    store = VelocityStore()
+    store.record(1111, 5.0)
+    store.record(1111, 5.0)
+    model = LinearFraudModel(['userTransactions'], weights=[10.0], bias=-15.0)
+    fraudChecker = InProcessFraudChecker(model=model, history=store, maxBatchDelay=0)
+
+    async def check():
+        return await asyncio.gather(
+            fraudChecker.isFraud(newTransaction(card=1111)),
+            fraudChecker.isFraud(newTransaction(card=2222)))
+
+    assert model.usesHistory
+    assert asyncio.run(check()) == [True, False]
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import math
+
+import pytest
+
+from orders.domain.transaction import Transaction
+from orders.usecases.fraudcheck import InProcessFraudChecker
+from orders.usecases.fraudmodel import (
+    FraudModelError, LinearFraudModel, TreeEnsembleFraudModel, loadFraudModel
+)
+
+
+def newTransaction(amount, cost=10.0, paymentMethod='paytm'):
+    return Transaction(
+        order={'cost': cost, 'items': [{'name': 'book', 'cost': cost}]},
+        paymentMethod=paymentMethod,
+        payment={'card': 1234, 'amount': amount}
+    )
+
+
+def test_features_are_extracted_from_the_transaction():
+    model = LinearFraudModel(
+        ['amount', 'logAmount', 'itemCount', 'amountOverCost', 'paymentMethod=paytm', 'userAmount'],
+        weights=[0] * 6)
+
+    row = model.extract(newTransaction(20.0).toDict()['Transaction'], history=(3, 60.0))
+
+    assert row == [20.0, math.log1p(20.0), 1, 2.0, 1.0, 60.0]
+
+
+def test_linear_model_is_a_logistic_regression():
+    model = LinearFraudModel(['amount'], weights=[0.5], bias=-5.0)
+
+    scores = model.score([[0.0], [10.0], [20.0]])
+
+    assert scores.tolist() == pytest.approx([1 / (1 + math.exp(5)), 0.5, 1 / (1 + math.exp(-5))])
+
+
+def test_trees_score_the_leaf_each_row_lands_in():
+    tree = {
+        'feature': [0, 1, 0, 0, 0], 'threshold': [1000, 1.5, 0, 0, 0],
+        'left': [1, 3, -1, -1, -1], 'right': [2, 4, -1, -1, -1],
+        'value': [0, 0, 2.5, -3.0, 0.5]
+    }
+    model = TreeEnsembleFraudModel(['amount', 'amountOverCost'], trees=[tree, tree])
+
+    scores = model.score([[5000, 1.0], [10, 1.0], [10, 2.0]])
+
+    # two trees, hence twice the leaf value of each row
+    assert scores.tolist() == pytest.approx([1 / (1 + math.exp(-value * 2)) for value in (2.5, -3.0, 0.5)])
+
+
+def test_model_is_loaded_from_json(tmp_path):
+    path = tmp_path / 'model.json'
+    path.write_text(json.dumps({'type': 'linear', 'features': ['amount'], 'weights': [1.0], 'threshold': 0.9}))
+    assert loadFraudModel(str(path)).threshold == 0.9
+
+    path.write_text(json.dumps({'type': 'linear', 'features': ['unknown'], 'weights': [1.0]}))
+    with pytest.raises(FraudModelError):
+        loadFraudModel(str(path))
+    path.write_text(json.dumps({'type': 'forest', 'features': ['amount']}))
+    with pytest.raises(FraudModelError):
+        loadFraudModel(str(path))
+
+
+def test_concurrent_checks_are_scored_in_one_batch():
+    model = LinearFraudModel(['amount'], weights=[1.0], bias=-100.0)
+    fraudChecker = InProcessFraudChecker(model=model, maxBatchDelay=0.001)
+
+    async def check():
+        return await asyncio.gather(*(
+            fraudChecker.isFraud(newTransaction(amount)) for amount in (10.0, 500.0, 20.0)))
+
+    assert asyncio.run(check()) == [False, True, False]
+    assert fraudChecker.stats()['batches'] == 1
+    assert fraudChecker.stats()['scored'] == 3
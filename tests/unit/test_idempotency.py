@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from orders.idempotency import (
+    IdempotencyGuard, IdempotencyKeyReused, InMemoryIdempotencyStore, SharedMemoryIdempotencyStore
+)
+from orders.sharedcache import SharedMemoryCache
+
+
+def newGuard():
+    return IdempotencyGuard(InMemoryIdempotencyStore(maxSize=10, ttl=60), ttl=60)
+
+
+def test_stored_result_is_replayed_for_the_same_request():
+    guard = newGuard()
+    calls = []
+
+    async def process():
+        calls.append(1)
+        return {'status': 200}, True
+
+    async def scenario():
+        first = await guard.execute(('client', 'key'), process, 'fingerprint')
+        second = await guard.execute(('client', 'key'), process, 'fingerprint')
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == ({'status': 200}, False)
+    assert second == ({'status': 200}, True)
+    assert len(calls) == 1
+
+
+def test_key_reused_for_another_request_is_rejected():
+    guard = newGuard()
+
+    async def process():
+        return {'status': 200}, True
+
+    async def scenario():
+        await guard.execute(('client', 'key'), process, 'fingerprint')
+        await guard.execute(('client', 'key'), process, 'another fingerprint')
+
+    with pytest.raises(IdempotencyKeyReused):
+        asyncio.run(scenario())
+
+
+def test_key_reused_while_in_flight_is_rejected():
+    guard = newGuard()
+
+    async def process():
+        await asyncio.sleep(0.01)
+        return {'status': 200}, True
+
+    async def scenario():
+        first = asyncio.ensure_future(guard.execute(('client', 'key'), process, 'fingerprint'))
+        await asyncio.sleep(0)
+        with pytest.raises(IdempotencyKeyReused):
+            await guard.execute(('client', 'key'), process, 'another fingerprint')
+        return await first
+
+    assert asyncio.run(scenario()) == ({'status': 200}, False)
+
+
+def test_keys_of_different_clients_do_not_collide():
+    guard = newGuard()
+
+    def processing(status):
+        async def process():
+            return {'status': status}, True
+        return process
+
+    async def scenario():
+        first = await guard.execute(('client1', 'key'), processing(200), 'fingerprint')
+        second = await guard.execute(('client2', 'key'), processing(500), 'fingerprint')
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == ({'status': 200}, False)
+    assert second == ({'status': 500}, False)
+
+
+def newWorkerGuard(cache):
+    """A guard as set up in one of the workers sharing the cache."""
+
+    store = InMemoryIdempotencyStore(maxSize=10, ttl=60, backend=SharedMemoryIdempotencyStore(cache))
+    return IdempotencyGuard(store, ttl=60, pollInterval=0.001)
+
+
+def test_retry_on_another_worker_waits_for_the_original_and_replays_it():
+    cache = SharedMemoryCache(slots=64, maxValueSize=256)
+    firstWorker, secondWorker = newWorkerGuard(cache), newWorkerGuard(cache)
+    calls = []
+
+    async def process():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {'status': 200}, True
+
+    async def scenario():
+        first = asyncio.ensure_future(firstWorker.execute(('client', 'key'), process, 'fingerprint'))
+        await asyncio.sleep(0)
+        second = await secondWorker.execute(('client', 'key'), process, 'fingerprint')
+        return await first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == ({'status': 200}, False)
+    assert second == ({'status': 200}, True)
+    assert len(calls) == 1
+
+
+def test_key_is_released_when_the_result_is_not_stored():
+    cache = SharedMemoryCache(slots=64, maxValueSize=256)
+    firstWorker, secondWorker = newWorkerGuard(cache), newWorkerGuard(cache)
+    calls = []
+
+    async def process():
+        calls.append(1)
+        return {'status': 503}, False
+
+    async def scenario():
+        await firstWorker.execute(('client', 'key'), process, 'fingerprint')
+        return await secondWorker.execute(('client', 'key'), process, 'fingerprint')
+
+    assert asyncio.run(scenario()) == ({'status': 503}, False)
+    assert len(calls) == 2
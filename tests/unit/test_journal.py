@@ -0,0 +1,60 @@
+import asyncio
+
+from orders.domain.transaction import Transaction, TRANSACTION_PAYMENT_COMPLETE
+from orders.journal import JournalRepository
+
+
+def newTransaction(card):
+    return Transaction({'id': card, 'cost': 10.0}, 'paytm', {'card': card, 'amount': 10.0})
+
+
+def test_transactions_with_the_same_id_do_not_replace_each_other(tmp_path):
+    journal = JournalRepository(str(tmp_path))
+
+    async def scenario():
+        await journal.setup()
+        first, second = newTransaction(1), newTransaction(2)
+        second.transactionID = first.transactionID
+        await journal.store(first)
+        await journal.store(second)
+        # later states of the same transaction keep its id
+        second.updateStatus(TRANSACTION_PAYMENT_COMPLETE)
+        await journal.store(second)
+        found = (await journal.findByID(first.transactionID), await journal.findByID(second.transactionID))
+        await journal.close()
+        return first, second, found
+
+    first, second, (foundFirst, foundSecond) = asyncio.run(scenario())
+    assert second.transactionID == first.transactionID + 1
+    assert foundFirst['payment']['card'] == 1
+    assert foundSecond['payment']['card'] == 2
+    assert foundSecond['status'] == TRANSACTION_PAYMENT_COMPLETE
+
+
+def test_compaction_keeps_the_latest_records(tmp_path):
+    journal = JournalRepository(str(tmp_path), segmentSize=16 * 1024)
+
+    async def scenario():
+        await journal.setup()
+        transactions = [newTransaction(card) for card in range(200)]
+        for i, transaction in enumerate(transactions):
+            transaction.transactionID = i + 1
+            await journal.store(transaction)
+            transaction.updateStatus(TRANSACTION_PAYMENT_COMPLETE)
+            await journal.store(transaction)
+            await asyncio.sleep(0)
+        if journal._compaction is not None:
+            await journal._compaction
+        segments = journal.stats()['segments']
+        await journal.close()
+        # the index rebuilt from the segments left finds the latest records
+        reopened = JournalRepository(str(tmp_path), segmentSize=16 * 1024)
+        await reopened.setup()
+        found = [await reopened.findByID(i + 1) for i in range(200)]
+        await reopened.close()
+        return segments, found
+
+    segments, found = asyncio.run(scenario())
+    assert segments < 10
+    assert [record['payment']['card'] for record in found] == list(range(200))
+    assert all(record['status'] == TRANSACTION_PAYMENT_COMPLETE for record in found)
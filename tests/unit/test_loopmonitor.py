@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from orders.loopmonitor import LoopMonitor, setEventLoopPolicy
+
+
+def blockTheLoop(seconds):
+    time.sleep(seconds)
+
+
+def test_lag_is_sampled():
+    monitor = LoopMonitor(interval=0.005)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+
+    asyncio.run(run())
+
+    stats = monitor.stats()
+    assert stats['samples'] > 5
+    assert stats['stalls'] == 0
+    assert 0 <= stats['lagP50Ms'] <= stats['lagMaxMs']
+
+
+def test_stall_is_detected_with_the_blocking_stack():
+    monitor = LoopMonitor(interval=0.01, stallThreshold=0.05)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.02)
+        blockTheLoop(0.3)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+
+    asyncio.run(run())
+
+    stats = monitor.stats()
+    assert stats['stalls'] == 1
+    assert 'blockTheLoop' in stats['recentStalls'][0]['stack']
+    assert stats['lagMaxMs'] >= 200
+
+
+def test_asyncio_loop_policy_can_be_forced():
+    try:
+        assert setEventLoopPolicy('asyncio') == 'asyncio'
+        assert setEventLoopPolicy('auto') in ('asyncio', 'uvloop')
+    finally:
+        asyncio.set_event_loop_policy(None)
@@ -0,0 +1,57 @@
+import asyncio
+
+from orders.outbox import OutboxRelay, SQLiteOutbox
+
+
+class FlakyGateway(object):
+
+    def __init__(self, failing):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def send(self, msg):
+        if msg['n'] in self.failing:
+            raise ConnectionError("broker down")
+        self.sent.append(msg['n'])
+
+
+def test_relay_acks_the_published_and_releases_the_failed(tmp_path):
+    outbox = SQLiteOutbox(str(tmp_path / 'outbox.db'))
+    outbox.setup()
+    gateway = FlakyGateway(failing=[2])
+    relay = OutboxRelay(outbox, gateway, batchSize=10)
+
+    async def scenario():
+        for n in range(4):
+            await outbox.append({'n': n})
+        first = await relay.relayOnce()
+        gateway.failing.clear()
+        second = await relay.relayOnce()
+        return first, second
+
+    try:
+        first, second = asyncio.run(scenario())
+        assert first is None
+        assert second == 1
+        assert sorted(gateway.sent) == [0, 1, 2, 3]
+        assert outbox.pending() == 0
+    finally:
+        outbox.close()
+
+
+def test_claimed_messages_are_leased(tmp_path):
+    outbox = SQLiteOutbox(str(tmp_path / 'outbox.db'), leaseTime=60)
+    outbox.setup()
+
+    async def scenario():
+        await outbox.append({'n': 1})
+        first = await outbox.claim(10)
+        second = await outbox.claim(10)
+        return first, second
+
+    try:
+        first, second = asyncio.run(scenario())
+        assert [msg for _, msg in first] == [{'n': 1}]
+        assert second == []
+    finally:
+        outbox.close()
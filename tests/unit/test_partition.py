@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from orders.partition import PartitionedExecutor, PartitionQueueFull
+
+
+def test_jobs_of_a_key_run_in_order_one_at_a_time():
+    executor = PartitionedExecutor()
+    events = []
+
+    async def job(name):
+        events.append(('start', name))
+        await asyncio.sleep(0.01)
+        events.append(('end', name))
+        return name
+
+    async def run():
+        return await asyncio.gather(*(executor.submit('card', lambda n=n: job(n)) for n in range(3)))
+
+    assert asyncio.run(run()) == [0, 1, 2]
+    assert events == [('start', 0), ('end', 0), ('start', 1), ('end', 1), ('start', 2), ('end', 2)]
+    assert executor.stats()['keys'] == 0
+
+
+def test_slow_key_does_not_hold_up_other_keys():
+    executor = PartitionedExecutor()
+    release = None
+
+    async def slow():
+        await release.wait()
+        return 'slow'
+
+    async def fast():
+        return 'fast'
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        slowJob = asyncio.ensure_future(executor.submit('slow', slow))
+        # many keys, so that a hashed lane would have been shared with the slow one
+        fastJobs = [executor.submit(key, fast) for key in range(256)]
+        results = await asyncio.wait_for(asyncio.gather(*fastJobs), timeout=1)
+        release.set()
+        return results, await slowJob
+
+    results, slowResult = asyncio.run(run())
+
+    assert results == ['fast'] * 256
+    assert slowResult == 'slow'
+
+
+def test_full_queue_of_a_key_is_rejected():
+    executor = PartitionedExecutor(maxQueueDepth=1)
+
+    async def run():
+        first = asyncio.ensure_future(executor.submit('card', lambda: asyncio.sleep(0.01)))
+        await asyncio.sleep(0)
+        with pytest.raises(PartitionQueueFull):
+            await executor.submit('card', lambda: asyncio.sleep(0))
+        await executor.submit('other', lambda: asyncio.sleep(0))
+        await first
+
+    asyncio.run(run())
+
+    assert executor.stats()['rejected'] == 1
@@ -0,0 +1,68 @@
+import pytest
+
+from orders.ratelimit import RateLimiter, SharedTokenBucketLimiter, TokenBucketLimiter
+
+
+class FakeRequest(object):
+
+    def __init__(self, body=None, headers=None, ip='10.0.0.1'):
+        self.json = body
+        self.headers = headers or {}
+        self.ip = ip
+
+
+@pytest.mark.parametrize('limiterClass', [TokenBucketLimiter, SharedTokenBucketLimiter])
+def test_bucket_allows_a_burst_then_the_rate(limiterClass):
+    limiter = limiterClass(rate=2, burst=3)
+
+    burst = [limiter.allow('client', now=0) for _ in range(4)]
+    refilled = [limiter.allow('client', now=0.5) for _ in range(2)]
+
+    assert burst == [True, True, True, False]
+    assert refilled == [True, False]
+    assert limiter.allow('other', now=0.5)
+
+
+def test_full_idle_buckets_are_evicted():
+    limiter = TokenBucketLimiter(rate=1, burst=2, maxKeys=10)
+    for key in range(10):
+        limiter.allow(key, now=0)
+
+    limiter.allow('late', now=5)
+
+    assert limiter.stats()['keys'] == 1
+
+
+def test_busy_buckets_are_kept_up_to_max_keys():
+    limiter = TokenBucketLimiter(rate=1, burst=2, maxKeys=2)
+    limiter.allow('first', now=0)
+    limiter.allow('second', now=0)
+
+    limiter.allow('third', now=0)
+
+    assert limiter.stats()['keys'] == 2
+
+
+def test_rate_limiter_limits_per_client_and_per_user():
+    rateLimiter = RateLimiter(
+        clientLimiter=TokenBucketLimiter(rate=0.001, burst=2),
+        userLimiter=TokenBucketLimiter(rate=0.001, burst=1))
+
+    sameCard = [rateLimiter.allow(FakeRequest({'payment': {'card': 1234}}, {'X-API-Key': 'a'}))
+        for _ in range(2)]
+    otherCard = rateLimiter.allow(FakeRequest({'payment': {'card': 5678}}, {'X-API-Key': 'a'}))
+    otherClient = rateLimiter.allow(FakeRequest({'payment': {'card': 1234}}, {'X-API-Key': 'b'}))
+
+    assert sameCard == [True, False]
+    # the client used up its burst of 2
+    assert otherCard is False
+    # the card is limited whichever client it comes through
+    assert otherClient is False
+
+
+def test_user_key_can_be_a_header():
+    rateLimiter = RateLimiter(userLimiter=TokenBucketLimiter(rate=0.001, burst=1), userKey='header:X-User')
+
+    assert rateLimiter.allow(FakeRequest(headers={'X-User': 'someone'}))
+    assert not rateLimiter.allow(FakeRequest(headers={'X-User': 'someone'}))
+    assert rateLimiter.allow(FakeRequest())
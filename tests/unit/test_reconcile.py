@@ -0,0 +1,226 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+from orders.domain.transaction import (
+    Transaction, TRANSACTION_PENDING, TRANSACTION_ALERT_ERROR, TRANSACTION_ALERT_DONE,
+    TRANSACTION_PAYMENT_ERROR, TRANSACTION_PAYMENT_COMPLETE
+)
+from orders.reconcile import Reconciler, SQLiteReconciliationLedger
+from orders.usecases.deadline import DeadlineExceeded
+from tests.unit.fakes import (
+    FakeAlertSender, FakeFraudChecker, FakeLedger, FakePaymentProcessor, FakeRepository,
+    newProcessor, newRequest
+)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = SQLiteReconciliationLedger(str(tmp_path / 'ledger.db'))
+    ledger.setup()
+    yield ledger
+    ledger.close()
+
+
+def newTransaction(status):
+    transaction = Transaction({'id': 1, 'cost': 10.0}, 'paytm', {'card': 1234, 'amount': 10.0})
+    transaction.updateStatus(status)
+    return Transaction.fromDict(transaction.toDict()['Transaction'])
+
+
+class ExpiringDeadline(object):
+    """A deadline which expires once the transaction is first saved."""
+
+    expired = False
+
+    def remaining(self):
+        return 0.0 if self.expired else 1.0
+
+
+class ExpiringRepository(FakeRepository):
+
+    def __init__(self, deadline):
+        super().__init__()
+        self.deadline = deadline
+
+    async def store(self, transaction):
+        await super().store(transaction)
+        self.deadline.expired = True
+
+
+def reconcile(ledger, processor):
+    reconciler = Reconciler(ledger, processor, staleAfter=0, retryDelay=0)
+    claimed = asyncio.run(reconciler.reconcileOnce())
+    return claimed, reconciler.stats()
+
+
+def test_failed_fraud_check_is_not_tracked():
+    ledger = FakeLedger()
+    processor = newProcessor(fraudChecker=FakeFraudChecker(error=ConnectionError()), ledger=ledger)
+
+    transaction = asyncio.run(processor.process(newRequest()))
+
+    assert transaction.status == TRANSACTION_PENDING
+    assert ledger.tracked == {}
+
+
+def test_pending_transaction_is_checked_for_fraud_before_it_is_paid(ledger):
+    asyncio.run(ledger.track(newTransaction(TRANSACTION_PENDING)))
+    fraudChecker = FakeFraudChecker()
+    paymentProcessor = FakePaymentProcessor()
+    processor = newProcessor(fraudChecker=fraudChecker, paymentProcessor=paymentProcessor, ledger=ledger)
+
+    claimed, stats = reconcile(ledger, processor)
+
+    assert claimed == 1
+    assert len(fraudChecker.checked) == 1
+    assert len(paymentProcessor.paid) == 1
+    assert stats['pending'] == {}
+
+
+def test_pending_transaction_found_fraudulent_is_alerted_not_paid(ledger):
+    transaction = newTransaction(TRANSACTION_PENDING)
+    asyncio.run(ledger.track(transaction))
+    repository = FakeRepository()
+    alerter = FakeAlertSender()
+    paymentProcessor = FakePaymentProcessor()
+    processor = newProcessor(
+        repository=repository, fraudChecker=FakeFraudChecker(fraud=True), alerter=alerter,
+        paymentProcessor=paymentProcessor, ledger=ledger)
+
+    claimed, stats = reconcile(ledger, processor)
+
+    assert paymentProcessor.paid == []
+    assert alerter.sent == [transaction.transactionID]
+    assert repository.saved[transaction.transactionID] == [TRANSACTION_ALERT_DONE]
+    assert stats['pending'] == {}
+
+
+def test_pending_transaction_is_not_paid_without_a_fraud_verdict(ledger):
+    asyncio.run(ledger.track(newTransaction(TRANSACTION_PENDING)))
+    paymentProcessor = FakePaymentProcessor()
+    processor = newProcessor(
+        fraudChecker=FakeFraudChecker(error=ConnectionError()), paymentProcessor=paymentProcessor,
+        ledger=ledger)
+
+    claimed, stats = reconcile(ledger, processor)
+
+    assert paymentProcessor.paid == []
+    assert stats['failed'] == 1
+    assert stats['pending'] == {'TRANSACTION_PENDING': 1}
+
+
+def test_payment_failed_after_it_was_started_is_left_for_manual_handling(ledger):
+    paymentProcessor = FakePaymentProcessor(error=ConnectionError())
+    processor = newProcessor(paymentProcessor=paymentProcessor, ledger=ledger)
+    transaction = asyncio.run(processor.process(newRequest()))
+    paymentProcessor.error = None
+
+    claimed, stats = reconcile(ledger, processor)
+
+    assert transaction.status == TRANSACTION_PAYMENT_ERROR
+    assert claimed == 0
+    assert paymentProcessor.paid == []
+    assert ledger.manual() == [transaction.transactionID]
+    assert stats['manual'] == 1
+
+
+def test_payment_failed_before_it_was_started_is_paid_again(ledger):
+    paymentProcessor = FakePaymentProcessor(factoryError=ValueError("unknown payment method"))
+    processor = newProcessor(paymentProcessor=paymentProcessor, ledger=ledger)
+    transaction = asyncio.run(processor.process(newRequest()))
+    paymentProcessor.factoryError = None
+
+    claimed, stats = reconcile(ledger, processor)
+
+    assert transaction.status == TRANSACTION_PAYMENT_ERROR
+    assert claimed == 1
+    assert len(paymentProcessor.paid) == 1
+    assert stats['pending'] == {}
+
+
+def test_failed_alert_is_tracked_and_sent_again(ledger):
+    alerter = FakeAlertSender(error=ConnectionError())
+    processor = newProcessor(fraudChecker=FakeFraudChecker(fraud=True), alerter=alerter, ledger=ledger)
+    transaction = asyncio.run(processor.process(newRequest()))
+    alerter.error = None
+
+    claimed, stats = reconcile(ledger, processor)
+
+    assert transaction.status == TRANSACTION_ALERT_ERROR
+    assert alerter.sent == [transaction.transactionID]
+    assert stats['pending'] == {}
+
+
+@pytest.mark.parametrize('status', [TRANSACTION_ALERT_DONE, TRANSACTION_PAYMENT_COMPLETE])
+def test_terminal_transaction_left_in_the_ledger_is_only_saved(ledger, status):
+    transaction = newTransaction(status)
+    asyncio.run(ledger.retryLater(transaction, 0))
+    repository = FakeRepository()
+    paymentProcessor = FakePaymentProcessor()
+    alerter = FakeAlertSender()
+    processor = newProcessor(
+        repository=repository, alerter=alerter, paymentProcessor=paymentProcessor, ledger=ledger)
+
+    claimed, stats = reconcile(ledger, processor)
+
+    assert claimed == 1
+    assert repository.saved[transaction.transactionID] == [status]
+    assert paymentProcessor.paid == [] and alerter.sent == []
+    assert stats['pending'] == {}
+
+
+def test_transaction_abandoned_before_payment_is_never_paid(ledger):
+    deadline = ExpiringDeadline()
+    paymentProcessor = FakePaymentProcessor()
+    processor = newProcessor(
+        repository=ExpiringRepository(deadline), paymentProcessor=paymentProcessor, ledger=ledger)
+    request = newRequest()
+    request.deadline = deadline
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(processor.process(request))
+    claimed, stats = reconcile(ledger, processor)
+
+    assert claimed == 0
+    assert paymentProcessor.paid == []
+    assert stats['pending'] == {}
+
+
+def test_transactions_sharing_an_id_are_tracked_apart(ledger):
+    first = newTransaction(TRANSACTION_PENDING)
+    second = newTransaction(TRANSACTION_PAYMENT_ERROR)
+    second.transactionID = first.transactionID
+
+    async def track():
+        await ledger.track(first)
+        await ledger.track(second)
+        first.updateStatus(TRANSACTION_PAYMENT_COMPLETE)
+        await ledger.track(first)
+
+    asyncio.run(track())
+
+    assert ledger.pending() == {'TRANSACTION_PAYMENT_ERROR': 1}
+
+
+def test_ledger_keyed_on_the_transaction_id_is_migrated(tmp_path):
+    path = str(tmp_path / 'ledger.db')
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE ledger (transactionID INTEGER PRIMARY KEY, status INTEGER NOT NULL, '
+        'updatedAt REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+        'leasedUntil REAL NOT NULL DEFAULT 0, transactionData TEXT NOT NULL)')
+    transaction = newTransaction(TRANSACTION_PENDING)
+    conn.execute('INSERT INTO ledger (transactionID, status, updatedAt, transactionData) VALUES (?, ?, 0, ?)',
+        (transaction.transactionID, TRANSACTION_PENDING, json.dumps(transaction.toDict()['Transaction'])))
+    conn.commit()
+    conn.close()
+    ledger = SQLiteReconciliationLedger(path)
+    ledger.setup()
+
+    batch = asyncio.run(ledger.claim(0, 10, 10))
+    ledger.close()
+
+    assert [(t.transactionID, attempts) for t, attempts in batch] == [(transaction.transactionID, 1)]
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from orders.retry import RetryBudget, RetryPolicy
+from orders.usecases.deadline import Deadline, deadlineScope
+
+
+class FlakyCall(object):
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("dependency is down")
+        return 'done'
+
+
+def test_retryable_error_is_retried_up_to_max_attempts():
+    policy = RetryPolicy('dependency', maxAttempts=3, baseDelay=0)
+    call = FlakyCall(failures=2)
+
+    assert asyncio.run(policy.call(call)) == 'done'
+    assert call.calls == 3
+    assert policy.stats()['retriedSuccesses'] == 1
+
+
+def test_other_errors_are_not_retried():
+    policy = RetryPolicy('dependency', retryableErrors=(ConnectionRefusedError,), baseDelay=0)
+    call = FlakyCall(failures=1)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(policy.call(call))
+    assert call.calls == 1
+
+
+def test_budget_caps_the_retries_to_a_ratio_of_the_calls():
+    budget = RetryBudget(ratio=0.1, maxTokens=2)
+    policy = RetryPolicy('dependency', maxAttempts=2, baseDelay=0, budget=budget)
+
+    async def run():
+        for _ in range(10):
+            with pytest.raises(ConnectionError):
+                await policy.call(FlakyCall(failures=10))
+
+    asyncio.run(run())
+
+    stats = policy.stats()
+    # the 2 saved up tokens, the 0.1 deposited per call is not a whole retry yet
+    assert stats['retriesAttempted'] == 2
+    assert stats['retriesSuppressed'] == 8
+
+
+def test_retry_is_not_started_past_the_deadline():
+    policy = RetryPolicy('dependency', maxAttempts=3, baseDelay=1.0, maxDelay=1.0)
+    call = FlakyCall(failures=1)
+
+    async def run():
+        with deadlineScope(Deadline(0)):
+            await policy.call(call)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    assert call.calls == 1
+    assert policy.stats()['retriesPastDeadline'] == 1
+    assert policy.stats()['budgetTokens'] == 10
@@ -0,0 +1,68 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from orders.simulation import (
+    CapacitySimulation, Constant, Histogram, LogNormal, VirtualTimeEventLoop, latencyFromConfig
+)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(len(values) * p)]
+
+
+def test_lognormal_fitted_from_percentiles_has_them():
+    rng = random.Random(1)
+    latency = LogNormal.fromPercentiles(p50=0.05, p99=0.8)
+
+    samples = [latency.sample(rng) for _ in range(50000)]
+
+    assert percentile(samples, 0.5) == pytest.approx(0.05, rel=0.05)
+    assert percentile(samples, 0.99) == pytest.approx(0.8, rel=0.1)
+
+
+def test_histogram_samples_its_buckets_by_their_counts():
+    rng = random.Random(1)
+    latency = Histogram(bounds=[0, 0.01, 0.1], counts=[900, 100])
+
+    samples = [latency.sample(rng) for _ in range(10000)]
+
+    assert all(0 <= sample <= 0.1 for sample in samples)
+    assert sum(sample < 0.01 for sample in samples) / len(samples) == pytest.approx(0.9, abs=0.02)
+
+
+def test_latency_config_is_validated():
+    assert isinstance(latencyFromConfig({'type': 'constant', 'value': 0.1}), Constant)
+    with pytest.raises(ValueError):
+        latencyFromConfig({'type': 'pareto'})
+    with pytest.raises(ValueError):
+        latencyFromConfig({'type': 'histogram', 'bounds': [0, 1], 'counts': [1, 2]})
+
+
+def test_virtual_time_loop_does_not_wait():
+    loop = VirtualTimeEventLoop()
+    start = time.perf_counter()
+    try:
+        loop.run_until_complete(asyncio.sleep(3600))
+        virtualTime = loop.time()
+    finally:
+        loop.close()
+
+    assert virtualTime == pytest.approx(3600)
+    assert time.perf_counter() - start < 1
+
+
+def test_simulation_latency_is_the_sum_of_the_dependencies_without_queueing():
+    latencies = {name: Constant(0.01) for name in ('fraudChecker', 'alertSender', 'paymentProcessor')}
+    latencies['repository'] = Constant(0.02)
+    simulation = CapacitySimulation(concurrency=1000, latencies=latencies, fraudRate=0, seed=1)
+
+    report = simulation.run(transactions=200, rate=100)
+
+    assert report['completed'] == 200
+    assert report['rejected'] == 0
+    # fraud check, save, payment, save
+    assert report['latency']['p99'] == pytest.approx(0.06)
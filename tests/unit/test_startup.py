@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import pytest
+
+from orders.startup import StartupReport
+
+
+def test_concurrent_steps_are_timed_separately():
+    report = StartupReport()
+
+    async def warmUp():
+        await asyncio.gather(
+            report.timed('cache', asyncio.sleep(0.05)),
+            report.timed('broker', asyncio.sleep(0.05))
+        )
+
+    asyncio.run(warmUp())
+    report.measure('model', time.sleep, 0.01)
+    report.done()
+
+    result = report.toDict()
+    assert report.isDone
+    assert list(result['stepsMs']) == ['cache', 'broker', 'model']
+    assert result['stepsMs']['cache'] >= 50
+    # the steps ran concurrently, so the total is less than their sum
+    assert result['totalMs'] < sum(result['stepsMs'].values())
+
+
+def test_failed_step_is_timed_too():
+    report = StartupReport()
+
+    async def failingStep():
+        raise ConnectionError("broker is down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(report.timed('broker', failingStep()))
+
+    assert 'broker' in report.toDict()['stepsMs']
+    assert not report.isDone
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from orders.domain.transaction import (
+    TRANSACTION_PENDING, TRANSACTION_PAYMENT_COMPLETE, TRANSACTION_PAYMENT_ERROR
+)
+from orders.usecases.deadline import Deadline, DeadlineExceeded
+from tests.unit.fakes import FakePaymentProcessor, FakeRepository, newProcessor, newRequest
+
+
+def test_payment_started_in_time_is_not_cut_short_by_the_deadline():
+    repository = FakeRepository()
+    paymentProcessor = FakePaymentProcessor(delay=0.05)
+    processor = newProcessor(repository=repository, paymentProcessor=paymentProcessor)
+
+    transaction = asyncio.run(processor.process(newRequest(Deadline(0.01))))
+
+    assert transaction.status == TRANSACTION_PAYMENT_COMPLETE
+    assert len(paymentProcessor.paid) == 1
+    assert repository.saved[transaction.transactionID] == [
+        TRANSACTION_PENDING, TRANSACTION_PAYMENT_COMPLETE]
+
+
+def test_failed_payment_is_saved():
+    repository = FakeRepository()
+    processor = newProcessor(
+        repository=repository, paymentProcessor=FakePaymentProcessor(error=ConnectionError()))
+
+    transaction = asyncio.run(processor.process(newRequest()))
+
+    assert transaction.status == TRANSACTION_PAYMENT_ERROR
+    assert repository.saved[transaction.transactionID] == [
+        TRANSACTION_PENDING, TRANSACTION_PAYMENT_ERROR]
+
+
+def test_payment_is_not_started_past_the_deadline():
+    paymentProcessor = FakePaymentProcessor()
+    processor = newProcessor(paymentProcessor=paymentProcessor)
+
+    async def scenario():
+        deadline = Deadline(0.001)
+        await asyncio.sleep(0.01)
+        return await processor.process(newRequest(deadline))
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+    assert paymentProcessor.paid == []
@@ -0,0 +1,40 @@
+from orders.domain.transaction import (
+    Transaction, TRANSACTION_PENDING, TRANSACTION_PAYMENT_INITIATED,
+    TRANSACTION_PAYMENT_COMPLETE
+)
+
+
+def newTransaction():
+    return Transaction({'id': 1, 'cost': 10.0}, 'paytm', {'card': 1234, 'amount': 10.0})
+
+
+def test_timeline_records_every_status_transition_in_order():
+    transaction = newTransaction()
+    transaction.updateStatus(TRANSACTION_PAYMENT_INITIATED)
+    transaction.updateStatus(TRANSACTION_PAYMENT_COMPLETE)
+
+    timeline = transaction.timeline
+    assert [status for status, _ in timeline] == [
+        TRANSACTION_PENDING, TRANSACTION_PAYMENT_INITIATED, TRANSACTION_PAYMENT_COMPLETE]
+    assert timeline[0][1] == 0
+    assert timeline[1][1] <= timeline[2][1]
+    assert transaction.toDict()['Transaction']['timeline'] == timeline
+
+
+def test_payment_started_once_the_payment_is_initiated():
+    transaction = newTransaction()
+    assert not transaction.paymentStarted
+
+    transaction.updateStatus(TRANSACTION_PAYMENT_INITIATED)
+    assert transaction.paymentStarted
+
+
+def test_rebuilt_transaction_starts_its_timeline_over_from_its_status():
+    transaction = newTransaction()
+    transaction.updateStatus(TRANSACTION_PAYMENT_INITIATED)
+
+    rebuilt = Transaction.fromDict(transaction.toDict()['Transaction'])
+
+    assert rebuilt.transactionID == transaction.transactionID
+    assert rebuilt.timeline == [[TRANSACTION_PAYMENT_INITIATED, 0]]
+    assert rebuilt.paymentStarted
@@ -0,0 +1,28 @@
+from orders.usecases.transact import (
+    TransactionRequest, TransactionValidator, validateTransactionRequest
+)
+
+
+BODY = {
+    'order': {'id': 1234, 'name': 'some book', 'cost': 123.00, 'currency': 'INR'},
+    'paymentMethod': 'amazonpay',
+    'payment': {'card': 1234567887654321, 'type': 'wallet', 'amount': 123.00, 'currency': 'INR'}
+}
+
+
+def test_payment_amount_is_optional():
+    body = dict(BODY, payment={'card': 1234567887654321, 'type': 'wallet'})
+    assert validateTransactionRequest(body) == []
+
+
+def test_invalid_body_is_rejected():
+    body = dict(BODY, paymentMethod='')
+    assert validateTransactionRequest(body)
+    assert not TransactionValidator().validate(
+        TransactionRequest(body['order'], body['paymentMethod'], body['payment']))
+
+
+def test_validated_request_is_trusted():
+    # a request built out of a validated body is not validated again
+    transReq = TransactionRequest(None, None, None, validated=True)
+    assert TransactionValidator().validate(transReq)